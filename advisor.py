@@ -1,57 +1,182 @@
-from llmproxy import generate
-from utils.uploads import handbook_upload, handbook_txt_upload
-from prompt import get_system_prompt, get_escalated_response
-import time
+from llmproxy import generate, agenerate
+from utils.uploads import get_session_id, start_handbook_ingestion, wait_for_handbooks, READY_TIMEOUT
+from utils.corpus import is_shared_corpus_enabled, get_corpus_session_id
+from utils.retrieval import is_local_retrieval_enabled, search, format_chunks
+from utils.catalog import is_course_catalog_enabled, get_catalog, format_courses
+from prompt import get_system_prompt, get_escalated_response, get_conversation_context, record_prompt_size
+from utils.history import is_local_history_enabled
+from utils.answer_cache import get_or_generate, aget_or_generate
+from utils import metrics
+from utils import resilience
+from utils.log_config import log_payload
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+def with_local_context(system_prompt, query, exclude_sources=()):
+    """
+    Append handbook excerpts from the local retrieval index to the system prompt.
+    """
+    with metrics.span("advisor.retrieval"):
+        chunks = search(query, k=10 if exclude_sources else 5)
+    chunks = [chunk for chunk in chunks if chunk["source"] not in exclude_sources][:5]
+    return system_prompt + "\n## PROVIDED RESOURCES (retrieved excerpts)\n\n" + format_chunks(chunks)
+
+def with_catalog_context(system_prompt, courses):
+    """
+    Append the catalog entries of the courses named in the question to the system prompt.
+    """
+    return system_prompt + "\n## COURSE CATALOG ENTRIES\n\n" + format_courses(courses) + "\n"
+
+class LLMUnavailable(Exception):
+    """
+    The LLM proxy call failed, timed out, ran out of request deadline or was refused
+    by the open circuit breaker; the message is generate()'s error string.
+    """
 
 class TuftsCSAdvisor:
-    def __init__(self, user_profile):
+    def __init__(self, user_profile, history=None):
         self.user_profile = user_profile
         self.user_id = user_profile["user_id"]
-        self.last_k = user_profile["last_k"]
-        if user_profile["last_k"] == 0:
-            handbook_upload(self.user_id)
-            # handbook_txt_upload(self.user_id)
-            time.sleep(2)
 
-    def get_escalated_response(self, query):
-        rag_response = generate(
+        # with local history the prompt carries a rolling summary plus the recent turns
+        # (see utils/history.py) and the proxy's server-side history is not used
+        self.history = history
+        self.last_k = 0 if is_local_history_enabled() else user_profile["last_k"]
+        self.session_id = get_session_id(self.user_id)
+
+        # with a shared corpus, handbooks are ingested once at startup (see utils/corpus.py)
+        # and the per-user session only carries conversation history
+        self.rag_session_id = get_corpus_session_id() if is_shared_corpus_enabled() else None
+
+        # with local retrieval, excerpts go into the prompt and the proxy's RAG is not used
+        self.local_retrieval = is_local_retrieval_enabled()
+
+        # courses named in the question get their parsed catalog entries (see utils/catalog.py)
+        self.course_catalog = is_course_catalog_enabled()
+
+        # otherwise the handbooks live in the per-user session: ingest them in the background
+        # (a no-op once the session is ready) and wait for readiness only right before generating
+        self.needs_handbooks = not self.rag_session_id and not self.local_retrieval
+        if self.needs_handbooks:
+            start_handbook_ingestion(self.user_id)
+
+    def _with_context(self, system, query):
+        courses = []
+        if self.course_catalog:
+            with metrics.span("advisor.catalog"):
+                courses = get_catalog().find_courses(query)
+        if courses:
+            system = with_catalog_context(system, courses)
+        if self.local_retrieval:
+            # the catalog entries stand in for excerpts of the course descriptions
+            system = with_local_context(system, query, exclude_sources=("courses.txt",) if courses else ())
+        return system
+
+    def _wait_for_handbooks(self):
+        if not self.needs_handbooks:
+            return
+        with metrics.span("advisor.wait_handbooks"):
+            # the wait comes out of the request's deadline, like the LLM call after it
+            status = wait_for_handbooks(self.user_id, timeout=resilience.budget(READY_TIMEOUT))
+        if status != "ready":
+            logger.warning(f"handbooks for {self.session_id} are {status}, answering without waiting further")
+
+    @staticmethod
+    def _response_text(rag_response):
+        if isinstance(rag_response, dict) and 'response' in rag_response:
+            return rag_response['response']
+        # generate() reports failures as a string
+        raise LLMUnavailable(rag_response)
+
+    def _escalated_request(self, query):
+        """
+        Build the generate() arguments for an escalation draft: prompt, local context
+        and, without a shared corpus, the wait for the handbooks of the user's session.
+        """
+        with metrics.span("advisor.prompt"):
+            system = get_escalated_response(self.user_profile) + get_conversation_context(self.history)
+        system = self._with_context(system, query)
+        record_prompt_size("escalation", system, query)
+        self._wait_for_handbooks()
+
+        return dict(
             model='4o-mini',
-            system=get_escalated_response(self.user_profile),
+            system=system,
             query=query,
             temperature=0.1,
             lastk=0,
-            session_id='cs-advising-handbooks-v5-' + self.user_id,      # prev v5
-            rag_usage=True,
+            session_id=self.session_id,
+            rag_usage=not self.local_retrieval,
             rag_threshold=0.5,  # Lower threshold
-            rag_k=5  # Retrieve more documents
+            rag_k=5,  # Retrieve more documents
+            rag_session_id=self.rag_session_id
         )
 
-        if isinstance(rag_response, dict) and 'response' in rag_response:
-            return rag_response['response']
-        
-        return rag_response
+    @metrics.timed("advisor.escalated_response")
+    def get_escalated_response(self, query):
+        request = self._escalated_request(query)
+        with metrics.span("llm.generate"):
+            rag_response = generate(**request)
+        return self._response_text(rag_response)
 
+    async def aget_escalated_response(self, query):
+        """
+        get_escalated_response() for the asyncio serving mode: the prompt is built on
+        a worker thread and the LLM call is awaited on the async HTTP client.
+        """
+        with metrics.span("advisor.escalated_response"):
+            request = await asyncio.to_thread(self._escalated_request, query)
+            with metrics.span("llm.generate"):
+                rag_response = await agenerate(**request)
+            return self._response_text(rag_response)
 
+    @metrics.timed("advisor.faq_response")
     def get_faq_response(self, faq_formatted, query):
-        print(f"user {self.user_id} has lastk {self.last_k}")
-        print("user_profile: ", self.user_profile)
+        # identical general questions share one LLM call and a cached answer (see utils/answer_cache.py)
+        return get_or_generate(query, lambda: self._generate_faq_response(faq_formatted, query), self.user_profile)
 
-        rag_response = generate(
+    async def aget_faq_response(self, faq_formatted, query):
+        with metrics.span("advisor.faq_response"):
+            return await aget_or_generate(query, lambda: self._agenerate_faq_response(faq_formatted, query), self.user_profile)
+
+    def _faq_request(self, faq_formatted, query):
+        logger.debug("user %s has lastk %s", self.user_id, self.last_k)
+        log_payload(logger, "user_profile", self.user_profile)
+
+        with metrics.span("advisor.prompt"):
+            system = get_system_prompt(self.user_profile) + get_conversation_context(self.history)
+        system = self._with_context(system, query)
+        record_prompt_size("faq", system, query)
+        self._wait_for_handbooks()
+
+        return dict(
             model='4o-mini',
-            system=get_system_prompt(self.user_profile),
+            system=system,
             query=query,
             temperature=0.1,
             lastk=self.last_k,
-            session_id='cs-advising-handbooks-v5-' + self.user_id,      # prev v5
-            rag_usage=True,
+            session_id=self.session_id,
+            rag_usage=not self.local_retrieval,
             rag_threshold=0.5,  # Lower threshold
-            rag_k=5  # Retrieve more documents
+            rag_k=5,  # Retrieve more documents
+            rag_session_id=self.rag_session_id
         )
 
-        print("\nResponse:", rag_response.get('response') if isinstance(rag_response, dict) else rag_response)
-        print("\nRAG Context:", rag_response.get('rag_context') if isinstance(rag_response, dict) else "No context available")
+    def _faq_response_text(self, rag_response):
+        if isinstance(rag_response, dict):
+            log_payload(logger, "LLM response and RAG context", rag_response)
+        return self._response_text(rag_response)
 
-        if isinstance(rag_response, dict) and 'response' in rag_response:
-            return rag_response['response']
-        
-        return rag_response
\ No newline at end of file
+    def _generate_faq_response(self, faq_formatted, query):
+        request = self._faq_request(faq_formatted, query)
+        with metrics.span("llm.generate"):
+            rag_response = generate(**request)
+        return self._faq_response_text(rag_response)
+
+    async def _agenerate_faq_response(self, faq_formatted, query):
+        request = await asyncio.to_thread(self._faq_request, faq_formatted, query)
+        with metrics.span("llm.generate"):
+            rag_response = await agenerate(**request)
+        return self._faq_response_text(rag_response)
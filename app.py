@@ -1,21 +1,39 @@
+# imported first, so the timing of app.py's import covers all of the imports below
+from utils import startup
+
 # Standard library imports
-import os
 import json
+import asyncio
 import logging
-import traceback
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 
 # Third-party imports
-import requests
-import pymongo
 from bson.objectid import ObjectId
-from flask import Flask, request, jsonify, redirect, render_template
-from dotenv import load_dotenv
+from flask import Flask, request, jsonify, redirect, render_template, Response
 
 # Local application imports
-from advisor import TuftsCSAdvisor
-from utils.mongo_config import get_collection, get_mongodb_connection
-from utils.log_config import setup_logging
-from utils.emails import send_notification_email
+from advisor import TuftsCSAdvisor, LLMUnavailable
+from utils.config import config
+from utils.mongo_config import get_collection, get_mongodb_connection, start_index_creation, start_round_trip_count, get_round_trip_count
+from utils.log_config import setup_logging, log_payload
+from utils.emails import send_notification_email, start_email_outbox, outbox
+from utils.corpus import start_corpus_ingestion
+from utils.retrieval import is_local_retrieval_enabled, get_index
+from utils.catalog import is_course_catalog_enabled, get_catalog
+from utils.audit import AUDIT_FAST_PATH, get_audit, is_progress_question, format_audit_answer
+from utils.jobs import JobQueue, is_async_mode
+from utils import http_client
+from utils import metrics
+from utils import resilience
+from utils.faq_index import faq_index
+from utils.preclassifier import preclassifier
+from utils.rocketchat import RocketChatDispatcher
+from utils.history import is_local_history_enabled, get_history, record_exchange
+from utils.idempotency import deliveries, TransientResult
+from utils.answer_cache import answer_cache_stats
+from utils.store import get_profile, get_pending_escalation, update_profile, update_profile_async, get_thread_mapping, add_thread_mappings, cache_stats
+from prompt import get_fixed_response, prompt_stats, render_form_url
 
 app = Flask(__name__)
 
@@ -23,22 +41,70 @@ app = Flask(__name__)
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# Load environment variables from .env file
-load_dotenv()
-BASE_URL = os.environ.get("koyeb_url", "https://shy-moyna-wendanj-b5959963.koyeb.app")
+BASE_URL = config.get("koyeb_url", "https://shy-moyna-wendanj-b5959963.koyeb.app")
 
 # global variables
-RC_BASE_URL = "https://chat.genaiconnect.net/api/v1"
+RC_BASE_URL = config.get("rc_base_url", "https://chat.genaiconnect.net/api/v1")
 
 
 HEADERS = {
     "Content-Type": "application/json",
-    "X-Auth-Token": os.environ.get("RC_token"),
-    "X-User-Id": os.environ.get("RC_userId")
+    "X-Auth-Token": config.get("RC_token"),
+    "X-User-Id": config.get("RC_userId")
 }
 
 HUMAN_OPERATOR = "@wendan.jiang" 
 
+# sent right away when the LLM proxy is down (circuit breaker open) or too slow for the request deadline
+DEGRADED_RESPONSE = (":kirby_sleep: The advising assistant is having trouble reaching its language model right now. "
+                     "Please try again in a minute, or connect with a human advisor.")
+
+# all RocketChat API writes go through per-room, rate-limited queues
+rocketchat = RocketChatDispatcher(RC_BASE_URL, HEADERS)
+
+# runs I/O that does not block the rest of a /query (loading message, profile writes)
+query_io = ThreadPoolExecutor(max_workers=config.get_int("query_io_workers", 16), thread_name_prefix="query-io")
+
+# make sure the indexes used on the request path exist; this also opens the MongoDB
+# connection, in the background, so a slow link does not delay the worker's boot
+start_index_creation()
+
+# send escalation emails left in the outbox by a previous process
+start_email_outbox()
+
+# ingest the shared handbook corpus once (no-op unless shared_corpus_enabled=true)
+start_corpus_ingestion()
+
+# build (or load) the local handbook retrieval index once per process
+if is_local_retrieval_enabled():
+    with startup.step("retrieval.index"):
+        get_index()
+
+# parse (or load) the course catalog once per process
+if is_course_catalog_enabled():
+    with startup.step("catalog"):
+        get_catalog()
+
+def in_background(fn, *args, **kwargs):
+    """
+    Run fn on the query I/O pool with the caller's context (metrics spans, MongoDB
+    round-trip counter) and return its Future.
+    """
+    return query_io.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def record_turn(user_id, message, answer):
+    """
+    Add an answered message to the student's conversation history (local history only).
+    Written before the reply is returned, so a quick follow-up always reads it.
+    """
+    if not is_local_history_enabled():
+        return
+    try:
+        with metrics.span("mongo.history_write"):
+            record_exchange(user_id, message, answer)
+    except Exception as e:
+        logger.error(f"Error recording conversation turn: {str(e)}")
+
 def is_json_object(json_string):
     try:
         parsed = json.loads(json_string)
@@ -48,6 +114,7 @@ def is_json_object(json_string):
     except json.JSONDecodeError:
         return None
 
+@metrics.timed("rc.send_to_human")
 def send_to_human(user, original_question, llm_answer=None, tmid=None, trigger_msg_id=None, uncertain_areas=None):
     """
     Sends a message to a human operator via RocketChat when AI escalation is needed.
@@ -109,12 +176,13 @@ def send_to_human(user, original_question, llm_answer=None, tmid=None, trigger_m
         }
         logger.info("forwarding to thread: " + tmid)
 
-    response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=payload, headers=HEADERS)
+    response = rocketchat.post_message(payload)
 
     logger.info("successfully forward message to human")
-    logger.info(f"DEBUG: RocketChat API Response: {response.status_code} - {response.text}")
+    logger.debug("RocketChat API response: %s - %s", response.status_code, response.text)
     return response.json()
 
+@metrics.timed("rc.human_response")
 def send_human_response(room_id, message, tmid):
     """
     Sends a response from a human operator back to the original user via RocketChat.
@@ -125,18 +193,19 @@ def send_human_response(room_id, message, tmid):
         "tmid": tmid
     }
 
-    response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=payload, headers=HEADERS)
-    logger.info(f"DEBUG: RocketChat API Response: {response.status_code} - {response.text}")
+    response = rocketchat.post_message(payload)
+    logger.debug("RocketChat API response: %s - %s", response.status_code, response.text)
     return response.json()
 
+@metrics.timed("rc.loading_message")
 def send_loading_response(room_id, loading_msg=" :everything_fine_parrot: Processing your inquiry. One moment please..."):
     payload = {
         "roomId": room_id,
         "text": loading_msg
     }
 
-    response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=payload, headers=HEADERS)
-    logger.info(f"DEBUG: RocketChat API Response: {response.status_code} - {response.text}")
+    response = rocketchat.post_message(payload)
+    logger.debug("RocketChat API response: %s - %s", response.status_code, response.text)
 
     if response.status_code == 200:
         json_res = response.json()
@@ -144,14 +213,14 @@ def send_loading_response(room_id, loading_msg=" :everything_fine_parrot: Proces
     else:
         raise Exception("fail to send loading message")
     
+@metrics.timed("rc.update_message")
 def update_loading_message(room_id, loading_msg_id, text=" :kirby_hi: Ta-da! Your answer is ready!"):
-    requests.post(f"{RC_BASE_URL}/chat.update",
-                  json={
-                      "roomId": room_id,
-                      "msgId": loading_msg_id,
-                      "text": text
-                  },
-                  headers=HEADERS)
+    # not awaited: it is queued ahead of any later message to the same room
+    return rocketchat.update_message({
+        "roomId": room_id,
+        "msgId": loading_msg_id,
+        "text": text
+    })
 
 def format_response_with_buttons(response_text, suggested_questions, category_id):
     question_buttons = []
@@ -239,14 +308,16 @@ def format_summary_confirmation(original_question, user_id):
         ]
     }
 
+@metrics.timed("escalation.threads")
 def build_bidirectional_threads(user, original_question, llm_answer, message_id, uncertain_areas):
     # Forward to human advisor and get the response
     forward_res = send_to_human(user, original_question)
 
     # message_id starts a new thread on human advisor side
     # send a thread message that contains AI-generated response
+    # the follow-up and the thread mapping only need the advisor message id: run them together
     advisor_messsage_id = forward_res["message"]["_id"]
-    send_to_human(user, original_question, llm_answer, trigger_msg_id=advisor_messsage_id, uncertain_areas=uncertain_areas)
+    follow_up = in_background(send_to_human, user, original_question, llm_answer, trigger_msg_id=advisor_messsage_id, uncertain_areas=uncertain_areas)
 
     # Create bidirectional thread mapping for ongoing conversation
     thread_item = [{
@@ -261,17 +332,294 @@ def build_bidirectional_threads(user, original_question, llm_answer, message_id,
         "forward_username": user
 
     }]
-    thread_collection = get_collection("Users", "threads")
-    thread_collection.insert_many(thread_item)
+    add_thread_mappings(thread_item)
+    follow_up.result()
+
+
+def post_query_result(data):
+    """
+    Job handler for async mode: runs the /query logic and posts the reply to the
+    student's channel through the RocketChat API instead of the webhook response.
+    """
+    # a redelivered message was (or is being) answered by its first job
+    response_data, _ = handle_query(data, replay=False)
+    if not response_data.get("text"):
+        return
+
+    response_data["roomId"] = data.get("channel_id")
+    with metrics.span("rc.post_message"):
+        response = rocketchat.post_message(response_data)
+    logger.debug("RocketChat API response: %s - %s", response.status_code, response.text)
+
+
+query_jobs = JobQueue(post_query_result)
+
+
+def dispatch_query(data):
+    """
+    Run a message through the /query pipeline in the background; a query worker
+    posts the answer to data["channel_id"]. Used by /query in async mode and by
+    /student-info, which would otherwise call back into /query over HTTP.
+    """
+    query_jobs.submit(data)
 
 
 @app.route('/query', methods=['POST'])
 def main():
     """
     Main endpoint for handling user queries to the Tufts CS Advisor.
+
+    In async mode (query_mode=async) the payload is validated and queued, and the
+    webhook is acknowledged right away; a worker posts the answer when it is ready.
+    """
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"text": "Invalid request"}), 400
+
+    if is_async_mode():
+        # Ignore bot messages without queueing them
+        if data.get("bot") or not data.get("text"):
+            return jsonify({"status": "ignored"})
+        dispatch_query(data)
+        return jsonify({"success": True}), 200
+
+    response_data, status = handle_query(data)
+    return jsonify(response_data), status
+
+
+@app.route('/queue-stats', methods=['GET'])
+def queue_stats():
+    """
+    Queue depth, wait time and worker utilisation of the /query job queue.
+    """
+    return jsonify(query_jobs.stats())
+
+
+@app.route('/faq-stats', methods=['GET'])
+def faq_stats():
+    """
+    Hit/miss ratio of the in-memory FAQ match index.
+    """
+    return jsonify(faq_index.stats())
+
+
+@app.route('/preclassifier-stats', methods=['GET'])
+def preclassifier_stats():
+    """
+    Fast-path counts and shadow-mode agreement of the local pre-classifier.
+    """
+    return jsonify(preclassifier.stats())
+
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats_view():
+    """
+    Hit rates and approximate memory use of the thread mapping and profile caches.
+    """
+    return jsonify(cache_stats())
+
+
+@app.route('/answer-cache-stats', methods=['GET'])
+def answer_cache_stats_view():
+    """
+    Hits, coalesced calls and size of the shared answer cache.
+    """
+    return jsonify(answer_cache_stats())
+
+
+@app.route('/prompt-stats', methods=['GET'])
+def prompt_stats_view():
+    """
+    Character and estimated token counts of the prompts sent to the LLM.
+    """
+    return jsonify(prompt_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_view():
+    """
+    Per-stage latency histograms in Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/email-stats', methods=['GET'])
+def email_stats():
+    """
+    Outbox depth and send counts of the escalation email sender.
+    """
+    return jsonify(outbox.stats())
+
+
+@app.route('/rocketchat-stats', methods=['GET'])
+def rocketchat_stats():
+    """
+    Queue depth and sent/retried/dropped/merged counters of the RocketChat dispatcher.
+    """
+    return jsonify(rocketchat.stats())
+
+
+@app.route('/idempotency-stats', methods=['GET'])
+def idempotency_stats():
+    """
+    Duplicate webhook deliveries detected and replayed by this process.
+    """
+    return jsonify(deliveries.stats())
+
+
+@app.route('/http-stats', methods=['GET'])
+def http_stats():
+    """
+    Per-host connection pool statistics of the outbound HTTP client.
+    """
+    return jsonify(http_client.pool_stats())
+
+
+@app.route('/resilience-stats', methods=['GET'])
+def resilience_stats_view():
+    """
+    LLM proxy circuit breakers, hedged requests and request deadlines.
+    """
+    return jsonify(resilience.resilience_stats())
+
+
+@app.route('/startup-stats', methods=['GET'])
+def startup_stats_view():
+    """
+    Import-time steps and first-request durations of this process.
+    """
+    return jsonify(startup.startup_stats())
+
+
+def handle_query(data, replay=True):
+    """
+    Process a RocketChat message for the Tufts CS Advisor, logging how many
+    MongoDB round trips it took.
+
+    A message_id that was already delivered is not processed again: with replay
+    the first delivery's response is returned, otherwise {"status": "duplicate"}.
+    The message is answered under the query_deadline budget (see utils/resilience.py).
+
+    Returns:
+        tuple: (response dict, HTTP status code)
+    """
+    start_round_trip_count()
+    try:
+        with metrics.request("query"), resilience.deadline():
+            if data.get("bot") or not data.get("text"):
+                message_id = None  # ignored anyway, no need to record it
+            else:
+                message_id = data.get("message_id")
+            response_data, status = deliveries.run(message_id, lambda: process_query(data), replay=replay)
+            if response_data.get("status") == "duplicate":
+                metrics.set_outcome("duplicate")
+            elif status >= 500:
+                metrics.set_outcome("error")
+            return response_data, status
+    finally:
+        logger.info(f"/query used {get_round_trip_count()} MongoDB round trips")
+
+
+async def handle_query_async(data, replay=True):
+    """
+    handle_query() for the asyncio serving mode (asgi.py).
+    """
+    start_round_trip_count()
+    try:
+        with metrics.request("query"), resilience.deadline():
+            if data.get("bot") or not data.get("text"):
+                message_id = None
+            else:
+                message_id = data.get("message_id")
+            response_data, status = await deliveries.arun(message_id, lambda: process_query_async(data), replay=replay)
+            if response_data.get("status") == "duplicate":
+                metrics.set_outcome("duplicate")
+            elif status >= 500:
+                metrics.set_outcome("error")
+            return response_data, status
+    finally:
+        logger.info(f"/query used {get_round_trip_count()} MongoDB round trips")
+
+
+async def post_query_result_async(data):
+    """
+    post_query_result() as an event-loop task, for async mode under asgi.py.
+    """
+    response_data, _ = await handle_query_async(data, replay=False)
+    if not response_data.get("text"):
+        return
+
+    response_data["roomId"] = data.get("channel_id")
+    with metrics.span("rc.post_message"):
+        response = await asyncio.to_thread(rocketchat.post_message, response_data)
+    logger.debug("RocketChat API response: %s - %s", response.status_code, response.text)
+
+
+class LLMCall:
+    """
+    An advisor LLM call yielded by query_steps(), made by whichever driver runs the
+    steps: a blocking call in process_query(), an awaited one in process_query_async().
+    """
+
+    def __init__(self, advisor, method, *args):
+        self.advisor = advisor
+        self.method = method
+        self.args = args
+
+    def run(self):
+        return getattr(self.advisor, self.method)(*self.args)
+
+    async def arun(self):
+        return await getattr(self.advisor, "a" + self.method)(*self.args)
+
+
+def process_query(data):
+    """
+    Run the /query logic, making its LLM calls on this thread.
+    """
+    steps = query_steps(data)
+    value, error = None, None
+    while True:
+        try:
+            call = steps.throw(error) if error else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            value, error = call.run(), None
+        except Exception as e:
+            value, error = None, e
+
+
+def _advance(steps, value, error):
+    # StopIteration cannot be raised through a Future, so the result is returned as a flag
+    try:
+        return False, steps.throw(error) if error else steps.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+async def process_query_async(data):
     """
-    data = request.get_json() 
+    Run the /query logic with its LLM calls awaited on the event loop. The steps in
+    between (MongoDB, RocketChat queues, FAQ matching) run on worker threads.
+    """
+    steps = query_steps(data)
+    value, error = None, None
+    while True:
+        done, result = await asyncio.to_thread(_advance, steps, value, error)
+        if done:
+            return result
+        try:
+            value, error = await result.arun(), None
+        except Exception as e:
+            value, error = None, e
+
 
+def query_steps(data):
+    """
+    The /query logic as a generator: it yields an LLMCall for every LLM request,
+    is sent the call's result, and returns (response dict, HTTP status code).
+    """
     # Extract relevant information
     user_id = data.get("user_id")
     user_name = data.get("user_name", "Unknown")
@@ -282,12 +630,13 @@ def main():
     channel_id = data.get("channel_id")
 
     # Log the incoming request
-    logger.info("hit /query endpoint, request data: %s", json.dumps(data, indent=2))
-    logger.info(f"{user_name} : {message}")
+    log_payload(logger, "hit /query endpoint, request data", data)
+    logger.info("%s : %s", user_name, message)
 
     # Ignore bot messages
     if data.get("bot") or not message:
-        return jsonify({"status": "ignored"})
+        metrics.set_outcome("ignored")
+        return {"status": "ignored"}, 200
     
     # Handle button message
     # parsed_msg = is_json_object(message)
@@ -312,61 +661,99 @@ def main():
     #         # logger.info("deleting button msg response: %s", json.dumps(response, indent=2))
     #         return jsonify({"success": True}), 200
     
+    loading = None
     try:
         # Get MongoDB client from the connection pool
         mongo_client = get_mongodb_connection()
         if not mongo_client:
-            return jsonify({"text": "Error connecting to database"}), 500
-        
-        user_collection = get_collection("Users", "user")
-        user_profile = user_collection.find_one({"user_id": user_id})
+            return {"text": "Error connecting to database"}, 500
         
+        history = None
+        if tmid:
+            # thread messages are forwarded as-is: no profile is created and last_k is not bumped
+            user_profile = get_profile(user_id)
+            if user_profile:
+                # the cached profile may be up to profile_cache_ttl old; the routing flag must not be
+                user_profile = {**user_profile, "pending_escalation": get_pending_escalation(user_id)}
+        else:
+            # the conversation history is read while the profile is upserted
+            if is_local_history_enabled():
+                history = in_background(get_history, user_id)
+
+            # ==== USER PROFILE MANAGEMENT ====
+            # Get or create the user profile and bump the interaction counter in one round trip
+            user_profile = update_profile(
+                user_id,
+                {
+                    "$setOnInsert": {
+                        "username": user_name,
+                        "transcript": {
+                            "program": "",
+                            "completed_courses": [],
+                            "credits_earned": "",
+                            "GPA": "",
+                            "domestic": ""
+                        }
+                    },
+                    "$inc": {"last_k": 1}
+                },
+                upsert=True
+            )
+            # the advisor works with the count before this message (0 for a new user);
+            # copy so the cached profile is left untouched
+            user_profile = {**user_profile, "last_k": user_profile["last_k"] - 1}
+
         # === QUESTION SUMMARY HANDLING ===
         if user_profile and user_profile.get("pending_escalation") is True:
-            _, loading_msg_id = send_loading_response(channel_id, loading_msg=" :everything_fine_parrot: Forwarding your request to a human advisor now...")
+            metrics.set_category("escalation")
+            # the loading message is posted while the LLM drafts the answer
+            loading = in_background(send_loading_response, channel_id, loading_msg=" :everything_fine_parrot: Forwarding your request to a human advisor now...")
 
-            advisor = TuftsCSAdvisor(user_profile)
-            response_data = advisor.get_escalated_response(message)
-            print("LINE 325")
-            print(response_data)
-            response_data = json.loads(response_data)
+            advisor = TuftsCSAdvisor(user_profile, history=history.result() if history else None)
+            response_data = yield LLMCall(advisor, "get_escalated_response", message)
+            _, loading_msg_id = loading.result()
+            logger.debug("escalated response: %s", response_data)
+            with metrics.span("llm.parse"):
+                response_data = json.loads(response_data)
 
             llm_answer = response_data.get("llmAnswer")
             uncertain_areas = response_data.get("uncertainAreas")
 
             # error handling
             if not llm_answer or not uncertain_areas:
-                user_collection.update_one(
-                    {"user_id": user_id},
+                update_profile(
+                    user_id,
                     {"$set": {"pending_escalation": False}}  # Set pending_escalation to True
                 )
                 update_loading_message(channel_id, loading_msg_id, "error processing your escalation request to human advisors, please try again")
-                return jsonify({"success": True}), 200
+                return {"success": True}, 200
 
             # Forward to human advisor and get the response
             build_bidirectional_threads(user_name, message, llm_answer, message_id, uncertain_areas)
+            record_turn(user_id, message, "(forwarded to a human advisor)")
 
-            # flip pending_escalation back to false
-            user_collection.update_one(
-                {"user_id": user_id},
+            # the loading-message update is queued without waiting, so it goes out
+            # while pending_escalation is flipped back to false
+            update_loading_message(channel_id, loading_msg_id, " :coll_doge_gif: Successfully forwarded your question to a human advisor. \n📬 To begin your conversation with a human advisor, please click the \"**View Thread**\" button.")
+            update_profile(
+                user_id,
                 {"$set": {"pending_escalation": False}}  # Set pending_escalation to True
             )
-            update_loading_message(channel_id, loading_msg_id, " :coll_doge_gif: Successfully forwarded your question to a human advisor. \n📬 To begin your conversation with a human advisor, please click the \"**View Thread**\" button.")
-            return jsonify({
+            return {
                 "text": "Connecting you with a human advisor now — their response will appear just below once it's ready!",
                 "tmid": message_id
-            })
+            }, 200
         
         # ==== THREAD MESSAGE HANDLING ====
         # If message is part of an existing thread, handle direct forwarding without LLM processing
         if tmid:
             logger.info("Processing thread message - direct forwarding without LLM processing")
-            thread_collection = get_collection("Users", "threads")
-            target_thread = thread_collection.find_one({"thread_id": tmid})
+            metrics.set_category("thread")
+            target_thread = get_thread_mapping(tmid)
 
             if not target_thread:
                 logger.error("thread with id %s does not exist", tmid)
-                return jsonify({"text": f"Error: unable to find a matched thread"}), 500
+                return {"text": f"Error: unable to find a matched thread"}, 500
             
             # Determine message direction (student to human advisor or vice versa)
             forward_human = target_thread.get("forward_human")
@@ -379,103 +766,77 @@ def main():
                 forward_thread_id = target_thread.get("forward_thread_id")
                 send_human_response(channel_id, message, forward_thread_id)
             
-            return jsonify({"success": True}), 200
+            return {"success": True}, 200
     
-        # ==== USER PROFILE MANAGEMENT ====
-        # Get or create user profile for tracking interactions
-        if not user_profile:
-            user_profile = {
-                "user_id": user_id,
-                "username": user_name,
-                "last_k": 0,
-                "transcript": {
-                    "program": "",
-                    "completed_courses": [],
-                    "credits_earned": "",
-                    "GPA": "",
-                    "domestic": ""
-                }
-            }
-            user_collection.insert_one(user_profile)
-
-        # Update the interaction counter for this user
-        lastk = user_profile.get("last_k", 0)
-        user_collection.update_one(
-                {"user_id": user_id},
-                {"$set": {"last_k": lastk + 1}}
-            )
+        # ==== LOCAL PRE-CLASSIFIER ====
+        # Greetings and out-of-scope messages get their fixed reply without an LLM
+        # round trip (preclassifier_mode=on)
+        with metrics.span("preclassifier"):
+            fast_category = preclassifier.fast_path(message)
+        metrics.set_category(fast_category)
+        if fast_category:
+            record_turn(user_id, message, get_fixed_response(fast_category))
+            return format_response_with_buttons(get_fixed_response(fast_category), [], fast_category), 200
+
+        # ==== FAQ MATCHING ====
+        # Answer from the stored FAQ without an LLM call when the question
+        # closely matches a freq_questions entry (token + character n-gram cosine)
+        with metrics.span("faq.match"):
+            faq_match = faq_index.match(message)
+        if faq_match:
+            metrics.set_category("faq")
+            logger.info(f"Found FAQ match {faq_match['question_id']} with score {faq_match['score']} - returning cached response")
+            record_turn(user_id, message, faq_match["answer"])
+            return format_response_with_buttons(faq_match["answer"], faq_match["suggestedQuestions"], "2"), 200
+
+        # ==== DEGREE AUDIT ====
+        # "Am I on track?" is answered from the locally computed audit of the saved
+        # transcript without an LLM call (degree_audit_fast_path=true)
+        if AUDIT_FAST_PATH and is_progress_question(message):
+            audit = get_audit(user_profile)
+            if audit:
+                metrics.set_category("audit")
+                logger.info("Answering a progress question from the degree audit")
+                answer = format_audit_answer(audit)
+                record_turn(user_id, message, answer)
+                return format_response_with_buttons(answer, [], "audit"), 200
 
         # Initialize the advisor with user profile data
-        advisor = TuftsCSAdvisor(user_profile)
-
-        # ==== FAQ MATCHING - EXACT MATCH ====
-        # Check if question exactly matches a cached question in the database
-        # faq_collection = get_collection("freq_questions", "questions")
-        # faq_doc = faq_collection.find_one({"question": message})
-        # if faq_doc:
-        #     logger.info("Found exact FAQ match - returning cached response")
-        #     return jsonify(format_response_with_buttons(faq_doc["answer"], faq_doc["suggestedQuestions"]))
-        
-        # ==== FAQ MATCHING - SEMANTIC MATCH ====
-        # If no exact match, try semantic matching with all FAQs
-        # else:
-
-        # Prompting loading message
-        room_id, loading_msg_id = send_loading_response(channel_id)
-
-        # faq_cursor = faq_collection.find(
-        #     {"question": {"$exists": True}},  
-        #     {"_id": 0, "question": 1, "question_id": 1}  # Projection to only return these fields
-        # )
-
-        # faq_list = []
-        # for doc in faq_cursor:
-        #     faq_list.append(f"{doc['question_id']}: {doc['question']}")
-        # faq_string = "\n".join(faq_list)
-        # response_data = json.loads(advisor.get_cached_response(faq_string, message))
-
-        # Check if LLM found a semantically similar FAQ
-        # if response_data.get("cached_question_id"):
-        #     faq_answer = faq_collection.find_one({"question_id": int(response_data["cached_question_id"])})
-        #     logger.info(f"Found semantic FAQ match with confidence score {response_data["confidence"]} - returning cached response")
-
-        #     response_data = {
-        #         "response": faq_answer["answer"],
-        #         "suggestedQuestions": faq_answer["suggestedQuestions"]
-        #     }
-        #     update_loading_message(room_id, loading_msg_id)
-        #     return jsonify(format_response_with_buttons(faq_answer["answer"], faq_answer["suggestedQuestions"]))
+        with metrics.span("advisor.init"):
+            advisor = TuftsCSAdvisor(user_profile, history=history.result() if history else None)
+
+        # Prompting loading message, posted while the LLM works on the answer
+        loading = in_background(send_loading_response, channel_id)
 
         # ==== LLM PROCESSING ====
-        # No cached or semantic match found, process with LLM
+        # No FAQ match found, process with LLM
         logger.info("No FAQ match found - processing with LLM")
 
-        raw_res = advisor.get_faq_response(None, message)
-        print(raw_res)
+        raw_res = yield LLMCall(advisor, "get_faq_response", None, message)
+        logger.debug("LLM response: %s", raw_res)
+        room_id, loading_msg_id = loading.result()
         
-        response_data = json.loads(raw_res)
+        with metrics.span("llm.parse"):
+            response_data = json.loads(raw_res)
+        response_data["response"] = render_form_url(response_data["response"], user_id)
         response_text = response_data["response"]
         category_id = response_data.get("category_id")
+        record_turn(user_id, message, response_text)
+        metrics.set_category(category_id)
         rc_payload = response_data.get("rocketChatPayload") 
+        preclassifier.record_shadow(message, category_id)
         
         # ==== HUMAN ESCALATION ====
         # category_id=4, user explicitly wants to talk to a human advisor
         if category_id == "4":
             original_question = rc_payload["originalQuestion"]
-            user_collection = get_collection("Users", "user")
-
-            user_collection.update_one(
-                {"user_id": user_id},
+            update_loading_message(room_id, loading_msg_id, response_text)
+            update_profile(
+                user_id,
                 {"$set": {"pending_escalation": True}}  # Set pending_escalation to True
             )
 
-            response = requests.post(f"{RC_BASE_URL}/chat.update", json={
-                "roomId": room_id,
-                "msgId": loading_msg_id,
-                "text": response_text
-            }, headers=HEADERS)
-
-            return format_summary_confirmation(original_question, user_id)
+            return format_summary_confirmation(original_question, user_id), 200
 
         # Check if LLM determined human escalation is needed
         elif rc_payload:
@@ -486,6 +847,8 @@ def main():
             llm_answer = rc_payload.get("llmAnswer")
             uncertain_areas = rc_payload.get("uncertainAreas")
 
+            # queued without waiting, so it goes out while the threads are built
+            update_loading_message(room_id, loading_msg_id, f" :coll_doge_gif: {response_text} \n📬 To begin your conversation, please click the \"**View Thread**\" button.")
             build_bidirectional_threads(user, original_question, llm_answer, message_id, uncertain_areas)
 
             # # Forward to human advisor and get the response
@@ -518,31 +881,42 @@ def main():
             #     "msgId": loading_msg_id,
             #     "text": f" :coll_doge_gif: {response_text} \n📬 To begin your conversation, please click the \"**View Thread**\" button."
             # }, headers=HEADERS)
-            update_loading_message(room_id, loading_msg_id, f" :coll_doge_gif: {response_text} \n📬 To begin your conversation, please click the \"**View Thread**\" button.")
 
-            return jsonify({
+            return {
                 "text": response_text,
                 "tmid": message_id
-            })
+            }, 200
 
         # ==== STANDARD LLM RESPONSE ====
         # Return LLM-generated response with suggested follow-up questions
         else:
+            logger.info("Returning standard LLM response with suggested questions")
+            update_loading_message(room_id, loading_msg_id)
             if category_id == "6":
-                user_collection = get_collection("Users", "user")
-                user_collection.update_one(
-                    {"user_id": user_id},
+                update_profile(
+                    user_id,
                     {"$set": {"channel_id": channel_id}}
                 )
 
-            logger.info("Returning standard LLM response with suggested questions")
-            update_loading_message(room_id, loading_msg_id)
-            return format_response_with_buttons(response_data["response"], response_data.get("suggestedQuestions"), category_id)
+            return format_response_with_buttons(response_data["response"], response_data.get("suggestedQuestions"), category_id), 200
+
+    except LLMUnavailable as e:
+        # a fast reply instead of an error or a webhook timeout; the student can retry
+        metrics.set_outcome("degraded")
+        logger.warning(f"LLM proxy unavailable, sending the degraded reply: {e}")
+        if loading:
+            try:
+                room_id, loading_msg_id = loading.result()
+                update_loading_message(room_id, loading_msg_id, " :kirby_sleep: Sorry, no answer this time.")
+            except Exception:
+                logger.exception("Failed to update the loading message")
+        # not remembered by deliveries, so RocketChat's retry gets a real answer
+        return TransientResult(format_response_with_buttons(DEGRADED_RESPONSE, [], "degraded"), 200)
 
     except Exception as e:
-        traceback.print_exc()
-        print(f"Error processing request: {str(e)}")
-        return jsonify({"text": "There was an error processing your request. Could you please try again?"})
+        metrics.set_outcome("error")
+        logger.exception(f"Error processing request: {str(e)}")
+        return TransientResult({"text": "There was an error processing your request. Could you please try again?"}, 200)
 
 @app.errorhandler(404)
 def page_not_found(e):
@@ -552,6 +926,25 @@ def page_not_found(e):
 def hello_world():
    return jsonify({"text": 'Hello from Koyeb - you reached the main page!'})
 
+@app.route('/courses/<course_id>', methods=['GET'])
+def course_info(course_id):
+    """
+    Catalog entries for a course id (e.g. /courses/CS160) with their parsed prerequisites
+    and the courses they unlock. ?completed=COMP15,MATH61 also checks the prerequisites.
+    """
+    catalog = get_catalog()
+    courses = catalog.lookup(course_id)
+    if not courses:
+        return jsonify({"error": f"Course {course_id} not found"}), 404
+
+    result = {"courses": [catalog.to_dict(course) for course in courses]}
+    completed = request.args.get("completed")
+    if completed is not None:
+        completed_ids = [course.strip() for course in completed.split(",") if course.strip()]
+        result["check"] = [catalog.check_prerequisites(course["id"], completed_ids) for course in courses]
+    return jsonify(result)
+
+
 @app.route('/faqs', methods=['GET', 'POST'])
 def display_faqs():
     """
@@ -593,15 +986,17 @@ def display_faqs():
             
             # Update the document
             collection = mongo_client[db_name][collection_name]
+            updated_doc = {
+                "question": question,
+                "answer": answer,
+                "question_id": question_id,
+                "suggestedQuestions": suggested_questions
+            }
             collection.update_one(
                 {"_id": ObjectId(doc_id)},
-                {"$set": {
-                    "question": question,
-                    "answer": answer,
-                    "question_id": question_id,
-                    "suggestedQuestions": suggested_questions
-                }}
+                {"$set": updated_doc}
             )
+            faq_index.upsert(doc_id, updated_doc)
             
             # Redirect to avoid form resubmission
             return redirect('/faqs')
@@ -635,12 +1030,14 @@ def display_faqs():
             next_id = highest_id + 1
             
             # Insert the new document
-            collection.insert_one({
+            new_doc = {
                 "question": question,
                 "answer": answer,
                 "question_id": next_id,
                 "suggestedQuestions": suggested_questions
-            })
+            }
+            result = collection.insert_one(new_doc)
+            faq_index.upsert(result.inserted_id, new_doc)
             
             # Redirect to avoid form resubmission
             return redirect('/faqs')
@@ -650,6 +1047,7 @@ def display_faqs():
             doc_id = request.form.get('doc_id')
             collection = mongo_client[db_name][collection_name]
             collection.delete_one({"_id": ObjectId(doc_id)})
+            faq_index.remove(doc_id)
             return redirect('/faqs')
         
         # Get all documents from freq_questions.questions collection
@@ -680,6 +1078,142 @@ def display_faqs():
         logger.error(f"Error in database view: {str(e)}")
         return render_template('error.html', error_message=str(e))
 
+def transcript_update(data):
+    """
+    Build the MongoDB update that saves the transcript fields of a /student-info form.
+    """
+    # Transcript data
+    program = data.get('program', '')
+    gpa = data.get('gpa', '')
+    domestic_value = data.get('domestic', '')
+    total_credits = data.get('credits_earned', 0)
+
+    # Convert domestic to appropriate type
+    if domestic_value == 'true':
+        domestic = True
+    elif domestic_value == 'false':
+        domestic = False
+    else:
+        domestic = ''
+
+    # Process courses
+    course_ids = data.get('course_id', [])
+    course_names = data.get('course_name', [])
+    grades = data.get('grade', [])
+    credits = data.get('credits', [])
+
+    # Ensure all course arrays are lists
+    if not isinstance(course_ids, list):
+        course_ids = [course_ids]
+    if not isinstance(course_names, list):
+        course_names = [course_names]
+    if not isinstance(grades, list):
+        grades = [grades]
+    if not isinstance(credits, list):
+        credits = [credits]
+
+    # Create courses array
+    courses = []
+    for i in range(len(course_ids)):
+        if i < len(grades) and i < len(credits) and i < len(course_names):
+            courses.append({
+                "course_id": course_ids[i],
+                "course_name": course_names[i],
+                "grade": grades[i],
+                "credits_earned": credits[i]
+            })
+
+    # Create update document - only updating transcript fields
+    return {
+        "$set": {
+            "transcript.program": program,
+            "transcript.GPA": gpa,
+            "transcript.domestic": domestic,
+            "transcript.completed_courses": courses,
+            "transcript.credits_earned": total_credits
+        }
+    }
+
+
+def follow_up_transcript(student_id, updated_user, dispatch=dispatch_query):
+    """
+    Queue the saved profile as a /query message from the student; the advice based
+    on it is posted to the student's chat when ready.
+    """
+    # Format the entire student profile as a string
+    formatted_profile = format_student_profile(updated_user)
+
+    channel_id = updated_user.get("channel_id")
+    if channel_id:
+        dispatch({
+            "text": formatted_profile,
+            "user_id": updated_user.get("user_id"),
+            "user_name": updated_user.get("username"),
+            "channel_id": channel_id
+        })
+    else:
+        logger.warning(f"No chat channel known for {student_id}, transcript saved without a follow-up message")
+
+
+def update_student_info():
+    """
+    Save the transcript submitted through /student-info and queue it as a /query
+    message from the student, answered in their chat.
+    """
+    try:
+        # Get MongoDB client from the connection pool
+        mongo_client = get_mongodb_connection()
+        if not mongo_client:
+            return jsonify({"success": False, "message": "Error connecting to database"}), 500
+    
+        # First try to get student_id from URL query parameter, then from the JSON data
+        data = request.get_json()
+        student_id = request.args.get('id') or data.get('student_id')
+    
+        # Validate student ID
+        if not student_id:
+            return jsonify({"success": False, "message": "Student ID is required"}), 400
+    
+        # Update the document in MongoDB; the form returns once the transcript is saved
+        updated_user = update_profile(student_id, transcript_update(data))
+        if not updated_user:
+            return jsonify({"success": False, "message": "Student not found"}), 404
+        follow_up_transcript(student_id, updated_user)
+
+        return jsonify({"success": True, "message": "Student information updated successfully"})
+        
+    except Exception as e:
+        metrics.set_outcome("error")
+        logger.error(f"Error updating student info: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+async def update_student_info_async(student_id, data, dispatch=dispatch_query):
+    """
+    POST /student-info for the asyncio serving mode (asgi.py); the transcript is
+    written with the asyncio MongoDB client. Returns (response dict, HTTP status code).
+    """
+    with metrics.request("student_info"):
+        try:
+            if not get_mongodb_connection():
+                return {"success": False, "message": "Error connecting to database"}, 500
+
+            student_id = student_id or data.get('student_id')
+            if not student_id:
+                return {"success": False, "message": "Student ID is required"}, 400
+
+            updated_user = await update_profile_async(student_id, transcript_update(data))
+            if not updated_user:
+                return {"success": False, "message": "Student not found"}, 404
+            follow_up_transcript(student_id, updated_user, dispatch)
+            return {"success": True, "message": "Student information updated successfully"}, 200
+
+        except Exception as e:
+            metrics.set_outcome("error")
+            logger.error(f"Error updating student info: {str(e)}")
+            return {"success": False, "message": str(e)}, 500
+
+
 @app.route('/student-info', methods=['GET', 'POST'])
 def student_info():
     """
@@ -689,115 +1223,8 @@ def student_info():
     """
     # For POST requests, handle the update
     if request.method == 'POST':
-        try:
-            # Get MongoDB client from the connection pool
-            mongo_client = get_mongodb_connection()
-            if not mongo_client:
-                return jsonify({"success": False, "message": "Error connecting to database"}), 500
-            
-            # First try to get student_id from URL query parameter
-            student_id = request.args.get('id')
-            
-            # If not in URL, try to get from JSON data
-            if not student_id:
-                # Get JSON data from request
-                data = request.get_json()
-                student_id = data.get('student_id')
-            else:
-                # If we got ID from URL, still need the rest of the data from JSON
-                data = request.get_json()
-            
-            # Validate student ID
-            if not student_id:
-                return jsonify({"success": False, "message": "Student ID is required"}), 400
-                
-            # Transcript data
-            program = data.get('program', '')
-            gpa = data.get('gpa', '')
-            domestic_value = data.get('domestic', '')
-            total_credits = data.get('credits_earned', 0)
-            
-            # Convert domestic to appropriate type
-            if domestic_value == 'true':
-                domestic = True
-            elif domestic_value == 'false':
-                domestic = False
-            else:
-                domestic = ''
-            
-            # Process courses
-            course_ids = data.get('course_id', [])
-            course_names = data.get('course_name', [])
-            grades = data.get('grade', [])
-            credits = data.get('credits', [])
-            
-            # Ensure all course arrays are lists
-            if not isinstance(course_ids, list):
-                course_ids = [course_ids]
-            if not isinstance(course_names, list):
-                course_names = [course_names]
-            if not isinstance(grades, list):
-                grades = [grades]
-            if not isinstance(credits, list):
-                credits = [credits]
-            
-            # Create courses array
-            courses = []
-            for i in range(len(course_ids)):
-                if i < len(grades) and i < len(credits) and i < len(course_names):
-                    courses.append({
-                        "course_id": course_ids[i],
-                        "course_name": course_names[i],
-                        "grade": grades[i],
-                        "credits_earned": credits[i]
-                    })
-            
-            # Create update document - only updating transcript fields
-            update_doc = {
-                "$set": {
-                    "transcript.program": program,
-                    "transcript.GPA": gpa,
-                    "transcript.domestic": domestic,
-                    "transcript.completed_courses": courses,
-                    "transcript.credits_earned": total_credits
-                }
-            }
-            
-            # Update the document in MongoDB
-            user_collection = get_collection("Users", "user")
-            updated_user = user_collection.find_one_and_update(
-                {"user_id": student_id}, 
-                update_doc,
-                return_document=pymongo.ReturnDocument.AFTER  # This ensures you get the document AFTER the update
-            )
-
-            # Format the entire student profile as a string
-            formatted_profile = format_student_profile(updated_user)
-
-            # telling the user your info has been successfully forwarded
-            response = requests.post(f"{BASE_URL}/query", json={
-                "text": formatted_profile,
-                "user_id": updated_user.get("user_id"),
-                "user_name": updated_user.get("username"),
-                "channel_id": updated_user.get("channel_id")
-            })
-
-            response_data = response.json()
-            response_data['roomId'] = updated_user.get("channel_id")
-            print(response_data)
-
-            response = requests.post(f"{RC_BASE_URL}/chat.postMessage", json=response_data, headers=HEADERS)
-            print(response.json())
-            
-            if response.status_code == 200:
-                return jsonify({"success": True, "message": "Student information updated successfully"})
-            else:
-                # Document might not have been modified if data is the same
-                return jsonify({"success": False, "message": "Something went wrong, please try again"})
-                
-        except Exception as e:
-            logger.error(f"Error updating student info: {str(e)}")
-            return jsonify({"success": False, "message": str(e)}), 500
+        with metrics.request("student_info"):
+            return update_student_info()
     
     # For GET requests, retrieve and display student info
     else:
@@ -888,6 +1315,9 @@ def format_student_profile(user_data):
     return profile
 
 
+# everything above ran during import, before the worker could serve a request
+startup.ready()
+
 if __name__ == "__main__":
     # Register shutdown handler to close MongoDB connection when app stops
     import atexit
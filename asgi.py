@@ -0,0 +1,199 @@
+"""
+ASGI entry point for CS Advising Bot (serve_mode=asgi).
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+POST /query and POST /student-info are served on the event loop: LLM calls are
+awaited on the async HTTP client and the transcript is written with the asyncio
+MongoDB client, so one process holds hundreds of concurrent LLM waits instead of
+one per worker thread. The short synchronous steps of a /query (profile reads,
+FAQ matching, RocketChat queues) run on the loop's thread pool. Every other
+route is the Flask app, called on that pool through a minimal WSGI adapter.
+"""
+
+import io
+import sys
+import json
+import asyncio
+import logging
+from urllib.parse import parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import app as flask_app
+from utils.config import config
+from utils import http_client
+from utils.jobs import is_async_mode, QUERY_QUEUE_BACKEND
+from utils.mongo_config import close_async_mongodb_connection
+
+logger = logging.getLogger(__name__)
+
+ASGI_THREADS = config.get_int("asgi_threads", 64)  # pool for the synchronous steps and Flask routes
+SHUTDOWN_GRACE = config.get_float("asgi_shutdown_grace", 30)  # seconds to finish queued answers
+
+_tasks = set()  # answers being generated after the webhook was acknowledged
+
+
+async def _read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send_json(send, payload, status=200):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _parse_json(body):
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+async def _answer_in_background(data):
+    try:
+        await flask_app.post_query_result_async(data)
+    except Exception:
+        logger.exception("Query job failed")
+
+
+def dispatch(data):
+    """
+    Answer a message after its webhook was acknowledged. With the in-process queue
+    the answer is an event-loop task; with query_queue_backend=mongo it goes to the
+    shared job queue so any node can pick it up.
+    """
+    if QUERY_QUEUE_BACKEND != "memory":
+        flask_app.dispatch_query(data)
+        return
+    task = asyncio.get_running_loop().create_task(_answer_in_background(data))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def query(scope, receive, send):
+    data = _parse_json(await _read_body(receive))
+    if not isinstance(data, dict):
+        await _send_json(send, {"text": "Invalid request"}, 400)
+        return
+
+    if is_async_mode():
+        if data.get("bot") or not data.get("text"):
+            await _send_json(send, {"status": "ignored"})
+            return
+        dispatch(data)
+        await _send_json(send, {"success": True})
+        return
+
+    response_data, status = await flask_app.handle_query_async(data)
+    await _send_json(send, response_data, status)
+
+
+async def student_info(scope, receive, send):
+    data = _parse_json(await _read_body(receive))
+    if not isinstance(data, dict):
+        await _send_json(send, {"success": False, "message": "Invalid request"}, 400)
+        return
+    student_id = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("id", [None])[0]
+    response_data, status = await flask_app.update_student_info_async(student_id, data, dispatch=dispatch)
+    await _send_json(send, response_data, status)
+
+
+ROUTES = {
+    ("POST", "/query"): query,
+    ("POST", "/student-info"): student_info,
+}
+
+
+def _environ(scope, body):
+    """
+    WSGI environ for an ASGI http scope.
+    """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ):
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+    result = flask_app.app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return response["status"], response["headers"], body
+
+
+async def wsgi(scope, receive, send):
+    environ = _environ(scope, await _read_body(receive))
+    status, headers, body = await asyncio.to_thread(_call_wsgi, environ)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+            )
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _tasks:
+                logger.info(f"Waiting for {len(_tasks)} answers still being generated")
+                await asyncio.wait(list(_tasks), timeout=SHUTDOWN_GRACE)
+            await http_client.close_async_clients()
+            await close_async_mongodb_connection()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(scope, receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    handler = ROUTES.get((scope["method"], scope["path"]), wsgi)
+    await handler(scope, receive, send)
@@ -0,0 +1,342 @@
+"""
+Replay benchmark for /query and /student-info.
+
+Runs the Flask app on a local port against stand-ins for the LLM proxy and
+RocketChat (bench/stubs.py) and an in-memory MongoDB (mongomock) or a local
+mongod, replays bench/messages.json at the given concurrency and reports
+p50/p95/p99 latency, throughput and outbound calls per message for each path
+through main().
+
+    python -m bench.replay --concurrency 8 --repeat 5 --output bench_results.json
+    python -m bench.replay --mongo-uri mongodb://localhost:27017 --llm-median-ms 1500
+    python -m bench.replay --server asgi --concurrency 200 --paths advising
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import argparse
+import datetime
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from werkzeug.serving import BaseWSGIServer, make_server
+
+from bench.stubs import LLMProxyStub, RocketChatStub
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+PATHS = ["greeting", "advising", "escalation_request", "escalation_forward", "thread_reply", "student_info"]
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies):
+    return {
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "max_ms": round(max(latencies), 2) if latencies else None
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_app(args, llm, rc):
+    """
+    Point the app at the stand-ins, import it and serve it on a local port.
+    """
+    os.environ.update({
+        "endPoint": llm.url + "/",
+        "apiKey": "bench",
+        "rc_base_url": rc.url + "/api/v1",
+        "RC_token": "bench",
+        "RC_userId": "bench",
+        "email_enabled": "false",
+        "preclassifier_mode": args.preclassifier,
+        "query_mode": args.query_mode
+    })
+    for pair in args.env:
+        key, _, value = pair.partition("=")
+        os.environ[key] = value
+
+    if args.mongo_uri:
+        os.environ["MONGO_URI"] = args.mongo_uri
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is not installed: pip install mongomock, or pass --mongo-uri for a local mongod")
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+
+    sys.path.insert(0, REPO_DIR)
+    import app as app_module
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    if args.server == "asgi":
+        return app_module, start_asgi()
+    if args.threads:
+        server = PooledWSGIServer("127.0.0.1", 0, app_module.app, args.threads)
+    else:
+        server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    return app_module, base_url
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Serves requests on a fixed number of threads, like one gunicorn gthread worker,
+    so the sync mode's concurrency per process is bounded as in production.
+    """
+
+    request_queue_size = 1024
+
+    def __init__(self, host, port, app, threads):
+        super().__init__(host, port, app)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+def start_asgi():
+    """
+    Serve asgi.py with uvicorn on a local port, in a background thread.
+    """
+    import socket
+    import uvicorn
+
+    import asgi
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", 0))
+    server = uvicorn.Server(uvicorn.Config(asgi.app, lifespan="on", log_level="warning", backlog=4096))
+    threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def build_requests(path, messages, repeat, run_id):
+    """
+    One request spec per message and repetition, each for its own student and channel.
+    """
+    specs = []
+    for i in range(repeat):
+        for j, message in enumerate(messages):
+            user_id = f"bench-{run_id}-{path}-{i}-{j}"
+            channel_id = f"room-{user_id}"
+            if path == "student_info":
+                specs.append({"kind": "student_info", "user_id": user_id, "channel_id": channel_id, "form": message})
+                continue
+            payload = {
+                "user_id": user_id,
+                "user_name": user_id,
+                "text": message,
+                "message_id": uuid.uuid4().hex,
+                "channel_id": channel_id
+            }
+            if path == "thread_reply":
+                payload["tmid"] = f"thread-{user_id}"
+            specs.append({"kind": "query", "user_id": user_id, "channel_id": channel_id, "payload": payload})
+    return specs
+
+
+def seed(path, specs):
+    """
+    Create the state a path needs before replay (pending escalations, thread mappings, profiles).
+    """
+    from utils.mongo_config import get_collection
+
+    users = get_collection("Users", "user")
+    threads = get_collection("Users", "threads")
+    for spec in specs:
+        if path == "escalation_forward":
+            users.insert_one({"user_id": spec["user_id"], "username": spec["user_id"], "last_k": 1,
+                              "pending_escalation": True, "transcript": {}})
+        elif path == "thread_reply":
+            threads.insert_one({"thread_id": spec["payload"]["tmid"], "forward_thread_id": "advisor-" + spec["user_id"],
+                                "forward_human": True})
+        elif path == "student_info":
+            users.insert_one({"user_id": spec["user_id"], "username": spec["user_id"], "last_k": 1,
+                              "channel_id": spec["channel_id"], "transcript": {}})
+
+
+def wait_quiet(stubs, quiet_seconds, timeout):
+    """
+    Wait until no stand-in has received a call for ``quiet_seconds`` (background work drained).
+    """
+    started = time.perf_counter()
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        # background work may not have reached a stand-in yet when the last request is acknowledged
+        last = max((call["time"] for stub in stubs for call in stub.snapshot()[-1:]), default=started)
+        last = max(last, started)
+        if time.perf_counter() - last >= quiet_seconds:
+            return
+        time.sleep(0.05)
+
+
+def run_path(path, specs, base_url, concurrency, llm, rc, quiet_seconds):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    llm_before, rc_before = len(llm.snapshot()), len(rc.snapshot())
+    llm.reset_peak()
+
+    def send(spec):
+        started = time.perf_counter()
+        try:
+            if spec["kind"] == "student_info":
+                response = session.post(f"{base_url}/student-info?id={spec['user_id']}", json=spec["form"], timeout=300)
+            else:
+                response = session.post(f"{base_url}/query", json=spec["payload"], timeout=300)
+            ok = response.status_code < 500
+        except requests.exceptions.RequestException:
+            ok = False
+        return {"channel_id": spec["channel_id"], "started": started, "ack": time.perf_counter(), "ok": ok}
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, specs))
+    wait_quiet([llm, rc], quiet_seconds, timeout=120)
+
+    llm_calls = llm.snapshot()[llm_before:]
+    rc_calls = rc.snapshot()[rc_before:]
+
+    # completion = last RocketChat call for the student's room (covers async mode), or the ack
+    last_rc_by_room = {}
+    for call in rc_calls:
+        room = (call["payload"] or {}).get("roomId")
+        if room:
+            last_rc_by_room[room] = max(last_rc_by_room.get(room, 0.0), call["time"])
+    ack_ms, completion_ms = [], []
+    for result in results:
+        ack_ms.append(1000 * (result["ack"] - result["started"]))
+        done = max(result["ack"], last_rc_by_room.get(result["channel_id"], 0.0))
+        completion_ms.append(1000 * (done - result["started"]))
+    wall = max(max(r["ack"] for r in results), max((c["time"] for c in rc_calls), default=0.0)) - wall_started
+
+    outbound = {}
+    for call in llm_calls + rc_calls:
+        outbound[call["kind"]] = outbound.get(call["kind"], 0) + 1
+    count = len(results)
+    return {
+        "messages": count,
+        "errors": sum(1 for r in results if not r["ok"]),
+        "throughput_msg_per_s": round(count / wall, 2) if wall > 0 else None,
+        "ack": summarize(ack_ms),
+        "completion": summarize(completion_ms),
+        "outbound_per_message": {kind: round(n / count, 3) for kind, n in sorted(outbound.items())},
+        "outbound_total_per_message": round(sum(outbound.values()) / count, 3),
+        "peak_concurrent_llm_calls": llm.peak_in_flight
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", default=os.path.join(BENCH_DIR, "messages.json"))
+    parser.add_argument("--paths", default=",".join(PATHS), help="comma-separated subset of " + ",".join(PATHS))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3, help="times each message is replayed")
+    parser.add_argument("--llm-median-ms", type=float, default=300.0)
+    parser.add_argument("--llm-sigma", type=float, default=0.4)
+    parser.add_argument("--upload-ms", type=float, default=100.0)
+    parser.add_argument("--rc-latency-ms", type=float, default=0.0, help="RocketChat API response time")
+    parser.add_argument("--mongo-uri", help="local mongod to use instead of the in-memory mongomock store")
+    parser.add_argument("--preclassifier", default="shadow", choices=["off", "shadow", "on"])
+    parser.add_argument("--query-mode", default="sync", choices=["sync", "async"])
+    parser.add_argument("--server", default="wsgi", choices=["wsgi", "asgi"],
+                        help="serve app.py (threaded WSGI) or asgi.py (uvicorn)")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="WSGI request threads, like gunicorn --threads (0: one thread per request)")
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE settings for the app")
+    parser.add_argument("--quiet-seconds", type=float, default=0.5, help="idle time that marks a path as drained")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    args = parser.parse_args()
+
+    with open(args.messages, encoding="utf-8") as file:
+        corpus = json.load(file)
+
+    llm = LLMProxyStub(median_ms=args.llm_median_ms, sigma=args.llm_sigma, upload_ms=args.upload_ms).start()
+    rc = RocketChatStub(latency_ms=args.rc_latency_ms).start()
+    app_module, base_url = start_app(args, llm, rc)
+
+    run_id = uuid.uuid4().hex[:6]
+    results = {}
+    for path in [p.strip() for p in args.paths.split(",") if p.strip()]:
+        specs = build_requests(path, corpus[path], args.repeat, run_id)
+        seed(path, specs)
+        results[path] = run_path(path, specs, base_url, args.concurrency, llm, rc, args.quiet_seconds)
+        summary = results[path]
+        print(f"{path:20s} n={summary['messages']:4d} p50={summary['completion']['p50_ms']:8.1f}ms "
+              f"p95={summary['completion']['p95_ms']:8.1f}ms p99={summary['completion']['p99_ms']:8.1f}ms "
+              f"{summary['throughput_msg_per_s']} msg/s outbound/msg={summary['outbound_total_per_message']} "
+              f"peak LLM waits={summary['peak_concurrent_llm_calls']}")
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "config": {
+            "concurrency": args.concurrency,
+            "repeat": args.repeat,
+            "llm_median_ms": args.llm_median_ms,
+            "llm_sigma": args.llm_sigma,
+            "upload_ms": args.upload_ms,
+            "rc_latency_ms": args.rc_latency_ms,
+            "mongo": "mongod" if args.mongo_uri else "mongomock",
+            "preclassifier": args.preclassifier,
+            "query_mode": args.query_mode,
+            "server": args.server,
+            "threads": args.threads,
+            "env": args.env
+        },
+        "paths": results,
+        # cold start of the app under test: import steps and the first request of each endpoint
+        "startup": app_module.startup.startup_stats()
+    }
+    steps = report["startup"]["steps_s"]
+    first_query = report["startup"]["first_requests"].get("query", {})
+    print(f"startup: import {1000 * steps.get('import.app', 0):.1f}ms, "
+          f"mongo connect {1000 * steps.get('mongo.connect', 0):.1f}ms, first /query {1000 * first_query.get('seconds', 0):.1f}ms")
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
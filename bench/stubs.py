@@ -0,0 +1,174 @@
+"""
+Local stand-ins for the LLM proxy and RocketChat, used by the replay benchmark.
+Both run as threaded HTTP servers and record every call they receive.
+"""
+
+import json
+import time
+import uuid
+import random
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ESCALATED_RESPONSE = {
+    "llmAnswer": "Benchmark answer drafted for a human advisor. Source: [CS Graduate Handbook Supplement](https://tufts.app.box.com/v/cs-grad-handbook-supplement)",
+    "uncertainAreas": "Benchmark uncertainty."
+}
+
+
+def canned_response(system, query):
+    """
+    Return canned model output in the shape the real prompts ask for.
+    """
+    if '"llmAnswer"' in system and '"category_id"' not in system:
+        return ESCALATED_RESPONSE
+
+    text = (query or "").lower()
+    if any(word in text for word in ("hello", "hi ", "hey")) or text in ("hi", "hey"):
+        return {"category_id": "1", "response": " :kirby_say_hi: Welcome to the **Tufts MSCS Advising Bot**!"}
+    if "human" in text:
+        return {
+            "category_id": "4",
+            "response": "I noticed you are asking about your question. Let me help you connect with a human advisor.",
+            "rocketChatPayload": {
+                "originalQuestion": query,
+                "llmAnswer": ESCALATED_RESPONSE["llmAnswer"],
+                "uncertainAreas": ESCALATED_RESPONSE["uncertainAreas"]
+            }
+        }
+    if any(word in text for word in ("thank", "bye")):
+        return {"category_id": "7", "response": "You're welcome!"}
+    if "program:" in text or "courses taken" in text:
+        return {"category_id": "2", "response": "Thanks for sharing your transcript. Here is some advice.",
+                "suggestedQuestions": ["Q1?", "Q2?", "Q3?"]}
+    return {
+        "category_id": "2",
+        "response": "Benchmark answer. Source: [CS Graduate Handbook Supplement](https://tufts.app.box.com/v/cs-grad-handbook-supplement)",
+        "suggestedQuestions": ["What are the core competency areas?", "When are registration dates?", "What is CPT?"]
+    }
+
+
+class _RecordingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # hundreds of concurrent callers in the ASGI benchmark
+
+    def __init__(self, handler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.calls = []
+        self.calls_lock = threading.Lock()
+
+    def record(self, kind, payload):
+        with self.calls_lock:
+            self.calls.append({"kind": kind, "time": time.perf_counter(), "payload": payload})
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def snapshot(self):
+        with self.calls_lock:
+            return list(self.calls)
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LLMProxyHandler(_JsonHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+            self.server.record("llm.upload", None)
+            time.sleep(self.server.upload_latency())
+            self._send_json({"result": "uploaded"})
+            return
+
+        request = json.loads(body or b"{}")
+        self.server.record("llm.generate", {"query": request.get("query"), "lastk": request.get("lastk")})
+        with self.server.generating():
+            time.sleep(self.server.generate_latency())
+        result = json.dumps(canned_response(request.get("system", ""), request.get("query", "")))
+        self._send_json({"result": result, "rag_context": ""})
+
+
+class LLMProxyStub(_RecordingServer):
+    """
+    LLM proxy stand-in. Generation latency is log-normal with the given median and sigma.
+    """
+
+    def __init__(self, median_ms=1500.0, sigma=0.4, upload_ms=200.0, seed=0):
+        super().__init__(LLMProxyHandler)
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.upload_ms = upload_ms
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0  # most generate calls waiting at once, since reset_peak()
+
+    @contextmanager
+    def generating(self):
+        with self._random_lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            yield
+        finally:
+            with self._random_lock:
+                self.in_flight -= 1
+
+    def reset_peak(self):
+        with self._random_lock:
+            self.peak_in_flight = self.in_flight
+
+    def generate_latency(self):
+        if self.median_ms <= 0:
+            return 0.0
+        with self._random_lock:
+            return self._random.lognormvariate(0, self.sigma) * self.median_ms / 1000.0
+
+    def upload_latency(self):
+        return self.upload_ms / 1000.0
+
+
+class RocketChatHandler(_JsonHandler):
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        method = self.path.rsplit("/", 1)[-1]
+        self.server.record(f"rc.{method}", payload)
+        time.sleep(self.server.latency_ms / 1000.0)
+        if method == "chat.postMessage":
+            self._send_json({
+                "success": True,
+                "message": {"_id": uuid.uuid4().hex, "rid": payload.get("roomId") or payload.get("channel"),
+                            "msg": payload.get("text")}
+            })
+        else:
+            self._send_json({"success": True})
+
+
+class RocketChatStub(_RecordingServer):
+    """
+    RocketChat stand-in that records chat.postMessage and chat.update calls and
+    answers each after a fixed latency.
+    """
+
+    def __init__(self, latency_ms=0.0):
+        super().__init__(RocketChatHandler)
+        self.latency_ms = latency_ms
@@ -1,14 +1,78 @@
-import os
 import json
+import time
 import requests
 from typing import Tuple
-from dotenv import load_dotenv
 
-load_dotenv()
+from utils.config import config
+from utils import http_client
+from utils import resilience
 
 # Read proxy config from environment
-end_point = os.environ.get("endPoint")
-api_key = os.environ.get("apiKey")
+end_point = config.get("endPoint")
+api_key = config.get("apiKey")
+generate_timeout = config.get_float("llm_read_timeout", 60)  # seconds
+upload_timeout = config.get_float("llm_upload_timeout", 120)  # seconds
+
+def _generate_request(model, system, query, temperature, lastk, session_id,
+                      rag_threshold, rag_usage, rag_k, rag_session_id):
+    request = {
+        'model': model,
+        'system': system,
+        'query': query,
+        'temperature': temperature,
+        'lastk': lastk,
+        'session_id': session_id,
+        'rag_threshold': rag_threshold,
+        'rag_usage': rag_usage,
+        'rag_k': rag_k
+    }
+    # retrieve from a shared corpus session while history stays in session_id
+    if rag_session_id:
+        request['rag_session_id'] = rag_session_id
+    return request
+
+def _generate_result(status_code, text):
+    if status_code == 200:
+        res = json.loads(text)
+        return {'response':res['result'],'rag_context':res['rag_context']}
+    return f"Error: Received response code {status_code}"
+
+def _proxy_ok(response):
+    # a 4xx other than 429 is our request's fault, not a sign the proxy is down
+    return response.status_code < 500 and response.status_code != 429
+
+def _start_call(name, timeout):
+    """
+    The timeout for an LLM proxy call under the current deadline, the circuit
+    breaker token to record its outcome with, and None; or None, None and the error
+    message if the call is not made because the deadline has (nearly) passed or the
+    circuit breaker is open.
+    """
+    timeout = resilience.budget(timeout)
+    if timeout < resilience.MIN_CALL_BUDGET:
+        resilience.deadline_exceeded()
+        return None, None, "An error occurred: the request deadline was exceeded"
+    token = resilience.breakers[name].allow()
+    if token is None:
+        return None, None, "An error occurred: the LLM proxy is unavailable (circuit breaker open)"
+    return timeout, token, None
+
+def _timeouts(timeout):
+    return (min(http_client.CONNECT_TIMEOUT, timeout), timeout)
+
+def _post_generate(headers, request, timeout):
+    started = time.perf_counter()
+    response = http_client.post(end_point, headers=headers, json=request, timeout=_timeouts(timeout))
+    if response.status_code == 200:
+        resilience.hedgers["generate"].latencies.add(time.perf_counter() - started)
+    return response
+
+async def _apost_generate(headers, request, timeout):
+    started = time.perf_counter()
+    response = await http_client.apost(end_point, headers=headers, json=request, timeout=_timeouts(timeout))
+    if response.status_code == 200:
+        resilience.hedgers["generate"].latencies.add(time.perf_counter() - started)
+    return response
 
 def generate(
 	model: str,
@@ -19,34 +83,77 @@ def generate(
 	session_id: str | None = None,
     rag_threshold: float | None = 0.5,
     rag_usage: bool | None = False,
-    rag_k: int | None = 0
+    rag_k: int | None = 0,
+    rag_session_id: str | None = None
 	):
 	
     headers = {
         'x-api-key': api_key
     }
 
-    request = {
-        'model': model,
-        'system': system,
-        'query': query,
-        'temperature': temperature,
-        'lastk': lastk,
-        'session_id': session_id,
-        'rag_threshold': rag_threshold,
-        'rag_usage': rag_usage,
-        'rag_k': rag_k
-    }
-    msg = None
+    request = _generate_request(model, system, query, temperature, lastk, session_id,
+                                rag_threshold, rag_usage, rag_k, rag_session_id)
+    timeout, token, msg = _start_call("generate", generate_timeout)
+    if msg:
+        return msg
+    started = time.perf_counter()
+    ok = False
     try:
-        response = requests.post(end_point, headers=headers, json=request)
-        if response.status_code == 200:
-            res = json.loads(response.text)
-            msg = {'response':res['result'],'rag_context':res['rag_context']}
+        if lastk:
+            response = _post_generate(headers, request, timeout)
         else:
-            msg = f"Error: Received response code {response.status_code}"
+            # with lastk=0 the proxy's session history is not read, so a second copy
+            # of a slow call is safe; the hedge gets whatever budget is left by then
+            response = resilience.hedgers["generate"].call(
+                lambda: _post_generate(headers, request, resilience.budget(timeout)), _proxy_ok)
+        ok = _proxy_ok(response)
+        msg = _generate_result(response.status_code, response.text)
     except requests.exceptions.RequestException as e:
         msg = f"An error occurred: {e}"
+    finally:
+        resilience.breakers["generate"].record(token, ok, time.perf_counter() - started)
+    return msg
+
+async def agenerate(
+    model: str,
+    system: str,
+    query: str,
+    temperature: float | None = None,
+    lastk: int | None = None,
+    session_id: str | None = None,
+    rag_threshold: float | None = 0.5,
+    rag_usage: bool | None = False,
+    rag_k: int | None = 0,
+    rag_session_id: str | None = None
+    ):
+    """
+    generate() on the async HTTP client, for the asyncio serving mode (asgi.py).
+    """
+    import httpx
+
+    headers = {
+        'x-api-key': api_key
+    }
+
+    request = _generate_request(model, system, query, temperature, lastk, session_id,
+                                rag_threshold, rag_usage, rag_k, rag_session_id)
+    timeout, token, msg = _start_call("generate", generate_timeout)
+    if msg:
+        return msg
+    started = time.perf_counter()
+    ok = False
+    try:
+        if lastk:
+            response = await _apost_generate(headers, request, timeout)
+        else:
+            response = await resilience.hedgers["generate"].acall(
+                lambda: _apost_generate(headers, request, resilience.budget(timeout)), _proxy_ok)
+        ok = _proxy_ok(response)
+        msg = _generate_result(response.status_code, response.text)
+    except httpx.HTTPError as e:
+        msg = f"An error occurred: {e}"
+    finally:
+        resilience.breakers["generate"].record(token, ok, time.perf_counter() - started)
     return msg
 
 def upload(multipart_form_data):
@@ -54,9 +161,14 @@ def upload(multipart_form_data):
         'x-api-key': api_key
     }
 
-    msg = None
+    timeout, token, msg = _start_call("upload", upload_timeout)
+    if msg:
+        return msg
+    started = time.perf_counter()
+    ok = False
     try:
-        response = requests.post(end_point, headers=headers, files=multipart_form_data)
+        response = http_client.post(end_point, headers=headers, files=multipart_form_data, timeout=_timeouts(timeout))
+        ok = _proxy_ok(response)
         
         if response.status_code == 200:
             msg = "Successfully uploaded. It may take a short while for the document to be added to your context"
@@ -64,6 +176,8 @@ def upload(multipart_form_data):
             msg = f"Error: Received response code {response.status_code}"
     except requests.exceptions.RequestException as e:
         msg = f"An error occurred: {e}"
+    finally:
+        resilience.breakers["upload"].record(token, ok, time.perf_counter() - started)
     
     return msg
 
@@ -81,12 +195,13 @@ def pdf_upload(
         'strategy': strategy
     }
 
-    multipart_form_data = {
-        'params': (None, json.dumps(params), 'application/json'),
-        'file': (None, open(path, 'rb'), "application/pdf")
-    }
+    with open(path, 'rb') as file:
+        multipart_form_data = {
+            'params': (None, json.dumps(params), 'application/json'),
+            'file': (None, file, "application/pdf")
+        }
 
-    response = upload(multipart_form_data)
+        response = upload(multipart_form_data)
     return response
 
 def text_upload(
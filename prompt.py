@@ -8,16 +8,30 @@ designed specifically for the Master of Science in Computer Science program at T
 """
 
 # greeting_msg = """I'm here to help you with a wide range of Computer Science advising topics:\\n- **Program Requirements**\\n    - \\\"What are the core competency areas for the MSCS program?\\\"\\n    - \\\"How many courses are required to complete a Master's in Computer Science at Tufts?\\\"\\n- **Academic Policies**\\n    - \\\"What is the transfer credit policy for Computer Science graduate students?\\\"\\n    - \\\"What are the requirements for maintaining good academic standing in the graduate program?\\\"\\n- **Course-related Information**\\n    - \\\"Does taking CS160 count towards my graduation requirement?\\\"\\n    - \\\"Can I take non-CS courses in my degree program?\\\"\\n- **Career Development**\\n    - \\\"What Co-op opportunities are available?\\\"\\n    - \\\"Can international students do internships as part of the program?\\\"\\n- **Administrative Questions**\\n    - \\\"When are the enrollment periods?\\\"\\n    - \\\"What important dates should I keep in mind?\\\"\\n\\n :kirby_fly: Want a **more personalized** advising experience? I just need a little more info from you:\\n- Your program status (e.g., \\\"First-year MSCS student\\\")\\n- Courses you've already completed (e.g., \\\"CS 105, CS 160\\\")\\n- Are you an international student?\\n- Your current GPA (if applicable)\\n**Totally optional**, and you're welcome to continue without it!\\n\\n :kirby_type: To speak with a human advisor, just type: \\\"**talk to a human advisor**\\\" or click on the \\\"**Connect**\\\" button below"
-import os
-from dotenv import load_dotenv
+import json
+import hashlib
+import logging
+import functools
+import threading
 
-# Load environment variables from .env file
-load_dotenv()
-BASE_URL = os.environ.get("koyeb_url", "https://shy-moyna-wendanj-b5959963.koyeb.app")
+from utils.config import config
+from utils.cache import LRUCache
+from utils.audit import get_audit, format_audit
+
+BASE_URL = config.get("koyeb_url", "https://shy-moyna-wendanj-b5959963.koyeb.app")
+# send the saved program, visa status, courses and degree audit to the LLM
+STUDENT_CONTEXT = config.get_bool("prompt_student_context", False)
+FORM_URL_PLACEHOLDER = "STUDENT_FORM_URL"  # replaced in category-6 replies by render_form_url()
+CHARS_PER_TOKEN = 4  # rough estimate for English prompts
+
+logger = logging.getLogger(__name__)
+
+# per-user prompt suffixes, keyed by a hash of the profile fields they use
+_student_context_cache = LRUCache("student_context", maxsize=2048, ttl=3600)
 
 def format_student_courses(transcript):
     if transcript:
-        courses = transcript.get("completed_courses")
+        courses = transcript.get("completed_courses") or []
         str = ""
         for course in courses:
             str += f"{course.get("course_id", "unknown")}, {course.get("course_name", "unknown")}, Grade: {course.get("grade", "unknown")} \n"
@@ -34,8 +48,7 @@ def is_international_student(transcript):
         return "not provided"
     
 
-def get_system_prompt(user_profile):
-    greeting_msg = f"""
+GREETING_MSG = f"""
 
 I'm here to help you with a wide range of Computer Science advising topics:
 - **Program Requirements**  - \"What are the core competency areas for the MSCS program?\"
@@ -46,8 +59,29 @@ I'm here to help you with a wide range of Computer Science advising topics:
 
  :kirby_type: To speak with a human advisor, just type: \"**talk to a human advisor**\" or click on the \"**Connect**\" button.
 """
-    transcript = user_profile.get("transcript")
-    
+
+# Fixed replies for categories that never need the LLM, shared with the local
+# pre-classifier (utils/preclassifier.py); 1 and 5 match the templates in the prompt below
+FIXED_RESPONSES = {
+    "1": f" :kirby_say_hi: Welcome to the **Tufts MSCS Advising Bot**! {GREETING_MSG}",
+    "5": f" :kirby_sweat: I apologize, but this question falls outside my scope as a MSCS advising bot.\n\n{GREETING_MSG}"
+}
+
+def get_fixed_response(category_id):
+    """Return the fixed reply text for a category, or None if it needs the LLM."""
+    return FIXED_RESPONSES.get(category_id)
+
+def get_system_prompt(user_profile):
+    """
+    System prompt for advising questions: the static prefix (rendered once) plus
+    the per-user STUDENT CONTEXT suffix.
+    """
+    return _system_prompt_prefix() + get_student_context(user_profile)
+
+@functools.lru_cache(maxsize=1)
+def _system_prompt_prefix():
+    greeting_msg = GREETING_MSG
+
     return f"""
 # TUFTS MSCS ACADEMIC ADVISOR BOT
 
@@ -210,10 +244,11 @@ Step 3. Generate a **properly formatted JSON response** strictly following to th
             - Clearly specify what additional information would be helpful (e.g., completed courses, GPA, visa status) based on the student's question.
             - Remind the student that sharing this information is completely optional.
             - Be thoughtful about what information you actually need — for example, core competency areas can often be determined based on the courses student have taken.
+            - Keep STUDENT_FORM_URL exactly as written; it is replaced with the student's own form link.
           - **Return a JSON object** following this format:
             {{
                 "category_id": "6",
-                "response": "I see you have a question about [topic]. To provide a more helpful and personalized answer, could you share a bit more about **[the relevant info]**? \n\nYou can either reply directly in the chatbox or click the form below to share your academic infor: \n👉[Fill out this quick form]({BASE_URL}/student-info?id={user_profile.get("user_id")})). \n\nSharing this info is **completely optional** — you're welcome to continue without it!"
+                "response": "I see you have a question about [topic]. To provide a more helpful and personalized answer, could you share a bit more about **[the relevant info]**? \n\nYou can either reply directly in the chatbox or click the form below to share your academic infor: \n👉[Fill out this quick form](STUDENT_FORM_URL)). \n\nSharing this info is **completely optional** — you're welcome to continue without it!"
             }}
 
     - CATEGORY 7
@@ -244,8 +279,14 @@ Step 3. Generate a **properly formatted JSON response** strictly following to th
 """
 
 def get_escalated_response(user_profile):
-    transcript = user_profile.get("transcript", {})
+    """
+    System prompt for escalations: the static prefix (rendered once) plus the
+    per-user STUDENT CONTEXT suffix.
+    """
+    return _escalated_prompt_prefix() + get_student_context(user_profile)
 
+@functools.lru_cache(maxsize=1)
+def _escalated_prompt_prefix():
     # def format_student_courses():
     #     if transcript:
     #         courses = transcript.get("completed_courses")
@@ -263,7 +304,7 @@ def get_escalated_response(user_profile):
     #         elif domestic == "true" or domestic == True:
     #             return "domestic student"
     #         return "not provided"
-        
+
     return f"""# TUFTS MSCS ACADEMIC ADVISOR BOT
 
 You are an academic advisor specializing in the MSCS (Master of Science in Computer Science) program at Tufts University. 
@@ -294,6 +335,99 @@ Your role is to **accurately and professionally answer CS advising-related quest
     - **MAKE SURE YOUR FINAL OUTPUT IS A VALID JSON OBJECT**
 """
 
+def render_form_url(text, user_id):
+    """
+    Replace the STUDENT_FORM_URL placeholder of a reply with the student's form link.
+    """
+    return text.replace(FORM_URL_PLACEHOLDER, f"{BASE_URL}/student-info?id={user_id}") if text else text
+
+def _profile_key(user_profile):
+    transcript = user_profile.get("transcript")
+    return hashlib.sha1(json.dumps(transcript, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def get_student_context(user_profile):
+    """
+    Per-user prompt suffix with the saved transcript (prompt_student_context=true),
+    memoized on a hash of the transcript; empty otherwise.
+    """
+    if not STUDENT_CONTEXT:
+        return ""
+    key = _profile_key(user_profile)
+    context = _student_context_cache.get(key)
+    if context is not None:
+        return context
+
+    transcript = user_profile.get("transcript") or {}
+    context = "\n## STUDENT CONTEXT\n"
+    context += f"- Program: {transcript.get('program') or 'not provided'}\n"
+    context += f"- Visa status: {is_international_student(transcript) or 'not provided'}\n"
+    context += f"- Completed courses (from the student's saved transcript):\n{format_student_courses(transcript) or 'not provided'}\n"
+    audit = get_audit(user_profile)
+    if audit:
+        # computed locally (utils/audit.py); rely on it instead of re-deriving the rules
+        context += f"- Degree audit against the M.S. course requirements:\n{format_audit(audit)}\n"
+    _student_context_cache.put(key, context)
+    return context
+
+SUMMARY_PROMPT = """You maintain the running summary of a conversation between a Tufts MSCS graduate student and the CS advising bot.
+Merge the current summary with the new turns into one updated summary of at most 120 words.
+Keep what later questions may depend on: the student's goals, courses and plans they mentioned, questions already answered and any open issues.
+Drop greetings and small talk. Reply with the summary text only."""
+
+def get_conversation_context(history):
+    """
+    Prompt section with the rolling summary and the most recent turns of the conversation.
+    """
+    if not history or not (history.get("summary") or history.get("turns")):
+        return ""
+    context = "\n## CONVERSATION SO FAR\n"
+    if history.get("summary"):
+        context += f"- Summary of earlier messages: {history['summary']}\n"
+    if history.get("turns"):
+        context += "- Most recent messages:\n"
+        context += "\n".join(f"  {turn['role']}: {turn['text']}" for turn in history["turns"]) + "\n"
+    return context
+
+# prompt size counters per prompt kind ("faq", "escalation")
+_prompt_stats = {}
+_prompt_stats_lock = threading.Lock()
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def record_prompt_size(kind, system, query):
+    """
+    Log and aggregate character and estimated token counts of a prompt.
+    """
+    system_chars, query_chars = len(system), len(query or "")
+    tokens = estimate_tokens(system) + estimate_tokens(query or "")
+    logger.info(f"{kind} prompt: system {system_chars} chars, query {query_chars} chars, ~{tokens} tokens")
+    with _prompt_stats_lock:
+        stats = _prompt_stats.setdefault(kind, {"count": 0, "system_chars": 0, "query_chars": 0, "est_tokens": 0, "max_est_tokens": 0})
+        stats["count"] += 1
+        stats["system_chars"] += system_chars
+        stats["query_chars"] += query_chars
+        stats["est_tokens"] += tokens
+        stats["max_est_tokens"] = max(stats["max_est_tokens"], tokens)
+
+def prompt_stats():
+    """
+    Average and maximum prompt sizes per kind, plus the student context cache stats.
+    """
+    with _prompt_stats_lock:
+        result = {}
+        for kind, stats in _prompt_stats.items():
+            count = stats["count"]
+            result[kind] = {
+                "count": count,
+                "avg_system_chars": round(stats["system_chars"] / count, 1),
+                "avg_query_chars": round(stats["query_chars"] / count, 1),
+                "avg_est_tokens": round(stats["est_tokens"] / count, 1),
+                "max_est_tokens": stats["max_est_tokens"]
+            }
+    result["student_context_cache"] = _student_context_cache.stats()
+    return result
+
 def main():
     """Example usage of the system prompt"""
     system_prompt = get_system_prompt()
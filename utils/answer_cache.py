@@ -0,0 +1,217 @@
+"""
+Shared answers for identical general questions.
+
+Around registration many students ask the same handbook question within
+minutes. Questions that reference nothing personal are keyed by their
+normalized text plus the handbook corpus version and the parts of the student
+context the prompt carries (program, visa status); students with saved courses
+get their own answers. Concurrent requests for the same key share one in-flight
+LLM call (single flight), and general answers
+(category 2, no escalation) are kept in a TTL cache for later askers. Answers
+in any other category are never shared; waiting requests then make their own call.
+"""
+
+import re
+import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from utils.config import config
+from utils.cache import LRUCache
+from utils.corpus import get_corpus_version
+from utils.faq_index import normalize, STOPWORDS
+from prompt import STUDENT_CONTEXT, is_international_student
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = config.get_bool("answer_cache_enabled", True)
+FLIGHT_WAIT = config.get_float("answer_cache_wait", 120)  # seconds a follower waits for the shared call
+
+# first-person references, transcript/profile fields and references to earlier messages
+PERSONAL_PATTERN = re.compile(
+    r"\b(i|me|my|mine|myself|we|our|us|"
+    r"gpa|grade|grades|transcript|credit|credits|shu|shus|visa|f1|opt|cpt|international|"
+    r"it|that|this|these|those|they|them|above|previous|earlier)\b"
+)
+SHAREABLE_CATEGORIES = {"2"}
+
+answer_cache = LRUCache(
+    "answers",
+    maxsize=config.get_int("answer_cache_size", 2000),
+    ttl=config.get_float("answer_cache_ttl", 3600)
+)
+
+_flights = {}  # key -> Future of the raw LLM response
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "coalesced": 0, "not_shared": 0, "uncacheable": 0, "personal": 0}
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def profile_key(user_profile):
+    """
+    The student context fields of the prompt (see prompt.get_student_context) an answer
+    may depend on, or None if the profile makes every answer personal.
+    """
+    if not STUDENT_CONTEXT:
+        return "-"  # the prompt carries no profile fields
+    transcript = (user_profile or {}).get("transcript") or {}
+    if transcript.get("completed_courses"):
+        return None  # the saved courses and the degree audit are in the prompt
+    program = normalize(transcript.get("program")) or "-"
+    return f"{program}|{is_international_student(transcript) or '-'}"
+
+
+def question_key(question, user_profile=None):
+    """
+    Cache key of a question asked by a student with this profile, or None if the
+    answer may depend on the student's own context.
+    """
+    normalized = normalize(question)
+    if not normalized or PERSONAL_PATTERN.search(normalized):
+        return None
+    tokens = [token for token in normalized.split() if token not in STOPWORDS]
+    if not tokens:
+        return None
+    profile = profile_key(user_profile)
+    if profile is None:
+        return None
+    return f"{get_corpus_version()}:{profile}:{' '.join(tokens)}"
+
+
+def is_shareable(raw_response):
+    """
+    Only general handbook answers (category 2 without an escalation payload) are shared.
+    """
+    try:
+        parsed = json.loads(raw_response)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(parsed, dict) and parsed.get("category_id") in SHAREABLE_CATEGORIES \
+        and not parsed.get("rocketChatPayload")
+
+
+def get_or_generate(question, generate, user_profile=None):
+    """
+    Return the raw LLM response for question, from the cache, from an identical
+    call already in flight, or by calling generate().
+    """
+    key = question_key(question, user_profile) if ANSWER_CACHE_ENABLED else None
+    if key is None:
+        if ANSWER_CACHE_ENABLED:
+            _count("personal")
+        return generate()
+
+    cached = answer_cache.get(key)
+    if cached is not None:
+        _count("hits")
+        logger.info(f"Answer cache hit for '{question}'")
+        return cached
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = Future()
+            _flights[key] = flight
+
+    if not leader:
+        try:
+            shared = flight.result(FLIGHT_WAIT)
+        except TimeoutError:
+            shared = None
+        if shared is not None:
+            _count("coalesced")
+            logger.info(f"Shared an in-flight answer for '{question}'")
+            return shared
+        # the leader's answer was not a general one, or it failed
+        _count("not_shared")
+        return generate()
+
+    _count("misses")
+    raw_response = None
+    shareable = False
+    try:
+        raw_response = generate()
+        shareable = is_shareable(raw_response)
+        if shareable:
+            answer_cache.put(key, raw_response)
+        else:
+            _count("uncacheable")
+    finally:
+        # cached before the flight ends, so no request in between makes another call
+        with _lock:
+            _flights.pop(key, None)
+        flight.set_result(raw_response if shareable else None)
+    return raw_response
+
+
+async def aget_or_generate(question, agenerate, user_profile=None):
+    """
+    get_or_generate() for the asyncio serving mode: agenerate is a coroutine
+    function, and flights are shared with the threaded path.
+    """
+    key = question_key(question, user_profile) if ANSWER_CACHE_ENABLED else None
+    if key is None:
+        if ANSWER_CACHE_ENABLED:
+            _count("personal")
+        return await agenerate()
+
+    cached = answer_cache.get(key)
+    if cached is not None:
+        _count("hits")
+        logger.info(f"Answer cache hit for '{question}'")
+        return cached
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = Future()
+            _flights[key] = flight
+
+    if not leader:
+        try:
+            # shielded: a timeout must not cancel the shared flight
+            shared = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(flight)), FLIGHT_WAIT)
+        except asyncio.TimeoutError:
+            shared = None
+        if shared is not None:
+            _count("coalesced")
+            logger.info(f"Shared an in-flight answer for '{question}'")
+            return shared
+        _count("not_shared")
+        return await agenerate()
+
+    _count("misses")
+    raw_response = None
+    shareable = False
+    try:
+        raw_response = await agenerate()
+        shareable = is_shareable(raw_response)
+        if shareable:
+            answer_cache.put(key, raw_response)
+        else:
+            _count("uncacheable")
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.set_result(raw_response if shareable else None)
+    return raw_response
+
+
+def answer_cache_stats():
+    """
+    Hits, coalesced calls and cache size; every hit or coalesced call saved one LLM call.
+    """
+    with _lock:
+        result = dict(_counters)
+        result["in_flight"] = len(_flights)
+    result["llm_calls_saved"] = result["hits"] + result["coalesced"]
+    result["cache"] = answer_cache.stats()
+    return result
@@ -0,0 +1,289 @@
+"""
+Degree audit for CS Advising Bot.
+Evaluates the transcript saved through /student-info against the M.S. in
+Computer Science course requirements of the CS Graduate Handbook Supplement
+(resources/cs-handbook.txt), so the prompt gets a short computed summary
+instead of leaving the LLM to apply the rules to the raw course list.
+Only transcripts whose saved program is the M.S. are audited. Audits are
+cached per transcript.
+"""
+
+import re
+import json
+import hashlib
+import logging
+
+from utils.config import config
+from utils.cache import LRUCache
+from utils.catalog import parse_course_id
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FAST_PATH = config.get_bool("degree_audit_fast_path", False)
+
+# M.S. in Computer Science, from the CS Graduate Handbook Supplement
+MSCS_RULES = {
+    "courses_required": 10,        # "10 total courses, each of 3 SHUs or more"
+    "shus_required": 30,           # "M.S. students must earn 30 SHUs"
+    "min_course_shus": 3,
+    "min_cs_courses": 6,           # fewer CS courses needs prior approval (Appendix F)
+    "max_research_courses": 2,     # "8-10 standard courses", "0-2 research courses"
+    "min_course_number": 100,      # "no graduate course credit for any course numbered less than 100"
+    "competency_grade": "B-",      # "at least a B- in a course ... to satisfy the relevant course-competency requirement"
+    "standing_average": 3.0,       # "a grade average of at least a B"
+    "max_below_b_minus": 1,        # "earning no more than one grade below B-"
+    "research_courses": {"cs191", "cs293", "cs295", "cs296", "cs297", "cs298"},
+    "once_only": {"cs191", "cs293"},  # "This course can be taken at most once."
+    "no_credit": {"cs199", "cs299", "cs401", "cs402", "cs404", "cs405", "cs406", "cs501", "cs502"},
+    # Appendix E areas with the Tufts courses that fill them (old COMP numbers included)
+    "competencies": {
+        "Computer Architecture and Assembly Language": {"cs40", "cs111", "cs112", "cs114", "cs116", "cs118",
+                                                        "cs146", "ee126", "cs107", "cs181", "cs140"},
+        "Programming Languages": {"cs105", "cs21", "cs86", "cs121", "cs180", "cs107", "cs181"},
+        "Data Structures and Analysis of Algorithms": {"cs160"},
+        "Theory of Computation": {"cs170"}
+    }
+}
+
+GRADE_POINTS = {
+    "A+": 4.0, "A": 4.0, "A-": 3.7, "B+": 3.3, "B": 3.0, "B-": 2.7, "C+": 2.3, "C": 2.0,
+    "C-": 1.7, "D+": 1.3, "D": 1.0, "D-": 0.7, "F": 0.0
+}
+PASSING_GRADES = {"P", "S", "CR", "PASS"}  # passed without grade points
+IN_PROGRESS_GRADES = {"", "IP", "I", "INC", "N/A", "NA", "TBD"}
+
+PROGRESS_PATTERN = re.compile(
+    r"\b(am i on track|on track to graduate|degree (audit|progress)|my (degree )?progress|"
+    r"can i graduate|(what|which) (requirements|courses) do i (still )?(need|have left)|"
+    r"how many (more )?(courses|credits|shus) do i (still )?(need|have left)|remaining requirements)\b"
+)
+
+# free-text program field of /student-info: "MSCS", "M.S. Computer Science", "Master's", ...
+MS_PROGRAM_PATTERN = re.compile(r"\b(m\.?\s?s\.?(\s?cs)?|mscs|master'?s?)(\b|$)")
+OTHER_PROGRAM_PATTERN = re.compile(r"\b(ph\.?\s?d|doctor|b\.?\s?s\b|bachelor|undergrad|certificate)")
+
+audit_cache = LRUCache(
+    "audits",
+    maxsize=config.get_int("audit_cache_size", 5000),
+    ttl=config.get_float("audit_cache_ttl", 86400)
+)
+
+
+def _canonical(key):
+    """
+    COMP and CS numbers name the same courses; sections do not matter to the rules.
+    """
+    key = key.split("-")[0]
+    return "cs" + key[4:] if key.startswith("comp") else key
+
+
+def _number(key):
+    match = re.search(r"\d+", key)
+    return int(match.group(0)) if match else 0
+
+
+def _credits(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _grade(value):
+    return str(value or "").strip().upper()
+
+
+def audit_transcript(transcript, rules=MSCS_RULES):
+    """
+    Evaluate a saved transcript against the M.S. course requirements.
+
+    Courses without a grade are treated as in progress and only listed. Returns
+    counted courses, SHUs, competency areas, excluded courses with the reason,
+    good-standing figures and what is still missing.
+    """
+    transcript = transcript or {}
+    counted, excluded, in_progress = [], [], []
+    competencies = {area: None for area in rules["competencies"]}
+    research_used = 0
+    seen_once_only = set()
+    grade_points, graded_shus, below_b_minus = 0.0, 0.0, 0
+    competency_floor = GRADE_POINTS[rules["competency_grade"]]
+
+    for course in transcript.get("completed_courses") or []:
+        course_id = str(course.get("course_id") or "").strip()
+        key = parse_course_id(course_id)
+        canonical = _canonical(key) if key else None
+        grade = _grade(course.get("grade"))
+        shus = _credits(course.get("credits_earned"))
+        label = course_id or course.get("course_name") or "unknown course"
+
+        if grade in IN_PROGRESS_GRADES:
+            in_progress.append(label)
+            continue
+
+        points = GRADE_POINTS.get(grade)
+        if points is not None and shus > 0:
+            grade_points += points * shus
+            graded_shus += shus
+            if points < competency_floor:
+                below_b_minus += 1
+        passed = grade in PASSING_GRADES or (points is not None and points > 0.0)
+
+        if canonical and passed and (points is None or points >= competency_floor):
+            for area, courses in rules["competencies"].items():
+                if competencies[area] is None and canonical in courses:
+                    competencies[area] = label
+
+        reason = None
+        if not passed:
+            reason = "not passed"
+        elif not canonical:
+            reason = "course number not recognized"
+        elif canonical in rules["no_credit"] or _number(canonical) >= 400:
+            reason = "does not count toward the degree"
+        elif _number(canonical) < rules["min_course_number"]:
+            reason = "numbered below 100, no graduate credit"
+        elif shus < rules["min_course_shus"]:
+            reason = f"fewer than {rules['min_course_shus']} SHUs"
+        elif canonical in rules["once_only"] and canonical in seen_once_only:
+            reason = "can be taken at most once"
+        elif canonical in rules["research_courses"] and research_used >= rules["max_research_courses"]:
+            reason = f"more than {rules['max_research_courses']} research courses"
+
+        if reason:
+            excluded.append({"course": label, "reason": reason})
+            continue
+        if canonical in rules["once_only"]:
+            seen_once_only.add(canonical)
+        research = canonical in rules["research_courses"]
+        research_used += research
+        counted.append({"course": label, "shus": shus, "research": research, "cs": canonical.startswith("cs")})
+
+    shus_counted = sum(course["shus"] for course in counted)
+    cs_courses = sum(1 for course in counted if course["cs"])
+    average = round(grade_points / graded_shus, 2) if graded_shus else None
+    missing_competencies = [area for area, course in competencies.items() if course is None]
+    remaining_courses = max(0, rules["courses_required"] - len(counted))
+    remaining_shus = max(0.0, rules["shus_required"] - shus_counted)
+    good_standing = (average is None or average >= rules["standing_average"]) and \
+        below_b_minus <= rules["max_below_b_minus"]
+
+    return {
+        "courses_counted": len(counted),
+        "courses_required": rules["courses_required"],
+        "shus_counted": shus_counted,
+        "shus_required": rules["shus_required"],
+        "research_courses": research_used,
+        "max_research_courses": rules["max_research_courses"],
+        "cs_courses": cs_courses,
+        "min_cs_courses": rules["min_cs_courses"],
+        "competencies": competencies,
+        "missing_competencies": missing_competencies,
+        "counted": [course["course"] for course in counted],
+        "excluded": excluded,
+        "in_progress": in_progress,
+        "grade_average": average,
+        "grades_below_b_minus": below_b_minus,
+        "good_standing": good_standing,
+        "remaining_courses": remaining_courses,
+        "remaining_shus": remaining_shus,
+        "complete": not remaining_courses and not remaining_shus and not missing_competencies
+                    and cs_courses >= rules["min_cs_courses"] and good_standing
+    }
+
+
+def is_ms_program(program):
+    """
+    Whether a saved program names the M.S. in Computer Science, the only rules audited here.
+    """
+    program = (program or "").strip().lower()
+    return bool(MS_PROGRAM_PATTERN.search(program)) and not OTHER_PROGRAM_PATTERN.search(program)
+
+
+def _transcript_key(transcript):
+    return hashlib.sha1(json.dumps(transcript, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def get_audit(user_profile):
+    """
+    Audit of the profile's saved transcript, or None if it lists no courses or
+    the saved program is not the M.S. (the rules would not apply).
+
+    Cached on the transcript content: the profile version is bumped on every
+    message (last_k), while the transcript only changes through /student-info.
+    """
+    transcript = (user_profile or {}).get("transcript") or {}
+    if not transcript.get("completed_courses") or not is_ms_program(transcript.get("program")):
+        return None
+    key = _transcript_key(transcript)
+    audit = audit_cache.get(key)
+    if audit is None:
+        audit = audit_transcript(transcript)
+        audit_cache.put(key, audit)
+    return audit
+
+
+def _format_shus(value):
+    return f"{value:g}"
+
+
+def format_audit(audit):
+    """
+    Compact prompt lines summarising an audit.
+    """
+    if not audit:
+        return "not available (no courses saved)"
+    competencies = "; ".join(f"{area}: {course or 'missing'}" for area, course in audit["competencies"].items())
+    lines = [
+        f"  - Courses counted toward the 10-course requirement: {audit['courses_counted']}/{audit['courses_required']} "
+        f"({_format_shus(audit['shus_counted'])}/{audit['shus_required']} SHUs, "
+        f"{audit['research_courses']} research, {audit['cs_courses']} CS)",
+        f"  - Core competencies (B- or better): {competencies}",
+        f"  - Grade average: {audit['grade_average'] if audit['grade_average'] is not None else 'n/a'}, "
+        f"grades below B-: {audit['grades_below_b_minus']}, good standing: {'yes' if audit['good_standing'] else 'no'}"
+    ]
+    if audit["excluded"]:
+        lines.append("  - Not counted: " + "; ".join(f"{item['course']} ({item['reason']})" for item in audit["excluded"]))
+    if audit["in_progress"]:
+        lines.append("  - In progress (no grade yet): " + ", ".join(audit["in_progress"]))
+    return "\n".join(lines)
+
+
+def is_progress_question(text):
+    return bool(PROGRESS_PATTERN.search((text or "").lower()))
+
+
+def format_audit_answer(audit):
+    """
+    Student-facing answer to an "am I on track" question, built from the audit alone.
+    """
+    lines = [":kirby: Here is where you stand, based on the transcript you saved:\n"]
+    lines.append(f"- **Courses**: {audit['courses_counted']} of {audit['courses_required']} counted "
+                 f"({_format_shus(audit['shus_counted'])} of {audit['shus_required']} SHUs)")
+    for area, course in audit["competencies"].items():
+        lines.append(f"- **{area}**: {'covered by ' + course if course else '**not yet covered**'}")
+    if audit["excluded"]:
+        lines.append("- **Not counted**: " + "; ".join(f"{item['course']} ({item['reason']})" for item in audit["excluded"]))
+    if audit["in_progress"]:
+        lines.append("- **In progress**: " + ", ".join(audit["in_progress"]))
+    if not audit["good_standing"]:
+        lines.append("- ⚠️ Your grades are below the good-standing rule (a B average with at most one grade below B-).")
+
+    if audit["complete"]:
+        lines.append("\nYou appear to meet the M.S. course requirements.")
+    else:
+        remaining = []
+        if audit["remaining_courses"]:
+            remaining.append(f"{audit['remaining_courses']} more course(s) ({_format_shus(audit['remaining_shus'])} SHUs)")
+        elif audit["remaining_shus"]:
+            remaining.append(f"{_format_shus(audit['remaining_shus'])} more SHUs")
+        if audit["missing_competencies"]:
+            remaining.append("the " + ", ".join(audit["missing_competencies"]) + " competency")
+        if audit["cs_courses"] < audit["min_cs_courses"]:
+            remaining.append(f"{audit['min_cs_courses'] - audit['cs_courses']} more CS course(s), since at least "
+                             f"{audit['min_cs_courses']} are required unless your plan was approved")
+        if remaining:
+            lines.append("\nStill needed: " + "; ".join(remaining) + ".")
+    lines.append("\nThis is computed from the [CS Graduate Handbook Supplement](https://tufts.app.box.com/v/cs-grad-handbook-supplement) "
+                 "rules; competencies filled elsewhere must be certified by the department.")
+    return "\n".join(lines)
@@ -0,0 +1,395 @@
+"""
+Course catalog index for CS Advising Bot.
+Parses resources/courses.txt into course entries keyed by course id and
+cross-listed alias, with each course's prerequisites parsed into a graph, so
+course lookups and prerequisite checks need neither RAG nor an LLM call. The
+parsed catalog is cached as compact JSON next to the source file.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+from utils.config import config
+
+logger = logging.getLogger(__name__)
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+CATALOG_SOURCE = os.path.join(RESOURCES_DIR, "courses.txt")
+CATALOG_PATH = config.get("course_catalog_path", os.path.join(RESOURCES_DIR, "course_catalog.json"))
+CATALOG_FORMAT = 1  # bump when the parsed structure changes
+MAX_PROMPT_COURSES = 5
+
+HEADER_PATTERN = re.compile(r"^## (.+?):\s*(.+)$")
+FIELD_PATTERN = re.compile(r"^\*\*(\w+):\*\*\s*(.*)$")
+# "COMP 15", "cs160", "CS 193-CC", "EE126"
+COURSE_PATTERN = re.compile(r"\b(comp|cs|ds|ee|es|math)\s*-?\s*(\d{1,3})(?:-([a-z]{2,4})\b)?", re.IGNORECASE)
+# a bare number continuing a list, e.g. the 72 in "MATH 70 or 72"
+REFERENCE_PATTERN = re.compile(r"\b(?:(comp|cs|ds|ee|es|math)\s*-?\s*)?(\d{1,3})\b")
+CONSENT_PATTERN = re.compile(r"\b(consent|permission)\b")
+STANDING_PATTERN = re.compile(r"\bstanding\b")
+EQUIVALENT_DEPARTMENTS = {"comp": "cs", "cs": "comp"}  # the CS department's old and new prefixes
+
+
+def course_key(department, number, section=None):
+    """
+    Lookup key of a course id, e.g. ("CS", "160") -> "cs160", ("COMP", "250", "VIS") -> "comp250-vis".
+    """
+    key = f"{department.lower()}{int(number)}"
+    return f"{key}-{section.lower()}" if section else key
+
+
+def parse_course_id(text):
+    """
+    Return the lookup key of the first course id in text, or None.
+    """
+    match = COURSE_PATTERN.search(text or "")
+    return course_key(*match.groups()) if match else None
+
+
+def display_id(key):
+    match = re.match(r"([a-z]+)(\d+)(?:-([a-z]+))?$", key)
+    if not match:
+        return key.upper()
+    department, number, section = match.groups()
+    return f"{department.upper()} {number}" + (f"-{section.upper()}" if section else "")
+
+
+def _references(text, department=None):
+    """
+    Course keys named in text, carrying the department over bare numbers.
+    Returns the keys and the last department seen.
+    """
+    keys = []
+    for match in REFERENCE_PATTERN.finditer(text):
+        if match.group(1):
+            department = match.group(1).lower()
+        elif department is None:
+            continue
+        keys.append(course_key(department, match.group(2)))
+    return keys, department
+
+
+def parse_prerequisites(text):
+    """
+    Parse free-text prerequisites into clauses that must all be met, each met by any
+    one of its courses ("or_other" marks clauses that a non-course condition such as
+    graduate standing also meets). The raw text is always kept alongside.
+    """
+    normalized = (text or "").lower().replace("computer science", "cs")
+    if not normalized or "not specified" in normalized:
+        return {"all_of": [], "recommended": False, "consent": False, "standing": False}
+
+    # "COMP/MATH 22" -> "comp 22 or math 22", "EE126/COMP146" -> "ee126 or comp146"
+    normalized = re.sub(r"\b([a-z]{2,4})/([a-z]{2,4})\s*(\d{1,3})", r"\1 \3 or \2 \3", normalized)
+    normalized = normalized.replace("/", " or ").replace("(", " ").replace(")", " ")
+    normalized = re.sub(r"\b(either|one of)\b", " ", normalized)
+    # "any 100+ MATH course", "a CS course numbered 100 or higher" are not course ids
+    normalized = re.sub(r"\b\d{1,3}\+|\bnumbered \d{1,3}( or higher)?", " ", normalized)
+
+    clauses = []
+    department = None
+    for part in re.split(r";|\band\b", normalized):
+        listed = part.split(",")
+        if sum(1 for piece in listed if re.search(r"\bor\b", piece)) > 1:
+            # "MATH 51 or 153, MATH 70 or 72": one clause per comma
+            pieces = [re.split(r"\bor\b", piece) for piece in listed]
+        elif re.search(r"\bor\b", part):
+            # "COMP 10, 11, or some programming experience": one list of alternatives
+            pieces = [re.split(r"\bor\b|,", part)]
+        else:
+            pieces = [[piece] for piece in part.split(",")]
+        for alternatives in pieces:
+            courses, other = [], False
+            for alternative in alternatives:
+                # the department carries over to bare numbers ("MATH 70 or 72")
+                found, department = _references(alternative, department)
+                if found:
+                    courses.extend(key for key in found if key not in courses)
+                elif alternative.strip(" .,"):
+                    other = True
+            if courses:
+                clauses.append({"any_of": courses, "or_other": other})
+
+    return {
+        "all_of": clauses,
+        "recommended": "recommend" in normalized,
+        "consent": bool(CONSENT_PATTERN.search(normalized)),
+        "standing": bool(STANDING_PATTERN.search(normalized))
+    }
+
+
+def parse_catalog(text):
+    """
+    Split the markdown catalog into course entries.
+    """
+    courses = []
+    current, field = None, None
+    for line in text.splitlines():
+        header = HEADER_PATTERN.match(line.strip())
+        if header:
+            ids = [part.strip() for part in header.group(1).split("/")]
+            keys = [key for key in (parse_course_id(course_id) for course_id in ids) if key]
+            if not keys:
+                current = None
+                continue
+            current = {"id": display_id(keys[0]), "key": keys[0], "aliases": keys[1:],
+                       "title": header.group(2).strip(), "summary": "", "prerequisites": ""}
+            courses.append(current)
+            field = None
+            continue
+        if current is None:
+            continue
+        match = FIELD_PATTERN.match(line.strip())
+        if match:
+            field = {"summary": "summary", "prerequisites": "prerequisites"}.get(match.group(1).lower())
+            line = match.group(2)
+        if field and line.strip():
+            current[field] = f"{current[field]} {line.strip()}".strip()
+
+    for course in courses:
+        # a trailing "/" at a line break (e.g. "CS/ MATH 61") is a cross-listing, not a gap
+        course["summary"] = course["summary"].replace("/ ", "/")
+        course["prerequisites"] = course["prerequisites"].replace("/ ", "/")
+        course["requires"] = parse_prerequisites(course["prerequisites"])
+    return courses
+
+
+def _source_hash():
+    digest = hashlib.sha256(f"format {CATALOG_FORMAT}\n".encode("utf-8"))
+    with open(CATALOG_SOURCE, 'rb') as file:
+        digest.update(file.read())
+    return digest.hexdigest()
+
+
+class CourseCatalog:
+    """
+    Course entries with an alias index and the reverse prerequisite graph.
+    """
+
+    def __init__(self, courses, source_hash=None):
+        self.courses = courses
+        self.source_hash = source_hash
+        self._by_key = {}  # course key or alias -> indices into courses
+        for i, course in enumerate(courses):
+            for key in [course["key"]] + course["aliases"]:
+                self._by_key.setdefault(key, []).append(i)
+        # sections share their base number ("comp250" -> COMP 250-SCS and COMP 250-VIS)
+        for i, course in enumerate(courses):
+            for key in [course["key"]] + course["aliases"]:
+                base = key.split("-")[0]
+                if base != key and base not in self._by_key:
+                    self._by_key.setdefault(f"~{base}", []).append(i)
+        self._unlocks = {}  # course key -> ids of courses that list it as a prerequisite
+        for course in courses:
+            for clause in course["requires"]["all_of"]:
+                for key in clause["any_of"]:
+                    for resolved in self.resolve(key) or [key]:
+                        unlocked = self._unlocks.setdefault(resolved, [])
+                        if course["id"] not in unlocked:
+                            unlocked.append(course["id"])
+
+    def _indices(self, key):
+        for candidate in (key, f"~{key}"):
+            if candidate in self._by_key:
+                return self._by_key[candidate]
+        department = re.match(r"[a-z]+", key).group(0)
+        if department in EQUIVALENT_DEPARTMENTS:
+            # COMP 160 is CS 160, but not when the course was renumbered
+            # (COMP 181 is listed as CS 107, so CS 181 is a different course)
+            swapped = EQUIVALENT_DEPARTMENTS[department] + key[len(department):]
+            for candidate in (swapped, f"~{swapped}"):
+                indices = [i for i in self._by_key.get(candidate, [])
+                           if not any(alias.startswith(department) and alias[len(department)].isdigit()
+                                      for alias in [self.courses[i]["key"]] + self.courses[i]["aliases"])]
+                if indices:
+                    return indices
+        return []
+
+    def resolve(self, key):
+        """
+        Primary keys of the catalog courses a key or alias refers to (COMP and CS are interchangeable).
+        """
+        return [self.courses[i]["key"] for i in self._indices(key)]
+
+    def lookup(self, course_id):
+        """
+        Catalog entries for a course id such as "CS 160", "comp160" or "CS 121" (cross-listed).
+        """
+        key = parse_course_id(course_id)
+        return [self.courses[i] for i in self._indices(key)] if key else []
+
+    def find_courses(self, text, limit=MAX_PROMPT_COURSES):
+        """
+        Catalog entries for every course id mentioned in text, in order of mention.
+        """
+        found = []
+        for match in COURSE_PATTERN.finditer(text or ""):
+            for i in self._indices(course_key(*match.groups())):
+                if self.courses[i] not in found:
+                    found.append(self.courses[i])
+        return found[:limit]
+
+    def unlocks(self, course_id):
+        """
+        Ids of the catalog courses that list course_id among their prerequisites.
+        """
+        key = parse_course_id(course_id)
+        if not key:
+            return []
+        keys = self.resolve(key) or [key]
+        department = re.match(r"[a-z]+", key).group(0)
+        if department in EQUIVALENT_DEPARTMENTS:
+            keys.append(EQUIVALENT_DEPARTMENTS[department] + key[len(department):])
+        result = []
+        for candidate in keys:
+            for course in self._unlocks.get(candidate, []):
+                if course not in result:
+                    result.append(course)
+        return result
+
+    def _completed_keys(self, completed):
+        keys = set()
+        for course_id in completed:
+            key = parse_course_id(str(course_id))
+            if not key:
+                continue
+            keys.add(key)
+            keys.update(self.resolve(key))
+            department = re.match(r"[a-z]+", key).group(0)
+            if department in EQUIVALENT_DEPARTMENTS:
+                keys.add(EQUIVALENT_DEPARTMENTS[department] + key[len(department):])
+        return keys
+
+    def check_prerequisites(self, course_id, completed):
+        """
+        Compare a course's parsed prerequisites with a list of completed course ids.
+
+        Returns None for an unknown course, otherwise the unmet clauses, whether the
+        prerequisites are only recommended, and whether instructor consent or standing
+        can substitute for them.
+        """
+        courses = self.lookup(course_id)
+        if not courses:
+            return None
+        course = courses[0]
+        done = self._completed_keys(completed)
+        missing = []
+        for clause in course["requires"]["all_of"]:
+            if not any(key in done or set(self.resolve(key)) & done for key in clause["any_of"]):
+                missing.append({"any_of": [display_id(key) for key in clause["any_of"]], "or_other": clause["or_other"]})
+        return {
+            "course": course["id"],
+            "title": course["title"],
+            "prerequisites": course["prerequisites"],
+            "met": not missing,
+            "missing": missing,
+            "recommended_only": course["requires"]["recommended"],
+            "consent_accepted": course["requires"]["consent"],
+            "standing_mentioned": course["requires"]["standing"]
+        }
+
+    def to_dict(self, course):
+        """
+        JSON view of an entry, with display ids and the courses it unlocks.
+        """
+        return {
+            "id": course["id"],
+            "aliases": [display_id(key) for key in course["aliases"]],
+            "title": course["title"],
+            "summary": course["summary"],
+            "prerequisites": course["prerequisites"],
+            "requires": [[display_id(key) for key in clause["any_of"]] for clause in course["requires"]["all_of"]],
+            "unlocks": self.unlocks(course["id"])
+        }
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({"source_hash": self.source_hash, "courses": self.courses}, file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        return cls(data["courses"], data.get("source_hash"))
+
+
+def build_catalog():
+    with open(CATALOG_SOURCE, 'r', encoding='utf-8') as file:
+        return CourseCatalog(parse_catalog(file.read()), _source_hash())
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def is_course_catalog_enabled():
+    return config.get_bool("course_catalog_enabled", True)
+
+
+def get_catalog():
+    """
+    Return the process-wide catalog, loading it from CATALOG_PATH when it is up to
+    date and otherwise parsing courses.txt (and trying to save it for the next start).
+    """
+    global _catalog
+    if _catalog is not None:
+        return _catalog
+
+    with _catalog_lock:
+        if _catalog is not None:
+            return _catalog
+
+        started = time.time()
+        source_hash = _source_hash()
+        if os.path.exists(CATALOG_PATH):
+            try:
+                catalog = CourseCatalog.load(CATALOG_PATH)
+                if catalog.source_hash == source_hash:
+                    _catalog = catalog
+                    logger.info(f"Loaded course catalog from {CATALOG_PATH} in {1000 * (time.time() - started):.1f} ms")
+                    return _catalog
+            except Exception as e:
+                logger.warning(f"Could not load course catalog {CATALOG_PATH}: {str(e)}")
+
+        catalog = build_catalog()
+        try:
+            catalog.save(CATALOG_PATH)
+        except OSError as e:
+            logger.warning(f"Could not save course catalog to {CATALOG_PATH}: {str(e)}")
+        _catalog = catalog
+        logger.info(f"Parsed course catalog ({len(catalog.courses)} courses) in {1000 * (time.time() - started):.1f} ms")
+        return _catalog
+
+
+def format_courses(courses):
+    """
+    Format catalog entries as a prompt section.
+    """
+    sections = []
+    for course in courses:
+        names = " / ".join([course["id"]] + [display_id(key) for key in course["aliases"]])
+        sections.append(f"### {names}: {course['title']}\n"
+                        f"Summary: {course['summary']}\n"
+                        f"Prerequisites: {course['prerequisites'] or 'Not specified.'}")
+    return "\n\n".join(sections)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    catalog = build_catalog()
+    catalog.save(CATALOG_PATH)
+    print(f"Saved {len(catalog.courses)} courses to {CATALOG_PATH}")
+    for course_id in sys.argv[1:]:
+        started = time.perf_counter()
+        courses = catalog.lookup(course_id)
+        elapsed = 1000 * (time.perf_counter() - started)
+        print(f"\n{course_id!r} ({elapsed:.3f} ms)")
+        for course in courses:
+            print(json.dumps(catalog.to_dict(course), indent=2))
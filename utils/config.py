@@ -0,0 +1,52 @@
+"""
+Configuration for CS Advising Bot.
+Settings come from the environment, with the .env file loaded once, on first
+use, no matter which module reads a setting first. Variables already set in the
+environment take precedence over .env. Modules read settings through ``config``
+rather than calling load_dotenv() and os.environ themselves.
+"""
+
+import os
+import threading
+
+from dotenv import load_dotenv
+
+
+class Config:
+    """
+    Typed access to environment settings.
+    """
+
+    def __init__(self):
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                load_dotenv()
+                self._loaded = True
+
+    def get(self, name, default=None):
+        self._load()
+        return os.environ.get(name, default)
+
+    def get_int(self, name, default):
+        return int(self.get(name, default))
+
+    def get_float(self, name, default):
+        return float(self.get(name, default))
+
+    def get_bool(self, name, default=False):
+        """
+        True if the setting is "true" (any case); unset settings take the default.
+        """
+        value = self.get(name)
+        if value is None:
+            return default
+        return value.lower() == "true"
+
+
+config = Config()
@@ -0,0 +1,204 @@
+"""
+Shared handbook corpus for CS Advising Bot.
+Hashes the reference documents in resources/, ingests each unique document
+once into a shared LLM proxy session and records the result in MongoDB so
+that every worker (and every student) retrieves from the same corpus.
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import datetime
+
+from pymongo import ReturnDocument
+
+from llmproxy import pdf_upload
+from utils.config import config
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+HANDBOOK_FILES = ["cs_handbook.pdf", "soe-grad-handbook.pdf", "filtered_grad_courses.pdf"]
+CORPUS_SESSION_PREFIX = "cs-advising-corpus-"
+
+# status values stored in the registry
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# a pending record older than this was left by a worker that died mid-upload
+STALE_PENDING = config.get_float("corpus_stale_pending", 600)  # seconds
+
+_corpus_version = None
+_ingested_locally = set()
+_lock = threading.Lock()
+
+
+def is_shared_corpus_enabled():
+    """
+    Shared corpus retrieval is opt-in: the LLM proxy must honour ``rag_session_id``.
+    """
+    return config.get_bool("shared_corpus_enabled")
+
+
+def file_digest(path):
+    """
+    Compute the sha256 hex digest of a file, reading it in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_corpus_documents():
+    """
+    Return the handbook documents as (filename, sha256) pairs, deduplicated by content.
+    """
+    documents = []
+    seen = set()
+    for filename in HANDBOOK_FILES:
+        sha256 = file_digest(os.path.join(RESOURCES_DIR, filename))
+        if sha256 in seen:
+            logger.info(f"{filename} has the same content as an earlier document, skipping")
+            continue
+        seen.add(sha256)
+        documents.append((filename, sha256))
+    return documents
+
+
+def get_corpus_version():
+    """
+    Content hash of the whole corpus. Changes whenever any handbook changes.
+    """
+    global _corpus_version
+    if _corpus_version is None:
+        combined = hashlib.sha256()
+        for filename, sha256 in get_corpus_documents():
+            combined.update(f"{filename}:{sha256}\n".encode("utf-8"))
+        _corpus_version = combined.hexdigest()[:12]
+    return _corpus_version
+
+
+def get_corpus_session_id():
+    """
+    Proxy session that holds the shared corpus for the current corpus version.
+    """
+    return CORPUS_SESSION_PREFIX + get_corpus_version()
+
+
+def _claim_document(registry, filename, sha256, session_id):
+    """
+    Atomically claim ingestion of a document. Returns True if this process should upload it.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    previous = registry.find_one_and_update(
+        {"sha256": sha256, "session_id": session_id},
+        {"$setOnInsert": {
+            "filename": filename,
+            "corpus_version": get_corpus_version(),
+            "status": STATUS_PENDING,
+            "created_at": now
+        }},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        return True
+
+    # a failed or stale ingestion can be retried by whoever flips it back to pending first
+    status = previous.get("status")
+    created_at = previous.get("created_at")
+    stale = created_at is not None and (now - created_at.replace(tzinfo=datetime.timezone.utc)).total_seconds() > STALE_PENDING
+    if status == STATUS_FAILED or (status == STATUS_PENDING and stale):
+        result = registry.update_one(
+            {"_id": previous["_id"], "status": status, "created_at": created_at},
+            {"$set": {"status": STATUS_PENDING, "created_at": now}}
+        )
+        if result.modified_count == 1 and status == STATUS_PENDING:
+            logger.warning(f"Reclaiming {filename}, left pending since {created_at}")
+        return result.modified_count == 1
+    return False
+
+
+def _upload_document(filename, session_id):
+    response = pdf_upload(
+        path=os.path.join(RESOURCES_DIR, filename),
+        session_id=session_id,
+        strategy='smart'
+    )
+    return response, isinstance(response, str) and response.startswith("Successfully")
+
+
+def ensure_corpus_ingested():
+    """
+    Ingest every unique handbook document into the shared corpus session exactly once.
+
+    Returns:
+        bool: True if every document is ingested (now or previously), False otherwise
+    """
+    session_id = get_corpus_session_id()
+    registry = get_collection("handbooks", "corpus")
+    all_ready = True
+
+    for filename, sha256 in get_corpus_documents():
+        if registry is None:
+            # no registry available: fall back to ingesting once per process
+            with _lock:
+                if (sha256, session_id) in _ingested_locally:
+                    continue
+                response, ok = _upload_document(filename, session_id)
+                if ok:
+                    _ingested_locally.add((sha256, session_id))
+            logger.warning(f"MongoDB unavailable, ingested {filename} without registry: {response}")
+            all_ready = all_ready and ok
+            continue
+
+        if not _claim_document(registry, filename, sha256, session_id):
+            doc = registry.find_one({"sha256": sha256, "session_id": session_id}, {"status": 1})
+            all_ready = all_ready and doc is not None and doc.get("status") == STATUS_READY
+            continue
+
+        response, ok = _upload_document(filename, session_id)
+        registry.update_one(
+            {"sha256": sha256, "session_id": session_id},
+            {"$set": {
+                "status": STATUS_READY if ok else STATUS_FAILED,
+                "response": response,
+                "ingested_at": datetime.datetime.now(datetime.timezone.utc)
+            }}
+        )
+        if ok:
+            logger.info(f"✅ {filename} ingested into shared corpus {session_id}")
+        else:
+            logger.error(f"❌ Error ingesting {filename} into shared corpus {session_id}: {response}")
+        all_ready = all_ready and ok
+
+    return all_ready
+
+
+def start_corpus_ingestion():
+    """
+    Ingest the shared corpus in a background thread so worker boot is not delayed.
+    """
+    if not is_shared_corpus_enabled():
+        return None
+
+    def _run():
+        try:
+            ensure_corpus_ingested()
+        except Exception as e:
+            logger.error(f"Error ingesting shared corpus: {str(e)}")
+
+    thread = threading.Thread(target=_run, name="corpus-ingestion", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(f"corpus version {get_corpus_version()} -> session {get_corpus_session_id()}")
+    print("ready" if ensure_corpus_ingested() else "incomplete")
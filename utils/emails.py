@@ -3,128 +3,449 @@
 """
 Email notification module for CS Advising Bot.
 Handles sending email notifications to human advisors.
+
+Escalations are written to an outbox (MongoDB ``emails.outbox``, or memory when
+MongoDB is unavailable) and sent by a background thread over one reused,
+authenticated SMTP connection, so the escalation path of /query never waits
+for the SMTP handshake. With ``email_digest_interval`` set, escalations that
+arrive within one interval are merged into a single digest email.
 """
 
+import sys
+import time
+import socket
 import logging
 import smtplib
+import datetime
+import threading
+from collections import deque
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from dotenv import load_dotenv
 import os
 
-# Load environment variables from .env file
-load_dotenv()
-SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")  # Default to Gmail
-SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))  # Default to TLS port
-EMAIL_USER = os.environ.get("EMAIL_USER")
-EMAIL_PASSWORD = os.environ.get("EMAIL_PASSWORD")
-ADVISOR_EMAIL = os.environ.get("ADVISOR_EMAIL")
+from pymongo import ReturnDocument
 
-# Set up logging
-logger = logging.getLogger(__name__)
+from utils.config import config
+from utils import metrics
+from utils.mongo_config import get_collection
 
+SMTP_SERVER = config.get("SMTP_SERVER", "smtp.gmail.com")  # Default to Gmail
+SMTP_PORT = config.get_int("SMTP_PORT", 587)  # Default to TLS port
+SMTP_USE_TLS = config.get_bool("SMTP_USE_TLS", True)  # false for a local debugging server
+EMAIL_USER = config.get("EMAIL_USER")
+EMAIL_PASSWORD = config.get("EMAIL_PASSWORD")
+ADVISOR_EMAIL = config.get("ADVISOR_EMAIL")
 
-def send_notification_email(student_username, student_question, llm_answer, uncertain_areas, is_initial_escalation):
-    if not os.environ.get("email_enabled") or os.environ.get("email_enabled").lower() != "true":
-        logger.info("Email feature disabled")
-        return
+EMAIL_DIGEST_INTERVAL = config.get_float("email_digest_interval", 0)  # seconds; 0 sends each email on its own
+EMAIL_BATCH_SIZE = config.get_int("email_batch_size", 20)  # emails sent per wake-up of the sender
+EMAIL_POLL_INTERVAL = config.get_float("email_poll_interval", 5)  # picks up emails queued by other workers
+SMTP_IDLE_TIMEOUT = config.get_float("smtp_idle_timeout", 60)  # seconds before an idle connection is checked
+EMAIL_MAX_ATTEMPTS = 5
+STALE_SENDING = 300  # seconds after which an email claimed by a dead sender is retried
 
-    if not all([EMAIL_USER, EMAIL_PASSWORD, ADVISOR_EMAIL]):
-        logger.warning("Email credentials not configured. Skipping email notification.")
-        return
-    
-    try:
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = ADVISOR_EMAIL
-        
-        if is_initial_escalation:
-            msg['Subject'] = f"🚨 ALERT: New CS Advising Escalation from {student_username}"
-            body = f"""
-<html>
-<head>
+# outbox states
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+EMAIL_STYLE = """
     <style>
-        body {{
+        body {
             font-family: Arial, sans-serif;
             background-color: #f9f9f9;
             padding: 20px;
-        }}
-        .container {{
+        }
+        .container {
             background-color: #ffffff;
             padding: 20px;
             border-radius: 8px;
             box-shadow: 0 2px 4px rgba(0,0,0,0.1);
             max-width: 600px;
             margin: auto;
-        }}
-        h2 {{
+        }
+        h2 {
             color: #333366;
-        }}
-        h3 {{
+        }
+        h3 {
             color: #444444;
-        }}
-        p {{
+        }
+        p {
             line-height: 1.5;
             color: #333333;
-        }}
-        .footer {{
+        }
+        .footer {
             font-size: 0.9em;
             color: #888888;
             margin-top: 30px;
             border-top: 1px solid #eeeeee;
             padding-top: 10px;
-        }}
+        }
     </style>
-</head>
-<body>
-    <div class="container">
-        <h2>🚨 New Escalation Alert</h2>
-        <p>Student <b>{student_username}</b> has requested help that requires your attention.</p>
-        
+"""
+
+EMAIL_FOOTER = """
+        <p><strong>➡️ Please log in to RocketChat to respond to this message.</strong></p>
+
+        <div class="footer">
+            <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
+        </div>
+"""
+
+
+def is_email_enabled():
+    return config.get_bool("email_enabled")
+
+
+def escalation_section(item):
+    return f"""
+        <p>Student <b>{item['student_username']}</b> has requested help that requires your attention.</p>
+
         <h3>📝 Student Question:</h3>
-        <p>{student_question}</p>
+        <p>{item['student_question']}</p>
 
         <h3>🤖 AI-Generated Response:</h3>
-        <p>{llm_answer}</p>
+        <p>{item['llm_answer']}</p>
 
         <h3>❓ Uncertain Areas:</h3>
-        <p>{uncertain_areas}</p>
+        <p>{item['uncertain_areas']}</p>
+"""
 
-        <p><strong>➡️ Please log in to RocketChat to respond to this message.</strong></p>
 
-        <div class="footer">
-            <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
-        </div>
-    </div>
+def build_escalation_email(item):
+    """
+    One email for one escalation.
+    """
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_USER
+    msg['To'] = ADVISOR_EMAIL
+    msg['Subject'] = f"🚨 ALERT: New CS Advising Escalation from {item['student_username']}"
+    body = f"""
+<html>
+<head>{EMAIL_STYLE}</head>
+<body>
+    <div class="container">
+        <h2>🚨 New Escalation Alert</h2>{escalation_section(item)}{EMAIL_FOOTER}    </div>
+</body>
+</html>
+"""
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+def build_digest_email(items):
+    """
+    One email summarising every escalation in a digest interval.
+    """
+    students = sorted({item['student_username'] for item in items})
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_USER
+    msg['To'] = ADVISOR_EMAIL
+    msg['Subject'] = f"🚨 ALERT: {len(items)} new CS Advising Escalations from {', '.join(students)}"
+    sections = "\n        <hr>\n".join(escalation_section(item) for item in items)
+    body = f"""
+<html>
+<head>{EMAIL_STYLE}</head>
+<body>
+    <div class="container">
+        <h2>🚨 {len(items)} New Escalation Alerts</h2>{sections}{EMAIL_FOOTER}    </div>
 </body>
 </html>
 """
-        # else:
-        #     msg['Subject'] = f"💬 New Thread Message from {student_username}"
-        #     body = f"""
-        #     <html>
-        #     <body>
-        #         <h2>New Message in Existing Thread</h2>
-        #         <p>Student <b>{student_username}</b> has sent a new message in an active thread.</p>
-        #         <h3>Message Content:</h3>
-        #         <p>{message_text}</p>
-        #         <p>Please log in to RocketChat to continue the conversation.</p>
-        #         <hr>
-        #         <p><i>This is an automated message from the Tufts CS Advising Bot.</i></p>
-        #     </body>
-        #     </html>
-        #     """
-        
-        msg.attach(MIMEText(body, 'html'))
-        
-        # Connect to server and send
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(EMAIL_USER, EMAIL_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        
-        logger.info(f"Email notification sent to advisor for message from {student_username}")
-        
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+class SmtpConnection:
+    """
+    One SMTP connection kept open between sends. It is re-checked with NOOP after
+    being idle and re-established once if the server has dropped it.
+    """
+
+    def __init__(self, host=SMTP_SERVER, port=SMTP_PORT, user=EMAIL_USER, password=EMAIL_PASSWORD, use_tls=SMTP_USE_TLS):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self._server = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def _connect(self):
+        self.close()
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        if self.use_tls:
+            server.starttls()
+        if self.password:
+            server.login(self.user, self.password)
+        self._server = server
+        self.connects += 1
+
+    def _ensure_connected(self):
+        if self._server is None:
+            self._connect()
+        elif time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            try:
+                if self._server.noop()[0] != 250:
+                    self._connect()
+            except (smtplib.SMTPException, OSError):
+                self._connect()
+
+    def send(self, msg):
+        with metrics.span("email.smtp"):
+            self._ensure_connected()
+            try:
+                self._server.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, OSError):
+                self._connect()
+                self._server.send_message(msg)
+            self._last_used = time.monotonic()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+
+class Outbox:
+    """
+    Durable queue of escalation emails drained by one background sender thread.
+
+    The sender is started lazily (after gunicorn forks). Every worker's sender
+    claims emails atomically, so emails queued by one worker may be sent by another.
+    """
+
+    def __init__(self, database_name="emails", collection_name="outbox"):
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self.connection = SmtpConnection()
+        self._memory = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._idle = threading.Event()
+        self._queued = 0
+        self._sent = 0
+        self._emails = 0
+        self._failed = 0
+
+    @property
+    def collection(self):
+        return get_collection(self.database_name, self.collection_name)
+
+    @property
+    def worker_id(self):
+        # read per call: a forked worker must not claim emails under its parent's id
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def start(self):
+        # a sender started before a fork does not exist in the forked worker
+        if self._thread and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._sender, name="email-sender", daemon=True)
+            self._thread.start()
+            mode = f"digest every {EMAIL_DIGEST_INTERVAL:g}s" if EMAIL_DIGEST_INTERVAL > 0 else "immediate"
+            logger.info(f"Started email sender ({mode})")
+
+    def put(self, item):
+        item = {**item, "status": STATUS_PENDING, "attempts": 0,
+                "created_at": datetime.datetime.now(datetime.timezone.utc)}
+        try:
+            collection = self.collection
+            if collection is None:
+                raise RuntimeError("MongoDB unavailable")
+            collection.insert_one(item)
+        except Exception as e:
+            logger.warning(f"Outbox not persisted ({str(e)}), keeping email in memory")
+            self._memory.append(item)
+        with self._stats_lock:
+            self._queued += 1
+            self._idle.clear()
+        self.start()
+        self._wakeup.set()
+
+    def _claim(self, limit):
+        items = []
+        while self._memory and len(items) < limit:
+            items.append(self._memory.popleft())
+
+        collection = self.collection
+        if collection is None:
+            return items
+        now = datetime.datetime.now(datetime.timezone.utc)
+        # emails claimed by a sender that died before finishing go back to pending
+        collection.update_many(
+            {"status": STATUS_SENDING, "claimed_at": {"$lt": now - datetime.timedelta(seconds=STALE_SENDING)}},
+            {"$set": {"status": STATUS_PENDING}}
+        )
+        while len(items) < limit:
+            doc = collection.find_one_and_update(
+                {"status": STATUS_PENDING},
+                {"$set": {"status": STATUS_SENDING, "claimed_at": now, "sender": self.worker_id}},
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not doc:
+                break
+            items.append(doc)
+        return items
+
+    def _finish(self, items, error=None):
+        persisted = [item["_id"] for item in items if "_id" in item]
+        if error is None:
+            if persisted:
+                self.collection.update_many(
+                    {"_id": {"$in": persisted}},
+                    {"$set": {"status": STATUS_SENT, "sent_at": datetime.datetime.now(datetime.timezone.utc)}}
+                )
+            with self._stats_lock:
+                self._sent += len(items)
+            return
+
+        logger.error(f"Failed to send email notification: {str(error)}")
+        for item in items:
+            attempts = item.get("attempts", 0) + 1
+            status = STATUS_FAILED if attempts >= EMAIL_MAX_ATTEMPTS else STATUS_PENDING
+            if status == STATUS_FAILED:
+                with self._stats_lock:
+                    self._failed += 1
+            if "_id" in item:
+                self.collection.update_one(
+                    {"_id": item["_id"]},
+                    {"$set": {"status": status, "attempts": attempts, "error": str(error)}}
+                )
+            elif status == STATUS_PENDING:
+                self._memory.append({**item, "attempts": attempts})
+
+    def _send(self, items):
+        if EMAIL_DIGEST_INTERVAL > 0 and len(items) > 1:
+            batches = [(items, build_digest_email(items))]
+        else:
+            batches = [([item], build_escalation_email(item)) for item in items]
+        for batch, msg in batches:
+            try:
+                self.connection.send(msg)
+            except Exception as e:
+                self._finish(batch, e)
+                continue
+            self._finish(batch)
+            with self._stats_lock:
+                self._emails += 1
+            logger.info(f"Email notification sent to advisor for {len(batch)} escalation(s)")
+
+    def _has_pending(self):
+        if self._memory:
+            return True
+        collection = self.collection
+        return collection is not None and collection.find_one({"status": STATUS_PENDING}, {"_id": 1}) is not None
+
+    def _sender(self):
+        while True:
+            # polled in digest mode too, so emails left by a previous process or queued
+            # by other workers go out without waiting for a put() in this one
+            self._wakeup.wait(EMAIL_POLL_INTERVAL)
+            self._wakeup.clear()
+            limit = max(EMAIL_BATCH_SIZE, 100) if EMAIL_DIGEST_INTERVAL > 0 else EMAIL_BATCH_SIZE
+
+            try:
+                if EMAIL_DIGEST_INTERVAL > 0 and self._has_pending():
+                    # collect the rest of the interval's escalations into the same digest;
+                    # nothing is claimed yet, so a long interval cannot make the claim stale
+                    time.sleep(EMAIL_DIGEST_INTERVAL)
+                items = self._claim(limit)
+                if items:
+                    self._send(items)
+                    if len(items) >= limit:
+                        self._wakeup.set()  # more may be waiting
+                        continue
+                elif time.monotonic() - self.connection._last_used > SMTP_IDLE_TIMEOUT:
+                    self.connection.close()
+            except Exception as e:
+                logger.error(f"Error draining email outbox: {str(e)}")
+                time.sleep(1.0)
+            self._idle.set()
+
+    def flush(self, timeout=60):
+        """
+        Wake the sender and wait until it has gone idle. Returns True if it did in time.
+        """
+        self.start()
+        self._idle.clear()
+        self._wakeup.set()
+        return self._idle.wait(timeout)
+
+    def stats(self):
+        try:
+            collection = self.collection
+            pending = collection.count_documents({"status": STATUS_PENDING}) if collection is not None else None
+        except Exception as e:
+            logger.error(f"Error reading outbox depth: {str(e)}")
+            pending = None
+        with self._stats_lock:
+            return {
+                "enabled": is_email_enabled(),
+                "digest_interval": EMAIL_DIGEST_INTERVAL,
+                "pending": pending,
+                "pending_in_memory": len(self._memory),
+                "queued": self._queued,
+                "sent_escalations": self._sent,
+                "emails_sent": self._emails,
+                "failed": self._failed,
+                "smtp_connects": self.connection.connects
+            }
+
+
+outbox = Outbox()
+
+
+def start_email_outbox():
+    """
+    Start the sender so emails left in the outbox by a previous process are sent.
+    """
+    if is_email_enabled():
+        outbox.start()
+
+
+def send_notification_email(student_username, student_question, llm_answer, uncertain_areas, is_initial_escalation):
+    if not is_email_enabled():
+        logger.info("Email feature disabled")
+        return
+
+    if not all([EMAIL_USER, ADVISOR_EMAIL]) or (SMTP_USE_TLS and not EMAIL_PASSWORD):
+        logger.warning("Email credentials not configured. Skipping email notification.")
+        return
+
+    # for now, only the initial escalation is emailed to the human advisor
+    if not is_initial_escalation:
+        return
+
+    try:
+        outbox.put({
+            "student_username": student_username,
+            "student_question": student_question,
+            "llm_answer": llm_answer,
+            "uncertain_areas": uncertain_areas
+        })
     except Exception as e:
-        logger.error(f"Failed to send email notification: {str(e)}")
+        logger.error(f"Failed to queue email notification: {str(e)}")
+
+
+if __name__ == "__main__":
+    # python -m utils.emails test   (sends a sample escalation through the outbox)
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] != ["test"]:
+        sys.exit("usage: python -m utils.emails test")
+    os.environ["email_enabled"] = "true"
+    send_notification_email("test-student", "Can I take CS 160 before CS 15?", "Sample answer.", "Sample uncertainty.", True)
+    print("flushed" if outbox.flush() else "timed out", outbox.stats())
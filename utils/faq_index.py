@@ -0,0 +1,193 @@
+"""
+In-memory FAQ match index for CS Advising Bot.
+Matches incoming questions against the freq_questions.questions collection
+using normalized-token and character n-gram vectors with a cosine threshold,
+so a confident hit can be answered from the stored answer without an LLM call.
+"""
+
+import re
+import math
+import time
+import logging
+import threading
+
+from utils.config import config
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+MATCH_THRESHOLD = config.get_float("faq_match_threshold", 0.85)
+REFRESH_INTERVAL = config.get_float("faq_index_refresh", 300)  # seconds, picks up edits made by other workers
+NGRAM_SIZE = 3
+TOKEN_WEIGHT = 2.0  # whole-word overlap counts more than shared character n-grams
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("a an the is are do does i my me to of for in on at and or what how can".split())
+
+
+def normalize(text):
+    """
+    Lowercase, drop punctuation and collapse whitespace; also joins "CS 160" into "cs160".
+    """
+    text = re.sub(r"\b([a-z]{2,4})\s*-?\s*(\d{2,3})\b", r"\1\2", (text or "").lower())
+    return " ".join(TOKEN_PATTERN.findall(text))
+
+
+def vectorize(text):
+    """
+    Build an L2-normalized sparse vector (dict) of token and character n-gram features.
+    """
+    normalized = normalize(text)
+    vector = {}
+    for token in normalized.split():
+        if token not in STOPWORDS:
+            key = "w:" + token
+            vector[key] = vector.get(key, 0.0) + TOKEN_WEIGHT
+    padded = f" {normalized} "
+    for i in range(len(padded) - NGRAM_SIZE + 1):
+        key = "c:" + padded[i:i + NGRAM_SIZE]
+        vector[key] = vector.get(key, 0.0) + 1.0
+
+    norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+    if norm:
+        for key in vector:
+            vector[key] /= norm
+    return vector
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(key, 0.0) for key, weight in a.items())
+
+
+class FaqIndex:
+    """
+    FAQ entries keyed by their Mongo ``_id`` (as a string), with match statistics.
+    """
+
+    def __init__(self, threshold=MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loaded_at = None  # last load attempt, successful or not
+        self._refreshing = False
+        self._changes = None  # /faqs writes made while a reload reads the collection
+        self.hits = 0
+        self.misses = 0
+
+    def reload(self):
+        """
+        Rebuild the whole index from freq_questions.questions and swap it in; matching
+        keeps using the current index meanwhile.
+        """
+        collection = get_collection("freq_questions", "questions")
+        if collection is None:
+            logger.error("Error loading FAQ index: MongoDB unavailable")
+            return
+        with self._lock:
+            self._changes = {}
+        try:
+            entries = {}
+            for doc in collection.find({"question": {"$exists": True}}):
+                entries[str(doc["_id"])] = self._make_entry(doc)
+        finally:
+            with self._lock:
+                changes, self._changes = self._changes, None
+        with self._lock:
+            # upserts and removals made during the read may be missing from it
+            for doc_id, entry in changes.items():
+                if entry is None:
+                    entries.pop(doc_id, None)
+                else:
+                    entries[doc_id] = entry
+            self._entries = entries
+        logger.info(f"FAQ index loaded with {len(entries)} questions")
+
+    def _ensure_fresh(self):
+        """
+        Load the index on first use; after that it is rebuilt on a background thread
+        every REFRESH_INTERVAL seconds, never on the request path.
+        """
+        if self._loaded_at is not None and time.time() - self._loaded_at <= REFRESH_INTERVAL:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        if self._loaded_at is None:
+            self._refresh()
+        else:
+            threading.Thread(target=self._refresh, name="faq-index-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"Error loading FAQ index: {str(e)}")
+        finally:
+            with self._lock:
+                # a failed load is retried after the interval too, not on every request
+                self._loaded_at = time.time()
+                self._refreshing = False
+
+    @staticmethod
+    def _make_entry(doc):
+        return {
+            "question": doc.get("question", ""),
+            "answer": doc.get("answer", ""),
+            "suggestedQuestions": doc.get("suggestedQuestions") or [],
+            "question_id": doc.get("question_id"),
+            "vector": vectorize(doc.get("question", ""))
+        }
+
+    def upsert(self, doc_id, doc):
+        """
+        Add or replace a single FAQ entry after it was written through /faqs.
+        """
+        entry = self._make_entry(doc)
+        with self._lock:
+            self._entries[str(doc_id)] = entry
+            if self._changes is not None:
+                self._changes[str(doc_id)] = entry
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._entries.pop(str(doc_id), None)
+            if self._changes is not None:
+                self._changes[str(doc_id)] = None
+
+    def match(self, query):
+        """
+        Return the best FAQ entry (with its "score") if it clears the threshold, else None.
+        """
+        self._ensure_fresh()
+        vector = vectorize(query)
+        best, best_score = None, 0.0
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            score = cosine(vector, entry["vector"])
+            if score > best_score:
+                best, best_score = entry, score
+
+        with self._lock:
+            if best is not None and best_score >= self.threshold:
+                self.hits += 1
+                return {**best, "score": round(best_score, 4)}
+            self.misses += 1
+            return None
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0
+            }
+
+
+faq_index = FaqIndex()
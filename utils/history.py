@@ -0,0 +1,132 @@
+"""
+Per-student conversation history kept in MongoDB (``Users.history``).
+
+Each document holds a capped array of recent turns and a rolling summary of
+everything older. The prompt gets the summary plus the last ``history_window``
+turns, so its size no longer grows with the number of messages a student has
+sent (the proxy's server-side ``lastk`` history is not used). Once more than
+``history_window + history_summary_batch`` turns have piled up, the oldest ones
+are folded into the summary by a background job, never on the request path.
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReturnDocument
+
+from llmproxy import generate
+from prompt import SUMMARY_PROMPT
+from utils.config import config
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MODE = config.get("conversation_history", "local").lower()  # "local" or "proxy" (server-side lastk)
+HISTORY_WINDOW = config.get_int("history_window", 6)  # recent turns sent verbatim
+HISTORY_SUMMARY_BATCH = config.get_int("history_summary_batch", 6)  # extra turns that trigger a summary
+HISTORY_MAX_TURNS = config.get_int("history_max_turns", 40)  # hard cap if summaries fall behind
+MAX_TURN_CHARS = 2000
+
+_summary_pool = ThreadPoolExecutor(max_workers=config.get_int("history_summary_workers", 2),
+                                   thread_name_prefix="history-summary")
+_summarizing = set()
+_lock = threading.Lock()
+
+
+def is_local_history_enabled():
+    return HISTORY_MODE == "local"
+
+
+def _collection():
+    return get_collection("Users", "history")
+
+
+def get_history(user_id):
+    """
+    Return {"summary": str, "turns": [...]} with at most HISTORY_WINDOW recent turns.
+    """
+    collection = _collection()
+    doc = None
+    if collection is not None:
+        doc = collection.find_one({"user_id": user_id}, {"summary": 1, "turns": {"$slice": -HISTORY_WINDOW}})
+    doc = doc or {}
+    return {"summary": doc.get("summary", ""), "turns": doc.get("turns", [])}
+
+
+def record_exchange(user_id, question, answer):
+    """
+    Append a question/answer pair and schedule a summary if the backlog is long enough.
+    """
+    collection = _collection()
+    if collection is None:
+        return
+    now = time.time()
+    turns = [
+        {"role": "student", "text": (question or "")[:MAX_TURN_CHARS], "at": now},
+        {"role": "advisor", "text": (answer or "")[:MAX_TURN_CHARS], "at": now + 1e-6}
+    ]
+    doc = collection.find_one_and_update(
+        {"user_id": user_id},
+        {"$push": {"turns": {"$each": turns, "$slice": -HISTORY_MAX_TURNS}}},
+        projection={"turns.at": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if doc and len(doc.get("turns", [])) > HISTORY_WINDOW + HISTORY_SUMMARY_BATCH:
+        schedule_summary(user_id)
+
+
+def schedule_summary(user_id):
+    with _lock:
+        if user_id in _summarizing:
+            return
+        _summarizing.add(user_id)
+    _summary_pool.submit(_summarize, user_id)
+
+
+def _format_turns(turns):
+    return "\n".join(f"{turn['role']}: {turn['text']}" for turn in turns)
+
+
+def _summarize(user_id):
+    """
+    Fold every turn older than the window into the rolling summary.
+    """
+    try:
+        collection = _collection()
+        doc = collection.find_one({"user_id": user_id}, {"summary": 1, "turns": 1})
+        turns = (doc or {}).get("turns", [])
+        old_turns = turns[:-HISTORY_WINDOW] if HISTORY_WINDOW else turns
+        if not old_turns:
+            return
+
+        query = f"Current summary:\n{doc.get('summary') or '(none)'}\n\nNew turns:\n{_format_turns(old_turns)}"
+        response = generate(
+            model='4o-mini',
+            system=SUMMARY_PROMPT,
+            query=query,
+            temperature=0.0,
+            lastk=0,
+            session_id=f"cs-advising-summary-{user_id}",
+            rag_usage=False
+        )
+        if not isinstance(response, dict) or not response.get("response"):
+            logger.warning(f"Summary for {user_id} failed: {response}")
+            return
+
+        # remove exactly the folded turns; turns appended meanwhile are kept
+        collection.update_one(
+            {"user_id": user_id},
+            {
+                "$set": {"summary": response["response"].strip(), "summarized_at": time.time()},
+                "$pull": {"turns": {"at": {"$lte": old_turns[-1]["at"]}}}
+            }
+        )
+        logger.info(f"Folded {len(old_turns)} turns into the conversation summary of {user_id}")
+    except Exception as e:
+        logger.error(f"Error summarizing history of {user_id}: {str(e)}")
+    finally:
+        with _lock:
+            _summarizing.discard(user_id)
@@ -0,0 +1,269 @@
+"""
+Shared HTTP client for CS Advising Bot.
+Keeps one pooled, keep-alive session per host for the LLM proxy and RocketChat,
+applies explicit connect/read timeouts, retries idempotent calls with jittered
+backoff and records per-host pool statistics. ``arequest`` does the same on
+an httpx.AsyncClient for the asyncio serving mode (asgi.py).
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+from utils.config import config
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT = config.get_float("http_connect_timeout", 3.05)  # seconds
+READ_TIMEOUT = config.get_float("http_read_timeout", 30)  # seconds
+POOL_MAXSIZE = config.get_int("http_pool_maxsize", 20)  # connections kept per host
+MAX_RETRIES = config.get_int("http_max_retries", 2)
+ASYNC_MAX_CONNECTIONS = config.get_int("http_async_max_connections", 500)  # per host, asyncio mode
+BACKOFF_BASE = 0.2  # seconds
+BACKOFF_MAX = 2.0  # seconds
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+_sessions = {}
+_async_clients = {}  # (event loop id, host) -> httpx.AsyncClient
+_stats = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # pooled sockets must never be shared between a parent and its forked workers
+    global _lock
+    _sessions.clear()
+    _async_clients.clear()
+    _stats.clear()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url):
+    """
+    Return the pooled session for the host of ``url``, creating it on first use.
+    """
+    host = _host_key(url)
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+            _stats[host] = _new_stats()
+        return session
+
+
+def _new_stats():
+    return {"requests": 0, "errors": 0, "retries": 0, "in_flight": 0, "total_seconds": 0.0}
+
+
+def get_async_client(url):
+    """
+    Return the httpx.AsyncClient for the host of ``url`` on the running event loop.
+    """
+    import httpx  # only needed in the asyncio serving mode
+
+    key = (id(asyncio.get_running_loop()), _host_key(url))
+    client = _async_clients.get(key)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS, max_keepalive_connections=POOL_MAXSIZE)
+        )
+        with _lock:
+            _async_clients[key] = client
+            _stats.setdefault(f"{key[1]} (async)", _new_stats())
+    return client
+
+
+async def close_async_clients():
+    """
+    Close the async clients of the running event loop (ASGI lifespan shutdown).
+    """
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _async_clients if key[0] == loop_id]:
+        await _async_clients.pop(key).aclose()
+
+
+def _record(host, **deltas):
+    with _lock:
+        stats = _stats.get(host)
+        if stats is None:
+            return
+        for key, value in deltas.items():
+            stats[key] += value
+
+
+def _backoff(attempt):
+    # "full jitter": sleep a random amount up to the exponential cap
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def is_connect_error(error):
+    """
+    True if a requests exception means the connection was never established (refused,
+    unresolvable host, connect timeout), so the server cannot have seen the request.
+    A connection dropped after the request was sent ("Connection aborted") is not one.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = getattr(error.args[0], "reason", error.args[0])  # urllib3 wraps the cause in MaxRetryError
+    return isinstance(reason, NewConnectionError)
+
+
+def request(method, url, idempotent=False, timeout=None, retries=MAX_RETRIES, **kwargs):
+    """
+    Send an HTTP request through the pooled session for the target host.
+
+    Args:
+        method (str): HTTP method
+        url (str): Target URL
+        idempotent (bool): Whether the call is safe to repeat. Idempotent calls are
+            retried on connection errors, timeouts and 429/5xx responses; other calls
+            are only retried when the connection could not be established.
+        timeout (float or tuple): Read timeout, or a (connect, read) tuple
+        retries (int): Maximum number of retries
+
+    Returns:
+        requests.Response: The final response
+
+    Raises:
+        requests.exceptions.RequestException: If the last attempt failed
+    """
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (CONNECT_TIMEOUT, timeout)
+
+    session = get_session(url)
+    host = _host_key(url)
+    attempt = 0
+    while True:
+        started = time.time()
+        _record(host, requests=1, in_flight=1)
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except requests.exceptions.RequestException as e:
+            _record(host, errors=1, in_flight=-1, total_seconds=time.time() - started)
+            retryable = idempotent or is_connect_error(e)
+            if not retryable or attempt >= retries:
+                raise
+            logger.warning(f"{method} {url} failed ({e.__class__.__name__}), retrying")
+        else:
+            _record(host, in_flight=-1, total_seconds=time.time() - started)
+            if not (idempotent and response.status_code in RETRY_STATUS_CODES) or attempt >= retries:
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying")
+
+        _record(host, retries=1)
+        time.sleep(_backoff(attempt))
+        attempt += 1
+
+
+async def arequest(method, url, idempotent=False, timeout=None, retries=MAX_RETRIES, **kwargs):
+    """
+    Async version of request() on httpx, with the same timeouts, retry policy and
+    statistics. Returns an httpx.Response; raises httpx.HTTPError if the last attempt failed.
+    """
+    import httpx
+
+    if timeout is None:
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+    elif not isinstance(timeout, tuple):
+        timeout = (CONNECT_TIMEOUT, timeout)
+    connect_timeout, read_timeout = timeout
+
+    client = get_async_client(url)
+    host = f"{_host_key(url)} (async)"
+    attempt = 0
+    while True:
+        started = time.time()
+        _record(host, requests=1, in_flight=1)
+        try:
+            response = await client.request(method, url, timeout=httpx.Timeout(read_timeout, connect=connect_timeout), **kwargs)
+        except httpx.HTTPError as e:
+            _record(host, errors=1, in_flight=-1, total_seconds=time.time() - started)
+            retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+            if not retryable or attempt >= retries:
+                raise
+            logger.warning(f"{method} {url} failed ({e.__class__.__name__}), retrying")
+        except asyncio.CancelledError:
+            # e.g. the losing copy of a hedged LLM call
+            _record(host, in_flight=-1, total_seconds=time.time() - started)
+            raise
+        else:
+            _record(host, in_flight=-1, total_seconds=time.time() - started)
+            if not (idempotent and response.status_code in RETRY_STATUS_CODES) or attempt >= retries:
+                return response
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying")
+
+        _record(host, retries=1)
+        await asyncio.sleep(_backoff(attempt))
+        attempt += 1
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+async def apost(url, **kwargs):
+    return await arequest("POST", url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def pool_stats():
+    """
+    Per-host request counters and connection pool usage, for sizing the pools under load.
+    """
+    with _lock:
+        result = {}
+        for host, session in _sessions.items():
+            stats = dict(_stats[host])
+            stats["avg_ms"] = round(1000 * stats.pop("total_seconds") / stats["requests"], 2) if stats["requests"] else 0.0
+            stats["pool_maxsize"] = POOL_MAXSIZE
+
+            connections = 0
+            idle = 0
+            adapter = session.get_adapter(host)
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                idle += sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            stats["connections_opened"] = connections
+            stats["idle_connections"] = idle
+            result[host] = stats
+        for host, stats in _stats.items():
+            if host.endswith(" (async)"):
+                stats = dict(stats)
+                stats["avg_ms"] = round(1000 * stats.pop("total_seconds") / stats["requests"], 2) if stats["requests"] else 0.0
+                result[host] = stats
+        return result
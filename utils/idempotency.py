@@ -0,0 +1,290 @@
+"""
+Webhook idempotency for CS Advising Bot.
+
+RocketChat retries an outgoing webhook when /query is slow to answer, so the
+same ``message_id`` can arrive more than once. Each message_id is claimed
+atomically in MongoDB (``webhooks.deliveries``, expired by a TTL index) and
+remembered in a process-local LRU. A duplicate of a message that is still being
+processed waits for the first result; a duplicate of a finished message gets
+the stored response back. Neither runs the handler again. Failures (exceptions,
+5xx responses and results wrapped in TransientResult) are not remembered, so
+RocketChat's retry is processed again.
+"""
+
+import os
+import time
+import socket
+import asyncio
+import logging
+import datetime
+import threading
+from concurrent.futures import Future, TimeoutError
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from utils.config import config
+from utils.cache import LRUCache
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL = config.get_int("idempotency_ttl", 86400)  # seconds a message_id is remembered
+IDEMPOTENCY_WAIT = config.get_float("idempotency_wait", 60)  # seconds a duplicate waits for the first
+IDEMPOTENCY_STALE = config.get_float("idempotency_stale", 300)  # claims older than this were abandoned
+POLL_INTERVAL = 0.25  # seconds between checks of a claim held by another process
+
+DUPLICATE_RESPONSE = ({"status": "duplicate"}, 200)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class TransientResult(tuple):
+    """
+    A (response, status code) handler result that is sent but not remembered, e.g. an
+    error or degraded reply returned with status 200 so RocketChat still shows it.
+    """
+
+    def __new__(cls, response, status_code):
+        return super().__new__(cls, (response, status_code))
+
+
+class Deliveries:
+    """
+    Runs a handler at most once per message_id, across threads and processes.
+    """
+
+    def __init__(self, database_name="webhooks", collection_name="deliveries"):
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self._results = LRUCache(
+            "deliveries",
+            maxsize=config.get_int("idempotency_cache_size", 10000),
+            ttl=IDEMPOTENCY_TTL
+        )
+        self._in_flight = {}  # message_id -> Future of the first delivery in this process
+        self._lock = threading.Lock()
+        self._counters = {"processed": 0, "duplicates": 0, "waited": 0, "replayed": 0, "timed_out": 0, "taken_over": 0}
+
+    @property
+    def collection(self):
+        return get_collection(self.database_name, self.collection_name)
+
+    @property
+    def owner(self):
+        # read per call, so a worker forked after import claims under its own id
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _enter(self, message_id):
+        """
+        Return (first, result, future): whether this is the first delivery of message_id
+        in this process, the remembered result, and the Future of the first delivery.
+        """
+        with self._lock:
+            result = self._results.get(message_id)
+            future = self._in_flight.get(message_id)
+            first = result is None and future is None
+            if first:
+                future = Future()
+                self._in_flight[message_id] = future
+        if not first:
+            self._count("duplicates")
+            if result is None:
+                self._count("waited")
+        return first, result, future
+
+    def _leave(self, message_id):
+        with self._lock:
+            self._in_flight.pop(message_id, None)
+
+    def _from_other(self, message_id, future, replay):
+        """
+        Wait for the process that owns message_id and return what a duplicate gets.
+        """
+        self._count("duplicates")
+        result = self._wait_for_other(message_id)
+        if result is not None:
+            self._results.put(message_id, result)
+        future.set_result(result or DUPLICATE_RESPONSE)
+        return self._replay(message_id, result, replay) if result is not None else DUPLICATE_RESPONSE
+
+    def _failed(self, message_id, future, error):
+        self._release(message_id)
+        future.set_exception(error)
+
+    def _finish(self, message_id, future, result):
+        self._count("processed")
+        if result[1] >= 500 or isinstance(result, TransientResult):
+            # not remembered, so RocketChat's retry is processed again
+            self._release(message_id)
+        else:
+            self._results.put(message_id, result)
+            self._store(message_id, result)
+        future.set_result(result)
+
+    def run(self, message_id, handler, replay=True):
+        """
+        Return handler() for the first delivery of message_id.
+
+        A duplicate gets the first delivery's result when replay is True (the webhook
+        response RocketChat is still waiting for), and DUPLICATE_RESPONSE otherwise.
+        """
+        if not message_id:
+            return handler()
+
+        first, result, future = self._enter(message_id)
+        if not first:
+            if result is None:
+                try:
+                    result = future.result(IDEMPOTENCY_WAIT)
+                except TimeoutError:
+                    self._count("timed_out")
+                    logger.warning(f"Gave up waiting for the first delivery of {message_id}")
+                    return DUPLICATE_RESPONSE
+                except Exception:
+                    return DUPLICATE_RESPONSE
+            return self._replay(message_id, result, replay)
+
+        try:
+            if not self._claim(message_id):
+                # another process owns this message_id
+                return self._from_other(message_id, future, replay)
+
+            try:
+                result = handler()
+            except BaseException as e:
+                self._failed(message_id, future, e)
+                raise
+            self._finish(message_id, future, result)
+            return result
+        finally:
+            self._leave(message_id)
+
+    async def arun(self, message_id, ahandler, replay=True):
+        """
+        run() for the asyncio serving mode: ahandler is a coroutine function, and the
+        MongoDB claim and bookkeeping run on worker threads.
+        """
+        if not message_id:
+            return await ahandler()
+
+        first, result, future = self._enter(message_id)
+        if not first:
+            if result is None:
+                try:
+                    # shielded: a timeout must not cancel the first delivery's Future
+                    result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), IDEMPOTENCY_WAIT)
+                except asyncio.TimeoutError:
+                    self._count("timed_out")
+                    logger.warning(f"Gave up waiting for the first delivery of {message_id}")
+                    return DUPLICATE_RESPONSE
+                except Exception:
+                    return DUPLICATE_RESPONSE
+            return self._replay(message_id, result, replay)
+
+        try:
+            if not await asyncio.to_thread(self._claim, message_id):
+                return await asyncio.to_thread(self._from_other, message_id, future, replay)
+
+            try:
+                result = await ahandler()
+            except BaseException as e:
+                await asyncio.to_thread(self._failed, message_id, future, e)
+                raise
+            await asyncio.to_thread(self._finish, message_id, future, result)
+            return result
+        finally:
+            self._leave(message_id)
+
+    def _replay(self, message_id, result, replay):
+        if not replay:
+            return DUPLICATE_RESPONSE
+        self._count("replayed")
+        logger.info(f"Returning the stored response for duplicate delivery of {message_id}")
+        return result
+
+    def _claim(self, message_id):
+        """
+        Atomically record message_id as being processed by this process. Claims
+        abandoned by a crashed process are taken over after IDEMPOTENCY_STALE seconds.
+        """
+        collection = self.collection
+        if collection is None:
+            return True
+        try:
+            collection.insert_one({"_id": message_id, "status": "processing", "owner": self.owner, "created_at": _now()})
+            return True
+        except DuplicateKeyError:
+            pass
+        except PyMongoError as e:
+            # fall back to the local check rather than dropping the message
+            logger.error(f"Error claiming delivery {message_id}: {e}")
+            return True
+
+        cutoff = _now() - datetime.timedelta(seconds=IDEMPOTENCY_STALE)
+        taken = collection.find_one_and_update(
+            {"_id": message_id, "status": "processing", "created_at": {"$lt": cutoff}},
+            {"$set": {"owner": self.owner, "created_at": _now()}}
+        )
+        if taken:
+            self._count("taken_over")
+            logger.warning(f"Taking over abandoned delivery {message_id} from {taken.get('owner')}")
+            return True
+        return False
+
+    def _wait_for_other(self, message_id):
+        """
+        Poll the claim of another process until it stores a response, or give up.
+        """
+        self._count("waited")
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while time.monotonic() < deadline:
+            doc = self.collection.find_one({"_id": message_id}, {"status": 1, "response": 1, "status_code": 1})
+            if not doc:
+                return None  # released after a failure; the retry is dropped rather than raced
+            if doc.get("status") == "done":
+                return doc.get("response"), doc.get("status_code", 200)
+            time.sleep(POLL_INTERVAL)
+        self._count("timed_out")
+        logger.warning(f"Gave up waiting for delivery {message_id} owned by another process")
+        return None
+
+    def _store(self, message_id, result):
+        collection = self.collection
+        if collection is None:
+            return
+        response, status_code = result
+        try:
+            collection.update_one(
+                {"_id": message_id},
+                {"$set": {"status": "done", "response": response, "status_code": status_code, "finished_at": _now()}}
+            )
+        except PyMongoError as e:
+            logger.error(f"Error storing the response of delivery {message_id}: {e}")
+
+    def _release(self, message_id):
+        """
+        Forget a claim whose handler failed, so a later retry is processed again.
+        """
+        collection = self.collection
+        if collection is None:
+            return
+        try:
+            collection.delete_one({"_id": message_id, "owner": self.owner})
+        except PyMongoError as e:
+            logger.error(f"Error releasing delivery {message_id}: {e}")
+
+    def stats(self):
+        with self._lock:
+            result = dict(self._counters)
+            result["in_flight"] = len(self._in_flight)
+        result["cache"] = self._results.stats()
+        return result
+
+
+deliveries = Deliveries()
@@ -0,0 +1,279 @@
+"""
+Background job queue for CS Advising Bot.
+Lets /query acknowledge RocketChat webhooks immediately and process the
+message on a pool of worker threads. Jobs are kept in an in-process queue
+or, for multi-node deployments, in a MongoDB collection shared by all nodes.
+"""
+
+import os
+import time
+import queue
+import socket
+import logging
+import datetime
+import threading
+
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from utils.config import config
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+QUERY_MODE = config.get("query_mode", "sync").lower()  # "sync" or "async"
+QUERY_WORKERS = config.get_int("query_workers", 4)
+QUERY_QUEUE_BACKEND = config.get("query_queue_backend", "memory").lower()  # "memory" or "mongo"
+MONGO_POLL_INTERVAL = config.get_float("query_queue_poll_interval", 0.2)  # seconds
+# a job running longer than this was left by a worker that crashed or was redeployed;
+# longer than idempotency_stale, so the rerun can take over the message's delivery claim
+JOB_TIMEOUT = config.get_float("query_job_timeout", 600)  # seconds
+JOB_MAX_ATTEMPTS = config.get_int("query_job_max_attempts", 3)  # a job that keeps killing its worker is given up
+SWEEP_INTERVAL = 60  # seconds between checks for jobs that ran out of attempts
+
+
+def is_async_mode():
+    return QUERY_MODE == "async"
+
+
+class MemoryBackend:
+    """
+    In-process FIFO queue. Jobs are lost if the process dies.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def put(self, payload):
+        self._queue.put((time.time(), payload))
+
+    def get(self, timeout):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def done(self, job, error=None):
+        self._queue.task_done()
+
+    def depth(self):
+        return self._queue.qsize()
+
+
+class MongoBackend:
+    """
+    MongoDB-backed queue shared by every node. Workers claim jobs atomically, and
+    a job left "running" by a dead worker is claimed again after JOB_TIMEOUT, up to
+    JOB_MAX_ATTEMPTS times before it is marked failed. While MongoDB is unreachable,
+    new jobs go to an in-process queue drained by this node's workers.
+    """
+
+    def __init__(self, database_name="jobs", collection_name="queries"):
+        self.database_name = database_name
+        self.collection_name = collection_name
+        self._fallback = MemoryBackend()
+        self._next_sweep = 0.0
+
+    @property
+    def collection(self):
+        return get_collection(self.database_name, self.collection_name)
+
+    @property
+    def worker_id(self):
+        # read per call, so a worker forked after import claims jobs under its own id
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def put(self, payload):
+        collection = self.collection
+        try:
+            if collection is None:
+                raise PyMongoError("no MongoDB connection")
+            collection.insert_one({
+                "payload": payload,
+                "status": "queued",
+                "enqueued_at": datetime.datetime.now(datetime.timezone.utc)
+            })
+        except PyMongoError as e:
+            # the message is still answered, by this node, rather than failing the webhook
+            logger.error(f"Error queueing job in MongoDB, queueing it in-process: {e}")
+            self._fallback.put(payload)
+
+    def _sweep(self, collection, now):
+        """
+        Mark failed the jobs whose workers stopped JOB_MAX_ATTEMPTS times before finishing them.
+        """
+        if time.monotonic() < self._next_sweep:
+            return
+        self._next_sweep = time.monotonic() + SWEEP_INTERVAL
+        result = collection.update_many(
+            {
+                "status": "running",
+                "started_at": {"$lt": now - datetime.timedelta(seconds=JOB_TIMEOUT)},
+                "attempts": {"$gte": JOB_MAX_ATTEMPTS}
+            },
+            {"$set": {
+                "status": "failed",
+                "error": f"gave up after {JOB_MAX_ATTEMPTS} attempts: the worker stopped or ran longer than {JOB_TIMEOUT:g}s",
+                "finished_at": now
+            }}
+        )
+        if result.modified_count:
+            logger.error(f"Gave up on {result.modified_count} jobs that ran out of attempts")
+
+    def get(self, timeout):
+        if self._fallback.depth():
+            job = self._fallback.get(timeout=0)
+            if job is not None:
+                return job
+        collection = self.collection
+        if collection is None:
+            time.sleep(min(timeout, MONGO_POLL_INTERVAL))
+            return None
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self._sweep(collection, now)
+        doc = collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued"},
+                {
+                    "status": "running",
+                    "started_at": {"$lt": now - datetime.timedelta(seconds=JOB_TIMEOUT)},
+                    "attempts": {"$not": {"$gte": JOB_MAX_ATTEMPTS}}
+                }
+            ]},
+            {
+                "$set": {"status": "running", "worker": self.worker_id, "started_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("enqueued_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not doc:
+            time.sleep(min(timeout, MONGO_POLL_INTERVAL))
+            return None
+        if doc["attempts"] > 1:
+            logger.warning(f"Reclaimed job {doc['_id']} (attempt {doc['attempts']}), its worker stopped before finishing it")
+        enqueued_at = doc["enqueued_at"].replace(tzinfo=datetime.timezone.utc).timestamp()
+        return enqueued_at, {"_job_id": doc["_id"], **doc["payload"]}
+
+    def done(self, job, error=None):
+        _, payload = job
+        if "_job_id" not in payload:
+            self._fallback.done(job, error)
+            return
+        self.collection.update_one(
+            {"_id": payload["_job_id"]},
+            {"$set": {
+                "status": "failed" if error else "done",
+                "error": str(error) if error else None,
+                "finished_at": datetime.datetime.now(datetime.timezone.utc)
+            }}
+        )
+
+    def depth(self):
+        collection = self.collection
+        queued = collection.count_documents({"status": "queued"}) if collection is not None else 0
+        return queued + self._fallback.depth()
+
+
+class JobQueue:
+    """
+    Runs ``handler(payload)`` for every submitted payload on a pool of worker threads.
+
+    Workers are started lazily on the first submit so the pool is created after
+    gunicorn forks, never in the master process.
+    """
+
+    def __init__(self, handler, workers=QUERY_WORKERS, backend=QUERY_QUEUE_BACKEND):
+        self.handler = handler
+        self.num_workers = max(1, workers)
+        self.backend = MongoBackend() if backend == "mongo" else MemoryBackend()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._busy = 0
+        self._busy_seconds = 0.0
+        self._started_at = None
+        self._processed = 0
+        self._failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            self._started_at = time.time()
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._worker, name=f"query-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            logger.info(f"Started {self.num_workers} query workers ({type(self.backend).__name__})")
+
+    def submit(self, payload):
+        self._ensure_started()
+        self.backend.put(payload)
+
+    def _worker(self):
+        while True:
+            try:
+                job = self.backend.get(timeout=1.0)
+            except Exception as e:
+                logger.error(f"Error fetching job: {str(e)}")
+                time.sleep(1.0)
+                continue
+            if job is None:
+                continue
+
+            enqueued_at, payload = job
+            started = time.time()
+            with self._stats_lock:
+                self._busy += 1
+                wait = started - enqueued_at
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+            error = None
+            try:
+                self.handler(payload)
+            except Exception as e:
+                error = e
+                logger.exception(f"Error processing job: {str(e)}")
+            finally:
+                with self._stats_lock:
+                    self._busy -= 1
+                    self._busy_seconds += time.time() - started
+                    self._processed += 1
+                    if error:
+                        self._failed += 1
+                try:
+                    self.backend.done(job, error)
+                except Exception as e:
+                    logger.error(f"Error marking job done: {str(e)}")
+
+    def stats(self):
+        """
+        Queue depth, wait time and worker utilisation for this process.
+        """
+        try:
+            depth = self.backend.depth()
+        except Exception as e:
+            logger.error(f"Error reading queue depth: {str(e)}")
+            depth = None
+
+        with self._stats_lock:
+            uptime = time.time() - self._started_at if self._started_at else 0.0
+            capacity = uptime * self.num_workers
+            return {
+                "mode": QUERY_MODE,
+                "backend": type(self.backend).__name__,
+                "depth": depth,
+                "workers": self.num_workers if self._threads else 0,
+                "busy_workers": self._busy,
+                "utilisation": round(self._busy_seconds / capacity, 4) if capacity else 0.0,
+                "processed": self._processed,
+                "failed": self._failed,
+                "avg_wait_ms": round(1000 * self._wait_total / self._processed, 2) if self._processed else 0.0,
+                "max_wait_ms": round(1000 * self._wait_max, 2)
+            }
@@ -1,34 +1,139 @@
+import os
+import gzip
+import json
+import atexit
+import queue
+import random
+import shutil
 import logging
-import logging.config
+import logging.handlers
 
-# Or from a dictionary
-def setup_logging():
-    config_dict = {
-        'version': 1,
-        'formatters': {
-            'standard': {
-                'format': '%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s'
-            },
-        },
-        'handlers': {
-            'console': {
-                'class': 'logging.StreamHandler',
-                'level': 'INFO',
-                'formatter': 'standard'
-            },
-            'file': {
-                'class': 'logging.FileHandler',
-                'filename': 'app.log',
-                'level': 'DEBUG',
-                'formatter': 'standard'
-            }
-        },
-        'loggers': {
-            '': {  # Root logger
-                'handlers': ['console', 'file'],
-                'level': 'DEBUG',
-                'propagate': True
-            }
+from utils.config import config
+
+LOG_LEVEL = config.get("log_level", "INFO").upper()
+LOG_FILE = config.get("log_file", "app.log")
+LOG_MAX_BYTES = config.get_int("log_max_bytes", 10 * 1024 * 1024)
+LOG_BACKUP_COUNT = config.get_int("log_backup_count", 5)
+# fraction of requests whose heavy payloads (webhook bodies, prompts, RAG context) are logged
+PAYLOAD_SAMPLE_RATE = config.get_float("log_payload_sample_rate", 0.01)
+# several gunicorn/uvicorn workers must not rotate one file: each writes its own
+WEB_WORKERS = config.get_int("web_workers", 1)
+
+_listener = None
+
+# attributes every LogRecord has; anything else was passed through `extra=`
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, location, message and any `extra=` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "location": f"{record.filename}:{record.lineno}",
+            "thread": record.threadName,
+            "message": record.getMessage()
         }
-    }
-    logging.config.dictConfig(config_dict)
\ No newline at end of file
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def log_file_name():
+    """
+    log_file, or with several web workers log_file with this process's pid (app.<pid>.log).
+    """
+    if WEB_WORKERS <= 1:
+        return LOG_FILE
+    root, ext = os.path.splitext(LOG_FILE)
+    return f"{root}.{os.getpid()}{ext}"
+
+
+def log_payload(logger, label, payload, sample_rate=None):
+    """
+    Log a large payload at DEBUG for a sampled fraction of calls. Nothing is
+    serialised unless DEBUG is enabled and the call is sampled.
+    """
+    rate = PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not logger.isEnabledFor(logging.DEBUG) or rate <= 0 or random.random() >= rate:
+        return
+    logger.debug("%s: %s", label, json.dumps(payload, default=str, ensure_ascii=False))
+
+
+def setup_logging():
+    """
+    Route all logging through a queue: request threads only enqueue records, and a
+    background QueueListener writes them to the console and to a size-rotated,
+    gzip-compressed JSON log file.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.setFormatter(logging.Formatter('%(asctime)s - %(filename)s:%(lineno)d - %(levelname)s - %(message)s'))
+
+    handlers = [console]
+    if LOG_FILE:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file_name(), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8", delay=True
+        )
+        file_handler.namer = _gzip_namer
+        file_handler.rotator = _gzip_rotator
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    # modules imported before setup_logging() (advisor, prompt, utils.*) keep their loggers;
+    # everything propagates to the root logger, which only enqueues
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def _reset_after_fork():
+    # the listener thread does not survive a fork (gunicorn --preload): start one for
+    # this worker, writing to its own file
+    global _listener
+    if _listener is not None:
+        _listener = None
+        setup_logging()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def stop_logging():
+    """
+    Flush queued records and stop the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,177 @@
+"""
+Per-stage latency histograms served in Prometheus text format from /metrics.
+
+A request (a /query message, a /student-info update) opens a context with
+request(); every span() inside it is buffered and recorded when the request
+ends, so all of its stages carry the request's final category_id. Spans outside
+a request (e.g. emails sent from a background thread) are recorded right away
+with category "none". Recording is a perf_counter pair and a list append per
+span plus one locked histogram update per stage, cheap enough to leave on.
+
+Metrics are per process: with several gunicorn workers each one serves its own.
+"""
+
+import time
+import bisect
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+from utils import startup
+from utils import resilience
+
+# seconds; spans range from in-memory lookups to LLM calls
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# category_ids 1-7 come from the LLM's JSON and the rest from the request path; anything
+# else is labelled "other", so malformed LLM output cannot add label series without bound
+CATEGORIES = frozenset(["1", "2", "3", "4", "5", "6", "7", "escalation", "thread", "faq", "audit", "none"])
+
+_current = contextvars.ContextVar("metrics_request", default=None)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram keyed by a tuple of label values.
+    """
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count]) for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {total}")
+            lines.append(f"{self.name}_count{{{label_text}}} {count}")
+        return "\n".join(lines)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+stage_duration = Histogram(
+    "chatbot_stage_duration_seconds",
+    "Time spent in each stage of a request.",
+    ["stage", "category", "outcome"]
+)
+request_duration = Histogram(
+    "chatbot_request_duration_seconds",
+    "End-to-end time of /query and /student-info requests.",
+    ["endpoint", "category", "outcome"]
+)
+
+
+class _Request:
+    __slots__ = ("spans", "category", "outcome")
+
+    def __init__(self):
+        self.spans = []
+        self.category = "none"
+        self.outcome = "ok"
+
+
+@contextmanager
+def request(endpoint):
+    """
+    Time a whole request and record its buffered spans with its final category and outcome.
+    """
+    current = _Request()
+    token = _current.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        _current.reset(token)
+        for stage, duration, outcome in current.spans:
+            stage_duration.observe((stage, current.category, outcome), duration)
+        request_duration.observe((endpoint, current.category, current.outcome), elapsed)
+        startup.first_request(endpoint, elapsed)
+
+
+def set_category(category):
+    """
+    Label the current request with the response category (a category_id or a path name).
+    """
+    current = _current.get()
+    if current is not None and category:
+        category = str(category)
+        current.category = category if category in CATEGORIES else "other"
+
+
+def set_outcome(outcome):
+    """
+    Override the current request's outcome ("ok", "error", "ignored", ...).
+    """
+    current = _current.get()
+    if current is not None:
+        current.outcome = outcome
+
+
+@contextmanager
+def span(stage):
+    """
+    Time one stage. Its outcome is "error" if the block raises.
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        current = _current.get()
+        if current is not None:
+            current.spans.append((stage, duration, outcome))
+        else:
+            stage_duration.observe((stage, "none", outcome), duration)
+
+
+def timed(stage):
+    """
+    Decorator form of span().
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render():
+    """
+    All histograms in Prometheus text exposition format (version 0.0.4).
+    """
+    return "\n".join([request_duration.render(), stage_duration.render(), startup.render(), resilience.render()]) + "\n"
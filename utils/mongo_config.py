@@ -1,41 +1,131 @@
 # utils/mongo_config.py
 import os
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import time
+import threading
+import contextvars
+from pymongo import MongoClient, ASCENDING, monitoring
+from pymongo.errors import PyMongoError
 import logging
 
-# Load environment variables from .env file
-load_dotenv()
+from utils.config import config
+from utils import startup
 
 # Setup log and mongodb
-MONGO_URI = os.environ.get("MONGO_URI")
+MONGO_URI = config.get("MONGO_URI")
 logger = logging.getLogger(__name__)
 
-# Create a global MongoDB client with connection pooling
-try:
-    MONGO_CLIENT = MongoClient(
+# Per-request MongoDB round-trip counter (None outside a counted request)
+_round_trips = contextvars.ContextVar("mongo_round_trips", default=None)
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """
+    Counts commands sent to MongoDB by the current request/job context.
+    """
+
+    def started(self, event):
+        counter = _round_trips.get()
+        if counter is not None:
+            counter[0] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def start_round_trip_count():
+    """
+    Start counting MongoDB round trips for the current request.
+    """
+    _round_trips.set([0])
+
+
+def get_round_trip_count():
+    """
+    Return the number of MongoDB round trips since start_round_trip_count(), or None.
+    """
+    counter = _round_trips.get()
+    return counter[0] if counter is not None else None
+
+
+def default_pool_size():
+    """
+    Threads of one process that can use MongoDB at once: the request threads of the
+    serving mode plus the query, query I/O and background pools.
+    """
+    if config.get("serve_mode", "wsgi") == "asgi":
+        request_threads = config.get_int("asgi_threads", 64)
+    else:
+        request_threads = config.get_int("web_threads", 16)
+    background = config.get_int("handbook_ingestion_workers", 4) + config.get_int("history_summary_workers", 2) + 2  # + email sender, FAQ refresh
+    return request_threads + config.get_int("query_workers", 4) + config.get_int("query_io_workers", 16) + background
+
+
+MAX_POOL_SIZE = config.get_int("mongo_max_pool_size", default_pool_size())
+MIN_POOL_SIZE = config.get_int("mongo_min_pool_size", 2)  # per process, so idle connections scale with workers
+RETRY_INTERVAL = config.get_float("mongo_retry_interval", 30)  # seconds before a failed connection is retried
+
+# Created on first use in each process: a client made before a fork (gunicorn --preload)
+# is never used by the forked workers
+_client = None
+_failed_at = None
+_client_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _client, _failed_at, _client_lock
+    _client = None
+    _failed_at = None
+    _client_lock = threading.Lock()
+    _async_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _connect():
+    client = MongoClient(
         MONGO_URI,
-        maxPoolSize=100,  # Maximum connections in the pool
-        minPoolSize=10,   # Minimum connections to maintain
+        event_listeners=[RoundTripCounter()],
+        maxPoolSize=MAX_POOL_SIZE,  # Maximum connections in the pool
+        minPoolSize=MIN_POOL_SIZE,   # Minimum connections to maintain
         maxIdleTimeMS=30000,  # Max idle time before closing (30 seconds)
         connectTimeoutMS=5000,  # Connection timeout
         serverSelectionTimeoutMS=5000  # Server selection timeout
     )
-    # Verify connection on startup
-    MONGO_CLIENT.admin.command('ping')
-    logger.info("Connected successfully to MongoDB")
-except Exception as e:
-    logger.error(f"Error connecting to MongoDB: {e}")
-    MONGO_CLIENT = None
+    # Verify the connection before handing the client out
+    client.admin.command('ping')
+    logger.info(f"Connected successfully to MongoDB (maxPoolSize={MAX_POOL_SIZE})")
+    return client
+
 
 def get_mongodb_connection():
     """
-    Return the global MongoDB client connection.
-    
+    Return this process's MongoDB client, connecting on first use.
+
     Returns:
-        MongoClient or None: MongoDB client if connection successful, None otherwise
+        MongoClient or None: MongoDB client if connection successful, None otherwise.
+        After a failed attempt, None is returned for mongo_retry_interval seconds
+        before connecting is tried again.
     """
-    return MONGO_CLIENT
+    global _client, _failed_at
+    if _client is not None:
+        return _client
+    if _failed_at is not None and time.monotonic() - _failed_at < RETRY_INTERVAL:
+        return None
+    with _client_lock:
+        if _client is None and (_failed_at is None or time.monotonic() - _failed_at >= RETRY_INTERVAL):
+            try:
+                with startup.step("mongo.connect"):
+                    _client = _connect()
+                _failed_at = None
+            except Exception as e:
+                logger.error(f"Error connecting to MongoDB: {e}")
+                _failed_at = time.monotonic()
+        return _client
 
 def get_collection(database_name, collection_name):
     """
@@ -48,14 +138,106 @@ def get_collection(database_name, collection_name):
     Returns:
         Collection or None: MongoDB collection if connection successful, None otherwise
     """
-    if MONGO_CLIENT:
-        return MONGO_CLIENT[database_name][collection_name]
+    client = get_mongodb_connection()
+    if client:
+        return client[database_name][collection_name]
     return None
 
+_async_clients = {}  # event loop id -> pymongo AsyncMongoClient
+
+
+def get_async_collection(database_name, collection_name):
+    """
+    Get a collection on pymongo's asyncio client for the running event loop (asgi.py).
+
+    Returns:
+        AsyncCollection or None: None when there is no real MongoDB deployment
+        (no MONGO_URI, or a test double in place of MongoClient); callers then
+        fall back to the synchronous client on a worker thread
+    """
+    if not MONGO_URI or not isinstance(get_mongodb_connection(), MongoClient):
+        return None
+    import asyncio
+    from pymongo import AsyncMongoClient
+
+    loop_id = id(asyncio.get_running_loop())
+    client = _async_clients.get(loop_id)
+    if client is None:
+        client = _async_clients[loop_id] = AsyncMongoClient(
+            MONGO_URI,
+            event_listeners=[RoundTripCounter()],
+            maxPoolSize=config.get_int("mongo_async_max_pool_size", 100),
+            connectTimeoutMS=5000,
+            serverSelectionTimeoutMS=5000
+        )
+    return client[database_name][collection_name]
+
+
+async def close_async_mongodb_connection():
+    """
+    Close the asyncio client of the running event loop (ASGI lifespan shutdown).
+    """
+    import asyncio
+
+    client = _async_clients.pop(id(asyncio.get_running_loop()), None)
+    if client is not None:
+        await client.close()
+
+
 def close_mongodb_connection():
     """
     Close the MongoDB client connection - should only be called when the application shuts down.
     """
-    if MONGO_CLIENT:
-        MONGO_CLIENT.close()
-        logger.info("MongoDB connection closed")
\ No newline at end of file
+    global _client
+    if _client:
+        _client.close()
+        _client = None
+        logger.info("MongoDB connection closed")
+
+
+# (database, collection) -> list of (keys, options)
+INDEXES = {
+    ("Users", "user"): [([("user_id", ASCENDING)], {"unique": True})],
+    ("Users", "threads"): [([("thread_id", ASCENDING)], {"unique": True})],
+    ("Users", "history"): [([("user_id", ASCENDING)], {"unique": True})],
+    ("handbooks", "corpus"): [([("sha256", ASCENDING), ("session_id", ASCENDING)], {"unique": True})],
+    ("handbooks", "sessions"): [([("session_id", ASCENDING)], {"unique": True})],
+    ("jobs", "queries"): [([("status", ASCENDING), ("enqueued_at", ASCENDING)], {})],
+    ("emails", "outbox"): [([("status", ASCENDING), ("created_at", ASCENDING)], {})],
+    # delivery records expire after idempotency_ttl seconds (see utils/idempotency.py)
+    ("webhooks", "deliveries"): [([("created_at", ASCENDING)], {"expireAfterSeconds": config.get_int("idempotency_ttl", 86400)})],
+}
+
+
+def ensure_indexes():
+    """
+    Make sure the indexes used on the request path exist. Safe to call on every startup:
+    creating an index that already exists is a no-op.
+    """
+    client = get_mongodb_connection()
+    if not client:
+        return
+    with startup.step("mongo.ensure_indexes"):
+        _create_indexes(client)
+    logger.info("MongoDB indexes ensured")
+
+
+def start_index_creation():
+    """
+    Connect and ensure the indexes in a background thread, so a slow MongoDB link
+    does not delay the worker's boot.
+    """
+    thread = threading.Thread(target=ensure_indexes, name="mongo-indexes", daemon=True)
+    thread.start()
+    return thread
+
+
+def _create_indexes(client):
+    for (database_name, collection_name), indexes in INDEXES.items():
+        collection = client[database_name][collection_name]
+        for keys, options in indexes:
+            try:
+                collection.create_index(keys, **options)
+            except PyMongoError as e:
+                # e.g. existing duplicate user_ids prevent a unique index
+                logger.error(f"Error creating index {keys} on {database_name}.{collection_name}: {e}")
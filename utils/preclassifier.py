@@ -0,0 +1,215 @@
+"""
+Local message pre-classifier for CS Advising Bot.
+Recognises greeting (1) and out-of-scope (5) messages with keyword rules plus a
+small multinomial Naive Bayes model, so their fixed replies can be sent without an
+LLM round trip. "Talk to a human" (4) and goodbye/thanks (7) are model classes only
+so they are not mistaken for greetings; they go to the LLM like everything else
+("other"), which drafts the escalation summary from the history and the reply.
+"""
+
+import re
+import math
+import logging
+import threading
+
+from utils.config import config
+
+logger = logging.getLogger(__name__)
+
+# "off": never classify, "shadow": classify and compare with the LLM, "on": answer fast-path categories locally
+PRECLASSIFIER_MODE = config.get("preclassifier_mode", "shadow").lower()
+CONFIDENCE_THRESHOLD = config.get_float("preclassifier_threshold", 0.9)
+MAX_MODEL_TOKENS = 8  # the lexical model only decides short messages; longer ones go to the LLM
+
+FAST_PATH_CATEGORIES = ("1", "5")
+# out of scope is never decided by the model alone: short in-scope questions share too
+# many words with the seed examples ("what time does registration open" vs "what time
+# does the gym open")
+RULE_ONLY_CATEGORIES = ("5",)
+OTHER = "other"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+
+# (pattern, category, confidence); matched against the whole lowercased message
+RULES = [
+    (re.compile(r"^\s*(hi|hello|hey|hiya|howdy|greetings|good (morning|afternoon|evening))( there)?( bot)?\s*[!.,:)]*\s*$"), "1", 0.99),
+]
+
+# seed corpus for the lexical model
+TRAINING_EXAMPLES = {
+    "1": [
+        "hi", "hello", "hey there", "good morning", "hello how are you", "hi bot", "hey how's it going",
+        "hello there", "hi how are you doing", "yo", "hey what's up", "good afternoon", "greetings",
+        "hi i'm new here", "hello advisor bot",
+    ],
+    "4": [
+        "talk to a human advisor", "connect me to an advisor", "i want to talk to a human",
+        "can i speak with a real person", "i need a human", "let me talk to someone",
+        "human please", "get me a human advisor", "i'd like to speak to an advisor",
+        "connect me with a person", "can a human help me", "speak to an actual advisor",
+    ],
+    "5": [
+        "what's the weather today", "what is the stock price of apple", "where can i eat on campus",
+        "what's for lunch at the dining hall", "tell me a joke", "who won the game last night",
+        "best pizza near campus", "how do i get a parking permit", "what movies are playing",
+        "recommend a restaurant", "write me a poem", "what is the capital of france",
+        "how's the weather in boston", "which dorm is the best", "what time does the gym open",
+    ],
+    "7": [
+        "thanks", "thank you", "thank you so much", "thanks for your help", "bye", "goodbye",
+        "see you later", "that's all thanks", "great thanks", "ok thank you", "appreciate it",
+        "thanks bye", "have a nice day", "got it thanks", "perfect thank you",
+    ],
+    OTHER: [
+        "what are the core competency areas for the mscs program",
+        "how many courses are required to complete a masters in computer science",
+        "what is the transfer credit policy", "does cs160 count towards my degree",
+        "can i take non cs courses", "what co-op opportunities are available",
+        "can international students do internships", "when are registration dates",
+        "what is the gpa requirement for good academic standing", "how do i apply for a thesis",
+        "what are the prerequisites for cs 105", "am i on track to graduate",
+        "how many credits do i need", "can i take a leave of absence", "what is cpt",
+        "i took cs 160 and cs 105 what should i take next", "what courses count for systems",
+        "how do i drop a class", "is comp 150 a research course", "what happens if i get a c",
+        "when is the add drop deadline", "can i double count courses for the fifth year masters",
+        "what are the requirements for the phd qualifying exam", "hi what are the core areas",
+        "thanks but what about the thesis option", "how do i talk to my advisor about course selection",
+        "who is the graduate program manager", "what is the minimum grade for core competency",
+        "how many research courses can i take", "can i take undergraduate courses",
+        "what time does registration open", "when does registration open", "what time does the registrar open",
+        "what time does the cs office open", "when does advising open", "what time does sis open",
+    ],
+}
+
+
+def tokenize(text):
+    tokens = TOKEN_PATTERN.findall((text or "").lower())
+    return tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+
+class NaiveBayes:
+    """
+    Multinomial Naive Bayes over unigram + bigram features with Laplace smoothing.
+    """
+
+    def __init__(self, examples):
+        self.classes = list(examples)
+        self.vocab = set()
+        self.counts = {}
+        self.totals = {}
+        num_examples = sum(len(texts) for texts in examples.values())
+        self.log_priors = {}
+        for label, texts in examples.items():
+            counts = {}
+            for text in texts:
+                for token in tokenize(text):
+                    counts[token] = counts.get(token, 0) + 1
+                    self.vocab.add(token)
+            self.counts[label] = counts
+            self.totals[label] = sum(counts.values())
+            self.log_priors[label] = math.log(len(texts) / num_examples)
+
+    def predict_proba(self, text):
+        """
+        Return {label: probability}, computed only over features seen in training.
+        """
+        tokens = [token for token in tokenize(text) if token in self.vocab]
+        if not tokens:
+            return {}
+        vocab_size = len(self.vocab)
+        scores = {}
+        for label in self.classes:
+            counts, total = self.counts[label], self.totals[label]
+            scores[label] = self.log_priors[label] + sum(
+                math.log((counts.get(token, 0) + 1) / (total + vocab_size)) for token in tokens
+            )
+        best = max(scores.values())
+        exp_scores = {label: math.exp(score - best) for label, score in scores.items()}
+        norm = sum(exp_scores.values())
+        return {label: value / norm for label, value in exp_scores.items()}
+
+
+class PreClassifier:
+    """
+    Rules first, then the lexical model for short messages; records shadow-mode agreement.
+    """
+
+    def __init__(self, threshold=CONFIDENCE_THRESHOLD, mode=PRECLASSIFIER_MODE):
+        self.threshold = threshold
+        self.mode = mode
+        self.model = NaiveBayes(TRAINING_EXAMPLES)
+        self._lock = threading.Lock()
+        self._counters = {"fast_path": 0, "sent_to_llm": 0, "shadow_agree": 0, "shadow_disagree": 0}
+        self._per_category = {}
+
+    def classify(self, message):
+        """
+        Returns:
+            tuple: (category, confidence, source) where category is "1", "4", "5", "7" or "other"
+        """
+        text = (message or "").strip().lower()
+        for pattern, category, confidence in RULES:
+            if pattern.match(text):
+                return category, confidence, "rule"
+
+        if len(TOKEN_PATTERN.findall(text)) > MAX_MODEL_TOKENS:
+            return OTHER, 1.0, "length"
+
+        probabilities = self.model.predict_proba(text)
+        if not probabilities:
+            return OTHER, 1.0, "unknown"
+        category = max(probabilities, key=probabilities.get)
+        return category, probabilities[category], "model"
+
+    def _answers_locally(self, category, confidence, source):
+        if category in RULE_ONLY_CATEGORIES and source != "rule":
+            return False
+        return category in FAST_PATH_CATEGORIES and confidence >= self.threshold
+
+    def fast_path(self, message):
+        """
+        Category to answer locally, or None if the message should go to the LLM.
+        """
+        if self.mode != "on":
+            return None
+        category, confidence, source = self.classify(message)
+        with self._lock:
+            if self._answers_locally(category, confidence, source):
+                self._counters["fast_path"] += 1
+                logger.info(f"pre-classifier answered category {category} ({source}, {confidence:.2f})")
+                return category
+            self._counters["sent_to_llm"] += 1
+        return None
+
+    def record_shadow(self, message, llm_category):
+        """
+        Compare the local prediction with the LLM's category (shadow mode only).
+        """
+        if self.mode != "shadow":
+            return
+        category, confidence, source = self.classify(message)
+        confident = self._answers_locally(category, confidence, source)
+        predicted = category if confident else OTHER
+        actual = llm_category if llm_category in FAST_PATH_CATEGORIES else OTHER
+        agree = predicted == actual
+        with self._lock:
+            self._counters["shadow_agree" if agree else "shadow_disagree"] += 1
+            stats = self._per_category.setdefault(predicted, {"agree": 0, "disagree": 0})
+            stats["agree" if agree else "disagree"] += 1
+        if not agree:
+            logger.info(f"pre-classifier shadow disagreement: predicted {predicted} ({source}, {confidence:.2f}), "
+                        f"LLM said {llm_category}")
+
+    def stats(self):
+        with self._lock:
+            compared = self._counters["shadow_agree"] + self._counters["shadow_disagree"]
+            return {
+                "mode": self.mode,
+                "threshold": self.threshold,
+                **self._counters,
+                "shadow_agreement": round(self._counters["shadow_agree"] / compared, 4) if compared else None,
+                "shadow_by_prediction": {label: dict(counts) for label, counts in self._per_category.items()}
+            }
+
+
+preclassifier = PreClassifier()
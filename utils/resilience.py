@@ -0,0 +1,361 @@
+"""
+Deadlines, circuit breakers and hedged requests for the LLM proxy calls of CS
+Advising Bot.
+
+- Deadlines: a /query runs under an end-to-end budget (``query_deadline``) and
+  every LLM call made on its behalf gets at most the time that is left, so a hung
+  proxy cannot hold a worker past the point where the answer is still useful.
+  The deadline is a context variable: it follows the request onto the query I/O
+  pool and into asyncio.to_thread, but not into background jobs (handbook
+  ingestion, history summaries), which run without one.
+- Circuit breakers: consecutive failures (errors, 429/5xx, timeouts, or calls
+  slower than ``llm_breaker_slow_seconds``) open the breaker, and calls fail fast
+  until a single probe gets through after the cooldown.
+- Hedging (``llm_hedge_enabled=true``): a call still running past the observed
+  p95 latency is sent a second time and the first good response wins.
+
+Breaker states and hedge counts are served from /resilience-stats and /metrics.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from utils.config import config
+
+logger = logging.getLogger(__name__)
+
+QUERY_DEADLINE = config.get_float("query_deadline", 45)  # seconds for a whole /query
+MIN_CALL_BUDGET = config.get_float("llm_min_call_budget", 1.0)  # less than this left: do not start a call
+
+BREAKER_FAILURES = config.get_int("llm_breaker_failures", 5)  # consecutive failures that open a breaker
+BREAKER_SLOW_SECONDS = config.get_float("llm_breaker_slow_seconds", 20)  # slower calls count as failures; 0 disables
+BREAKER_COOLDOWN = config.get_float("llm_breaker_cooldown", 30)  # seconds open before a probe is let through
+
+HEDGE_ENABLED = config.get_bool("llm_hedge_enabled", False)
+HEDGE_MIN_SAMPLES = config.get_int("llm_hedge_min_samples", 20)  # latencies observed before hedging starts
+HEDGE_MIN_DELAY = config.get_float("llm_hedge_min_delay", 1.0)  # never hedge sooner than this (seconds)
+HEDGE_WORKERS = config.get_int("llm_hedge_workers", 32)  # threads for hedged calls in the threaded server
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds=QUERY_DEADLINE):
+    """
+    Run the block under a deadline `seconds` from now. An earlier deadline already
+    in effect is kept.
+    """
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    Seconds left on the current deadline, or None outside of one.
+    """
+    at = _deadline.get()
+    return None if at is None else max(0.0, at - time.monotonic())
+
+
+def budget(timeout):
+    """
+    timeout capped by the time left on the current deadline.
+    """
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+class CircuitBreaker:
+    """
+    Closed: calls go through. Open: calls are refused until the cooldown has
+    passed. Half-open: one probe call is let through; its outcome closes or
+    re-opens the breaker; calls started before it opened no longer change the state.
+    """
+
+    PROBE = "probe"
+    CALL = "call"
+
+    def __init__(self, name, failures=BREAKER_FAILURES, slow_seconds=BREAKER_SLOW_SECONDS, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failures
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "failures": 0, "slow_calls": 0, "opened": 0, "short_circuited": 0}
+
+    def allow(self):
+        """
+        Whether a call may be made now: None if it is refused, else the token
+        (PROBE for the half-open probe, CALL otherwise) to pass to record() once the
+        call is done. Every allowed call must be followed by record().
+        """
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+                self._probing = False
+            if self.state == "closed" or (self.state == "half_open" and not self._probing):
+                self._probing = self.state == "half_open"
+                self._counters["calls"] += 1
+                return self.PROBE if self._probing else self.CALL
+            self._counters["short_circuited"] += 1
+            return None
+
+    def record(self, token, ok, seconds):
+        """
+        Record the outcome of a call allowed with token; a call slower than
+        slow_seconds is a failure.
+        """
+        slow = ok and self.slow_seconds > 0 and seconds > self.slow_seconds
+        with self._lock:
+            if not (ok and not slow):
+                self._counters["failures"] += 1
+                self._counters["slow_calls"] += slow
+            if token == self.PROBE:
+                self._probing = False
+                if ok and not slow:
+                    logger.info(f"Circuit breaker {self.name} closed")
+                    self.state = "closed"
+                    self._failures = 0
+                else:
+                    self._open()
+                return
+            if self.state != "closed":
+                # a call started before the breaker opened: only the probe decides now
+                return
+            if ok and not slow:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                logger.warning(f"Circuit breaker {self.name} opened after {self._failures} failed calls")
+                self._open()
+
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._counters["opened"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._failures,
+                "open_for_s": round(time.monotonic() - self._opened_at, 1) if self.state == "open" else None,
+                **self._counters
+            }
+
+
+class LatencyWindow:
+    """
+    The latencies of the last `size` successful calls, for the hedging delay.
+    """
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def __len__(self):
+        return len(self._samples)
+
+
+class Hedger:
+    """
+    Sends a second copy of a call that is still running past the observed p95 and
+    returns the first good result. Only for calls that are safe to repeat.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = LatencyWindow()
+        self._pool = None
+        self._lock = threading.Lock()
+        self._counters = {"hedged": 0, "hedge_won": 0, "primary_won": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def delay(self):
+        """
+        Seconds to wait before hedging, or None while hedging is off or still warming up.
+        """
+        if not HEDGE_ENABLED or len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, self.latencies.percentile(0.95))
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix=f"hedge-{self.name}")
+        return self._pool
+
+    @staticmethod
+    def _good(future, is_ok):
+        return future.exception() is None and is_ok(future.result())
+
+    def call(self, fn, is_ok):
+        """
+        fn() with a hedge. The primary runs on the hedging pool so this thread can
+        stop waiting for it; whichever call loses finishes in the background.
+        """
+        delay = self.delay()
+        if delay is None:
+            return fn()
+        pool = self._get_pool()
+        primary = pool.submit(contextvars.copy_context().run, fn)
+        done, _ = wait([primary], timeout=delay)
+        if not done:
+            self._count("hedged")
+            hedge = pool.submit(contextvars.copy_context().run, fn)
+            pending = {primary, hedge}
+            while True:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                winner = next((future for future in done if self._good(future, is_ok)), None)
+                if winner or not pending:
+                    winner = winner or done.pop()
+                    break
+            self._count("hedge_won" if winner is hedge else "primary_won")
+            return winner.result()
+        return primary.result()
+
+    async def acall(self, fn, is_ok):
+        """
+        call() for coroutine functions; the losing task is cancelled.
+        """
+        delay = self.delay()
+        if delay is None:
+            return await fn()
+        primary = asyncio.ensure_future(fn())
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        self._count("hedged")
+        hedge = asyncio.ensure_future(fn())
+        pending = {primary, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if self._good(task, is_ok)), None)
+                if winner or not pending:
+                    winner = winner or done.pop()
+                    break
+            self._count("hedge_won" if winner is hedge else "primary_won")
+            return winner.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        p95 = self.latencies.percentile(0.95)
+        delay = self.delay()
+        return {
+            "enabled": HEDGE_ENABLED,
+            "samples": len(self.latencies),
+            "p95_s": round(p95, 3) if p95 is not None else None,
+            "delay_s": round(delay, 3) if delay is not None else None,
+            **counters,
+            "hedge_win_rate": round(counters["hedge_won"] / counters["hedged"], 3) if counters["hedged"] else None
+        }
+
+
+breakers = {
+    "generate": CircuitBreaker("generate"),
+    # handbook PDFs take long to ingest: only failures count for uploads
+    "upload": CircuitBreaker("upload", slow_seconds=0)
+}
+hedgers = {"generate": Hedger("generate")}
+_counters = {"deadline_exceeded": 0}
+_counters_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # a hedging pool started in the parent has no threads in a forked worker
+    for hedger in hedgers.values():
+        hedger._pool = None
+        hedger._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def deadline_exceeded():
+    """
+    Count a call that was not started because its deadline had (nearly) passed.
+    """
+    with _counters_lock:
+        _counters["deadline_exceeded"] += 1
+
+
+def resilience_stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    return {
+        "query_deadline_s": QUERY_DEADLINE,
+        **counters,
+        "breakers": {name: breaker.stats() for name, breaker in breakers.items()},
+        "hedging": {name: hedger.stats() for name, hedger in hedgers.items()}
+    }
+
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def render():
+    """
+    Breaker states and hedge counts as Prometheus metrics.
+    """
+    lines = ["# HELP chatbot_llm_breaker_state Circuit breaker state (0 closed, 1 half-open, 2 open).",
+             "# TYPE chatbot_llm_breaker_state gauge"]
+    breaker_stats = {name: breaker.stats() for name, breaker in breakers.items()}
+    lines += [f'chatbot_llm_breaker_state{{call="{name}"}} {BREAKER_STATES[stats["state"]]}'
+              for name, stats in breaker_stats.items()]
+    lines += ["# HELP chatbot_llm_breaker_opened_total Times the circuit breaker opened.",
+              "# TYPE chatbot_llm_breaker_opened_total counter"]
+    lines += [f'chatbot_llm_breaker_opened_total{{call="{name}"}} {stats["opened"]}' for name, stats in breaker_stats.items()]
+    lines += ["# HELP chatbot_llm_short_circuited_total Calls refused by an open circuit breaker.",
+              "# TYPE chatbot_llm_short_circuited_total counter"]
+    lines += [f'chatbot_llm_short_circuited_total{{call="{name}"}} {stats["short_circuited"]}'
+              for name, stats in breaker_stats.items()]
+    lines += ["# HELP chatbot_llm_hedges_total Hedged calls by the copy that answered first.",
+              "# TYPE chatbot_llm_hedges_total counter"]
+    for name, hedger in hedgers.items():
+        stats = hedger.stats()
+        lines.append(f'chatbot_llm_hedges_total{{call="{name}",winner="hedge"}} {stats["hedge_won"]}')
+        lines.append(f'chatbot_llm_hedges_total{{call="{name}",winner="primary"}} {stats["primary_won"]}')
+    with _counters_lock:
+        exceeded = _counters["deadline_exceeded"]
+    lines += ["# HELP chatbot_llm_deadline_exceeded_total LLM calls not started because the request deadline had passed.",
+              "# TYPE chatbot_llm_deadline_exceeded_total counter",
+              f"chatbot_llm_deadline_exceeded_total {exceeded}"]
+    return "\n".join(lines)
@@ -0,0 +1,294 @@
+"""
+Local retrieval index for CS Advising Bot.
+Builds a BM25 inverted index over the handbook text files in resources/ and
+scores queries with vectorized NumPy operations, so handbook excerpts can be
+put into the prompt without relying on the LLM proxy's remote RAG.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import numpy as np
+
+from utils.config import config
+
+logger = logging.getLogger(__name__)
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+
+# text file -> (document title, citation URL), matching the citations in prompt.py
+DOCUMENTS = {
+    "cs-handbook.txt": ("CS Graduate Handbook Supplement", "https://tufts.app.box.com/v/cs-grad-handbook-supplement"),
+    "soe-handbook.txt": ("SOE Graduate Handbook AY24-25", "https://tufts.app.box.com/v/soe-grad-handbook"),
+    "courses.txt": ("CS Graduate Course Description", "https://www.cs.tufts.edu/t/courses/description/graduate"),
+}
+
+INDEX_PATH = config.get("retrieval_index_path", os.path.join(RESOURCES_DIR, "handbook_index.npz"))
+MAX_CHUNK_CHARS = 1500
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+PAGE_PATTERN = re.compile(r"^page (\d+), contents?:\s*$", re.IGNORECASE | re.MULTILINE)
+SECTION_PATTERN = re.compile(r"^## (.+)$", re.MULTILINE)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+COURSE_PATTERN = re.compile(r"\b([a-z]{2,4})\s*-?\s*(\d{2,3})\b")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i if in is it its may me my
+of on or our should that the their them there this to was we what when where which who
+will with you your
+""".split())
+
+
+def is_local_retrieval_enabled():
+    return config.get_bool("local_retrieval_enabled")
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens without stopwords, plus joined course codes ("CS 160" -> "cs160").
+    """
+    text = text.lower()
+    tokens = [token for token in TOKEN_PATTERN.findall(text) if token not in STOPWORDS]
+    tokens.extend(subject + number for subject, number in COURSE_PATTERN.findall(text))
+    return tokens
+
+
+def _split_long(text, limit=MAX_CHUNK_CHARS):
+    """
+    Split text on paragraph/line boundaries into pieces of at most ``limit`` characters.
+    """
+    if len(text) <= limit:
+        return [text]
+    pieces, current = [], ""
+    for line in text.splitlines(keepends=True):
+        if current and len(current) + len(line) > limit:
+            pieces.append(current)
+            current = ""
+        current += line
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+
+def chunk_document(filename, text):
+    """
+    Split a handbook text file into chunks on its page or course-section markers.
+
+    Returns:
+        list: dicts with "text", "document", "url", "source" and "page" or "section"
+    """
+    title, url = DOCUMENTS[filename]
+    chunks = []
+
+    page_matches = list(PAGE_PATTERN.finditer(text))
+    if page_matches:
+        for i, match in enumerate(page_matches):
+            end = page_matches[i + 1].start() if i + 1 < len(page_matches) else len(text)
+            body = text[match.end():end].strip()
+            for piece in _split_long(body):
+                chunks.append({"text": piece.strip(), "document": title, "url": url,
+                               "source": filename, "page": int(match.group(1))})
+        return chunks
+
+    section_matches = list(SECTION_PATTERN.finditer(text))
+    for i, match in enumerate(section_matches):
+        end = section_matches[i + 1].start() if i + 1 < len(section_matches) else len(text)
+        body = text[match.start():end].strip()
+        for piece in _split_long(body):
+            chunks.append({"text": piece.strip(), "document": title, "url": url,
+                           "source": filename, "section": match.group(1).strip()})
+    return chunks
+
+
+def _source_hash():
+    digest = hashlib.sha256()
+    for filename in sorted(DOCUMENTS):
+        with open(os.path.join(RESOURCES_DIR, filename), 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+class RetrievalIndex:
+    """
+    BM25 index stored as a CSR-style inverted index.
+
+    For term id t, ``post_docs[term_ptr[t]:term_ptr[t+1]]`` are the chunks that
+    contain it and ``post_tf`` the matching term frequencies.
+    """
+
+    def __init__(self, chunks, vocab, term_ptr, post_docs, post_tf, doc_len, source_hash=None):
+        self.chunks = chunks
+        self.vocab = vocab
+        self.term_ptr = term_ptr
+        self.post_docs = post_docs
+        self.post_tf = post_tf
+        self.doc_len = doc_len
+        self.source_hash = source_hash
+
+        num_docs = len(chunks)
+        doc_freq = np.diff(term_ptr).astype(np.float32)
+        self.idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        # per-chunk BM25 length normalisation, precomputed once
+        avg_len = float(doc_len.mean()) if num_docs else 0.0
+        self.norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_len / (avg_len or 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, chunks, source_hash=None):
+        vocab = {}
+        postings = {}
+        doc_len = np.zeros(len(chunks), dtype=np.float32)
+        for doc_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk["text"])
+            doc_len[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_id = vocab.setdefault(token, len(vocab))
+                postings.setdefault(term_id, []).append((doc_id, count))
+
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int32)
+        for term_id in range(len(vocab)):
+            term_ptr[term_id + 1] = term_ptr[term_id] + len(postings[term_id])
+        post_docs = np.empty(term_ptr[-1], dtype=np.int32)
+        post_tf = np.empty(term_ptr[-1], dtype=np.float32)
+        for term_id, entries in postings.items():
+            start = term_ptr[term_id]
+            post_docs[start:start + len(entries)] = [doc_id for doc_id, _ in entries]
+            post_tf[start:start + len(entries)] = [count for _, count in entries]
+
+        return cls(chunks, vocab, term_ptr, post_docs, post_tf, doc_len, source_hash)
+
+    def search(self, query, k=5):
+        """
+        Return the top-k chunks for a query as dicts with chunk metadata and "score".
+        """
+        term_ids = [self.vocab[token] for token in set(tokenize(query)) if token in self.vocab]
+        if not term_ids:
+            return []
+
+        docs = np.concatenate([self.post_docs[self.term_ptr[t]:self.term_ptr[t + 1]] for t in term_ids])
+        tf = np.concatenate([self.post_tf[self.term_ptr[t]:self.term_ptr[t + 1]] for t in term_ids])
+        idf = np.concatenate([np.full(self.term_ptr[t + 1] - self.term_ptr[t], self.idf[t], dtype=np.float32)
+                              for t in term_ids])
+        contributions = idf * tf * (BM25_K1 + 1) / (tf + self.norm[docs])
+        scores = np.bincount(docs, weights=contributions, minlength=len(self.chunks))
+
+        k = min(k, np.count_nonzero(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{**self.chunks[i], "score": round(float(scores[i]), 4)} for i in top]
+
+    def save(self, path):
+        terms = np.empty(len(self.vocab), dtype=object)
+        for token, term_id in self.vocab.items():
+            terms[term_id] = token
+        np.savez_compressed(
+            path,
+            terms=terms.astype(str),
+            term_ptr=self.term_ptr,
+            post_docs=self.post_docs,
+            post_tf=self.post_tf,
+            doc_len=self.doc_len,
+            chunks=np.array(json.dumps(self.chunks)),
+            source_hash=np.array(self.source_hash or "")
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            vocab = {str(token): term_id for term_id, token in enumerate(data["terms"])}
+            return cls(json.loads(str(data["chunks"])), vocab, data["term_ptr"], data["post_docs"],
+                       data["post_tf"], data["doc_len"], str(data["source_hash"]))
+
+
+def build_index():
+    """
+    Chunk and index every handbook text file in resources/.
+    """
+    chunks = []
+    for filename in DOCUMENTS:
+        with open(os.path.join(RESOURCES_DIR, filename), 'r', encoding='utf-8') as file:
+            chunks.extend(chunk_document(filename, file.read()))
+    return RetrievalIndex.build(chunks, _source_hash())
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    Return the process-wide index, loading it from INDEX_PATH when it is up to date
+    and otherwise building it (and trying to save it for the next start).
+    """
+    global _index
+    if _index is not None:
+        return _index
+
+    with _index_lock:
+        if _index is not None:
+            return _index
+
+        started = time.time()
+        source_hash = _source_hash()
+        if os.path.exists(INDEX_PATH):
+            try:
+                index = RetrievalIndex.load(INDEX_PATH)
+                if index.source_hash == source_hash:
+                    _index = index
+                    logger.info(f"Loaded retrieval index from {INDEX_PATH} in {1000 * (time.time() - started):.1f} ms")
+                    return _index
+            except Exception as e:
+                logger.warning(f"Could not load retrieval index {INDEX_PATH}: {str(e)}")
+
+        index = build_index()
+        try:
+            index.save(INDEX_PATH)
+        except OSError as e:
+            logger.warning(f"Could not save retrieval index to {INDEX_PATH}: {str(e)}")
+        _index = index
+        logger.info(f"Built retrieval index ({len(index.chunks)} chunks, {len(index.vocab)} terms) "
+                    f"in {1000 * (time.time() - started):.1f} ms")
+        return _index
+
+
+def search(query, k=5):
+    return get_index().search(query, k)
+
+
+def format_chunks(chunks):
+    """
+    Format retrieved chunks as a prompt section with citation metadata.
+    """
+    if not chunks:
+        return "No relevant excerpts were found in the provided resources."
+
+    sections = []
+    for chunk in chunks:
+        location = f"page {chunk['page']}" if "page" in chunk else chunk.get("section", "")
+        sections.append(f"### [{chunk['document']}]({chunk['url']}) — {location}\n{chunk['text']}")
+    return "\n\n".join(sections)
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    index = build_index()
+    index.save(INDEX_PATH)
+    print(f"Saved {len(index.chunks)} chunks, {len(index.vocab)} terms to {INDEX_PATH}")
+    for query in sys.argv[1:]:
+        started = time.perf_counter()
+        results = index.search(query)
+        elapsed = 1000 * (time.perf_counter() - started)
+        print(f"\n{query!r} ({elapsed:.3f} ms)")
+        for result in results:
+            print(f"  {result['score']:.2f}  {result['source']}  {result.get('page', result.get('section'))}")
@@ -0,0 +1,262 @@
+"""
+Outbound RocketChat dispatcher for CS Advising Bot.
+
+Every chat.postMessage / chat.update goes through a per-room FIFO queue, so the
+calls for one room are sent one at a time and in order. Workers enforce a global
+and a per-room rate, retry 429 and 5xx responses with backoff (honouring
+Retry-After), and a chat.update queued while an earlier update of the same msgId
+is still waiting replaces it instead of being sent separately.
+"""
+
+import time
+import heapq
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import requests
+
+from utils.config import config
+from utils import http_client
+
+logger = logging.getLogger(__name__)
+
+RC_WORKERS = config.get_int("rc_workers", 4)
+RC_RATE_LIMIT = config.get_float("rc_rate_limit", 20)  # calls per second, all rooms
+RC_ROOM_RATE_LIMIT = config.get_float("rc_room_rate_limit", 5)  # calls per second, per room
+RC_MAX_RETRIES = config.get_int("rc_max_retries", 4)
+RC_CALL_TIMEOUT = config.get_float("rc_call_timeout", 60)  # seconds a caller waits for its call
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 10.0  # seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class _Message:
+    __slots__ = ("method", "payload", "room", "futures", "attempts")
+
+    def __init__(self, method, payload, room, future):
+        self.method = method
+        self.payload = payload
+        self.room = room
+        self.futures = [future]
+        self.attempts = 0
+
+
+def _room_of(payload):
+    return payload.get("roomId") or payload.get("channel") or "_default"
+
+
+def _retry_after(response, attempt):
+    header = response.headers.get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return min(BACKOFF_MAX, float(header))
+        except ValueError:
+            pass
+    # "full jitter", as in utils.http_client
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+class RocketChatDispatcher:
+    """
+    Rate-limited, retrying sender of RocketChat API calls with one queue per room.
+
+    Workers are started lazily on the first call so they are created after gunicorn forks.
+    """
+
+    def __init__(self, base_url, headers, workers=RC_WORKERS, rate=RC_RATE_LIMIT,
+                 room_rate=RC_ROOM_RATE_LIMIT, max_retries=RC_MAX_RETRIES):
+        self.base_url = base_url
+        self.headers = headers
+        self.num_workers = max(1, workers)
+        self.rate = rate
+        self.room_interval = 1.0 / room_rate if room_rate > 0 else 0.0
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._rooms = {}        # room -> deque of queued _Message
+        self._ready = deque()   # rooms with queued messages that no worker is serving
+        self._delayed = []      # heap of (not_before, room) waiting for their rate or a retry
+        self._busy = set()      # rooms a worker is sending for (or scheduled in _delayed)
+        self._room_next = {}    # room -> earliest time of its next call
+        self._tokens = max(1.0, rate)
+        self._tokens_at = time.monotonic()
+        self._token_lock = threading.Lock()
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._counters = {"sent": 0, "failed": 0, "retried": 0, "dropped": 0, "merged": 0, "rate_limited": 0, "throttled_seconds": 0.0}
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(target=self._worker, name=f"rocketchat-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, method, payload):
+        """
+        Queue an API call (e.g. "chat.postMessage") and return a Future of its requests.Response.
+        """
+        self._ensure_started()
+        future = Future()
+        room = _room_of(payload)
+        with self._cond:
+            queue = self._rooms.setdefault(room, deque())
+            if method == "chat.update":
+                for message in queue:
+                    if message.method == method and message.payload.get("msgId") == payload.get("msgId"):
+                        message.payload = payload  # the latest text wins
+                        message.futures.append(future)
+                        self._counters["merged"] += 1
+                        return future
+            queue.append(_Message(method, payload, room, future))
+            if room not in self._busy and len(queue) == 1:
+                self._ready.append(room)
+                self._cond.notify()
+        return future
+
+    def call(self, method, payload, timeout=RC_CALL_TIMEOUT):
+        """
+        Queue an API call and wait for its response.
+
+        Raises:
+            requests.exceptions.RequestException: If the call failed, or is still
+                queued or in flight after ``timeout`` seconds (requests.exceptions.Timeout)
+        """
+        try:
+            return self.submit(method, payload).result(timeout)
+        except FutureTimeoutError:
+            raise requests.exceptions.Timeout(f"RocketChat {method} not sent within {timeout:g}s (queue backed up)")
+
+    def post_message(self, payload):
+        return self.call("chat.postMessage", payload)
+
+    def update_message(self, payload):
+        """
+        Queue a chat.update without waiting for it; returns a Future.
+        """
+        return self.submit("chat.update", payload)
+
+    def _next_room(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    _, room = heapq.heappop(self._delayed)
+                    self._busy.discard(room)
+                    self._ready.append(room)
+                if self._ready:
+                    room = self._ready.popleft()
+                    not_before = self._room_next.get(room, 0.0)
+                    if not_before > now:
+                        self._busy.add(room)
+                        heapq.heappush(self._delayed, (not_before, room))
+                        continue
+                    self._busy.add(room)
+                    return room, self._rooms[room].popleft()
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._cond.wait(timeout)
+
+    def _acquire_token(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._token_lock:
+                now = time.monotonic()
+                self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._tokens_at) * self.rate)
+                self._tokens_at = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+                self._counters["throttled_seconds"] += wait
+            time.sleep(wait)
+
+    def _send(self, message):
+        self._acquire_token()
+        return http_client.post(f"{self.base_url}/{message.method}", json=message.payload, headers=self.headers,
+                                idempotent=message.method == "chat.update", retries=0)
+
+    def _worker(self):
+        while True:
+            room, message = self._next_room()
+            response, error = None, None
+            try:
+                response = self._send(message)
+            except requests.exceptions.RequestException as e:
+                error = e
+            except Exception as e:
+                logger.exception(f"Unexpected error sending {message.method}: {str(e)}")
+                error = e
+
+            # a postMessage that may have reached the server (read timeout, connection
+            # dropped after sending) is not resent
+            idempotent = message.method == "chat.update"
+            retryable = http_client.is_connect_error(error) or \
+                (idempotent and isinstance(error, requests.exceptions.RequestException)) or \
+                (response is not None and response.status_code in RETRY_STATUS_CODES)
+            delay = self.room_interval
+            finished = True
+            if retryable and message.attempts < self.max_retries:
+                delay = max(delay, _retry_after(response, message.attempts))
+                message.attempts += 1
+                finished = False
+                reason = response.status_code if response is not None else error.__class__.__name__
+                logger.warning(f"RocketChat {message.method} for room {room} failed ({reason}), retry {message.attempts} in {delay:.2f}s")
+
+            with self._cond:
+                if response is not None and response.status_code == 429:
+                    self._counters["rate_limited"] += 1
+                if not finished:
+                    self._counters["retried"] += 1
+                    self._rooms[room].appendleft(message)
+                elif retryable:
+                    self._counters["dropped"] += 1
+                elif error is not None:
+                    self._counters["failed"] += 1
+                else:
+                    self._counters["sent"] += 1
+
+                self._room_next[room] = time.monotonic() + delay
+                if self._rooms[room]:
+                    heapq.heappush(self._delayed, (self._room_next[room], room))
+                    self._cond.notify()
+                else:
+                    self._busy.discard(room)
+                    del self._rooms[room]
+                    if len(self._room_next) > 1000:
+                        now = time.monotonic()
+                        self._room_next = {r: t for r, t in self._room_next.items() if t > now or r in self._rooms}
+
+            if finished:
+                if retryable:
+                    logger.error(f"Dropping RocketChat {message.method} for room {room} after {message.attempts} retries")
+                for future in message.futures:
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(response)
+
+    def stats(self):
+        """
+        Queue depth and sent/retried/dropped/merged counters of this process.
+        """
+        with self._cond:
+            depths = [len(queue) for queue in self._rooms.values()]
+            result = dict(self._counters)
+            result.update({
+                "depth": sum(depths),
+                "rooms": len(depths),
+                "max_room_depth": max(depths, default=0),
+                "workers": self.num_workers if self._threads else 0,
+                "rate_limit": self.rate,
+                "room_rate_limit": 1.0 / self.room_interval if self.room_interval else 0.0
+            })
+        result["throttled_seconds"] = round(result["throttled_seconds"], 3)
+        return result
@@ -0,0 +1,109 @@
+"""
+Cold-start timings for CS Advising Bot.
+
+Each startup step (importing app.py, connecting to MongoDB, loading the
+indexes) and the first request of each endpoint is timed once per process.
+The timings are served from /startup-stats and as gauges in /metrics, so
+cold-start regressions show up next to the request latencies.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+_started = time.perf_counter()  # first import, at the top of app.py
+_steps = {}  # step -> seconds
+_ready = None  # perf_counter when app.py finished importing
+_first_requests = {}  # endpoint -> {"seconds": duration, "after_ready_s": time since ready}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # steps run before the fork happened once for every worker; requests are per process
+    global _lock
+    _first_requests.clear()
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def step(name):
+    """
+    Time one startup step. A step that runs again (e.g. MongoDB reconnecting in a
+    forked worker) replaces its earlier timing.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _steps[name] = time.perf_counter() - started
+
+
+def ready():
+    """
+    Mark the end of app.py's import: everything before this delays the worker's boot.
+    """
+    global _ready
+    _ready = time.perf_counter()
+    with _lock:
+        _steps["import.app"] = _ready - _started
+
+
+def first_request(endpoint, seconds):
+    """
+    Record the duration of a request if it is the first one of its endpoint in this process.
+    """
+    if endpoint in _first_requests:
+        return
+    with _lock:
+        _first_requests.setdefault(endpoint, {
+            "seconds": round(seconds, 4),
+            "after_ready_s": round(time.perf_counter() - _ready, 3) if _ready else None
+        })
+
+
+def _process_age():
+    """
+    Seconds since this process started (Linux only), covering interpreter startup too.
+    """
+    try:
+        with open("/proc/self/stat") as file:
+            start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as file:
+            uptime = float(file.read().split()[0])
+        return round(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def startup_stats():
+    with _lock:
+        steps = {name: round(seconds, 4) for name, seconds in _steps.items()}
+        first_requests = {endpoint: dict(timing) for endpoint, timing in _first_requests.items()}
+    return {
+        "pid": os.getpid(),
+        "process_age_s": _process_age(),
+        "steps_s": steps,
+        "first_requests": first_requests
+    }
+
+
+def render():
+    """
+    Startup steps and first-request durations as Prometheus gauges.
+    """
+    with _lock:
+        steps = sorted(_steps.items())
+        first_requests = sorted(_first_requests.items())
+    lines = ["# HELP chatbot_startup_seconds Time spent in each startup step of this process.",
+             "# TYPE chatbot_startup_seconds gauge"]
+    lines += [f'chatbot_startup_seconds{{step="{name}"}} {seconds}' for name, seconds in steps]
+    lines += ["# HELP chatbot_first_request_seconds Duration of the first request of each endpoint in this process.",
+              "# TYPE chatbot_first_request_seconds gauge"]
+    lines += [f'chatbot_first_request_seconds{{endpoint="{endpoint}"}} {timing["seconds"]}' for endpoint, timing in first_requests]
+    return "\n".join(lines)
@@ -0,0 +1,137 @@
+"""
+Cached accessors for user profiles and escalation thread mappings.
+
+Thread mappings never change after build_bidirectional_threads inserts them, so
+they are cached for a long time. Profiles carry a ``version`` counter that every
+writer bumps through update_profile(); a cached profile is replaced only by a
+newer version, and writes made by this process invalidate it immediately.
+Writes made by other processes are picked up when the short TTL expires.
+"""
+
+import asyncio
+import logging
+
+import pymongo
+
+from utils.config import config
+from utils import metrics
+from utils.cache import LRUCache
+from utils.mongo_config import get_collection, get_async_collection
+
+logger = logging.getLogger(__name__)
+
+thread_cache = LRUCache(
+    "threads",
+    maxsize=config.get_int("thread_cache_size", 10000),
+    ttl=config.get_float("thread_cache_ttl", 86400)  # immutable, keep for a day
+)
+profile_cache = LRUCache(
+    "profiles",
+    maxsize=config.get_int("profile_cache_size", 5000),
+    ttl=config.get_float("profile_cache_ttl", 60)
+)
+
+
+def cache_profile(profile):
+    """
+    Store a profile read from MongoDB unless a newer version is already cached.
+    """
+    if not profile:
+        return
+    cached = profile_cache.peek(profile["user_id"])
+    if cached is not None and cached.get("version", 0) > profile.get("version", 0):
+        logger.debug(f"not caching stale profile version {profile.get('version', 0)} for {profile['user_id']}")
+        return
+    profile_cache.put(profile["user_id"], profile)
+
+
+@metrics.timed("mongo.profile_get")
+def get_profile(user_id):
+    """
+    Return the user profile, from the cache when possible.
+    """
+    profile = profile_cache.get(user_id)
+    if profile is not None:
+        return profile
+    profile = get_collection("Users", "user").find_one({"user_id": user_id})
+    cache_profile(profile)
+    return profile
+
+
+@metrics.timed("mongo.profile_get")
+def get_pending_escalation(user_id):
+    """
+    Read pending_escalation straight from MongoDB: it decides how a message is routed,
+    and a cached profile may predate another worker's update.
+    """
+    profile = get_collection("Users", "user").find_one({"user_id": user_id}, {"pending_escalation": 1})
+    return bool(profile and profile.get("pending_escalation") is True)
+
+
+def _find_and_update_profile(collection, user_id, update, upsert):
+    """
+    Bump the version of an update, drop the cached profile and send the update
+    through collection.find_one_and_update; returns its result (an awaitable on the
+    asyncio client). The caller caches the updated profile with cache_profile().
+    """
+    update = dict(update)
+    update["$inc"] = {**update.get("$inc", {}), "version": 1}
+    profile_cache.invalidate(user_id)
+    return collection.find_one_and_update(
+        {"user_id": user_id},
+        update,
+        upsert=upsert,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+
+
+@metrics.timed("mongo.profile_update")
+def update_profile(user_id, update, upsert=False):
+    """
+    Apply an update to a user profile, bumping its version, and return the updated profile.
+    """
+    profile = _find_and_update_profile(get_collection("Users", "user"), user_id, update, upsert)
+    cache_profile(profile)
+    return profile
+
+
+async def update_profile_async(user_id, update, upsert=False):
+    """
+    update_profile() on the asyncio MongoDB client, or on a worker thread without one.
+    """
+    collection = get_async_collection("Users", "user")
+    if collection is None:
+        return await asyncio.to_thread(update_profile, user_id, update, upsert)
+
+    with metrics.span("mongo.profile_update"):
+        profile = await _find_and_update_profile(collection, user_id, update, upsert)
+    cache_profile(profile)
+    return profile
+
+
+@metrics.timed("mongo.thread_get")
+def get_thread_mapping(thread_id):
+    """
+    Return the thread mapping for a RocketChat thread id, from the cache when possible.
+    """
+    mapping = thread_cache.get(thread_id)
+    if mapping is not None:
+        return mapping
+    mapping = get_collection("Users", "threads").find_one({"thread_id": thread_id})
+    if mapping:
+        thread_cache.put(thread_id, mapping)
+    return mapping
+
+
+@metrics.timed("mongo.thread_insert")
+def add_thread_mappings(mappings):
+    """
+    Insert thread mappings and prime the cache with them.
+    """
+    get_collection("Users", "threads").insert_many(mappings)
+    for mapping in mappings:
+        thread_cache.put(mapping["thread_id"], mapping)
+
+
+def cache_stats():
+    return [thread_cache.stats(), profile_cache.stats()]
@@ -1,29 +1,201 @@
+import sys
+import time
+import logging
+import datetime
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReturnDocument
+
 from llmproxy import pdf_upload, text_upload
+from utils.config import config
+from utils.mongo_config import get_collection
+
+logger = logging.getLogger(__name__)
+
+SESSION_PREFIX = 'cs-advising-handbooks-v5-'      # prev v5
+ALL_REFERENCES = ["cs_handbook.pdf", "soe-grad-handbook.pdf", "filtered_grad_courses.pdf"]
+READY_TIMEOUT = config.get_float("handbook_ready_timeout", 15)  # seconds the first /query waits
+STALE_PENDING = 300  # seconds after which a pending ingestion is assumed dead and retried
+
+# readiness states recorded in handbooks.sessions
+STATUS_PENDING = "pending"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# runs ingestion jobs; each job uploads its documents in parallel on _upload_pool
+_ingestion_pool = ThreadPoolExecutor(max_workers=config.get_int("handbook_ingestion_workers", 4),
+                                     thread_name_prefix="handbook-ingestion")
+_upload_pool = ThreadPoolExecutor(max_workers=len(ALL_REFERENCES) * 4, thread_name_prefix="handbook-upload")
+_ready_sessions = set()
+_local_events = {}
+_lock = threading.Lock()
+
+
+def get_session_id(user_id):
+    return SESSION_PREFIX + user_id
+
+
+def _upload_one(reference, session_id):
+    response = pdf_upload(
+        path = f'resources/{reference}',
+        session_id = session_id,
+        strategy = 'smart'
+    )
+    ok = isinstance(response, str) and response.startswith("Successfully")
+    if ok:
+        logger.info("✅ " + reference + " is successfully loaded")
+    else:
+        logger.error(f"❌ Error uploading {reference}: {response}")
+    return ok
+
 
 def handbook_upload(user_id):
-    try:
-        all_references = ["cs_handbook.pdf", "soe-grad-handbook.pdf", "filtered_grad_courses.pdf"]
-        for reference in all_references:
-            response = pdf_upload(
-                path = f'resources/{reference}',
-                session_id = 'cs-advising-handbooks-v5-' + user_id,
-                strategy = 'smart'
-            )
-            print("✅ " + reference + " is successfully loaded")
+    """
+    Upload all handbooks into the user's session in parallel.
 
+    Returns:
+        bool: True if every upload succeeded
+    """
+    session_id = get_session_id(user_id)
+    try:
+        results = list(_upload_pool.map(lambda reference: _upload_one(reference, session_id), ALL_REFERENCES))
+        return all(results)
     except Exception as e:
-        print(f"❌ Error uploading handbooks: {str(e)}")
+        logger.error(f"❌ Error uploading handbooks: {str(e)}")
+        return False
+
+
+def _claim_session(session_id):
+    """
+    Atomically mark a session pending. Returns True if the caller should run the ingestion.
+    """
+    sessions = get_collection("handbooks", "sessions")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    previous = sessions.find_one_and_update(
+        {"session_id": session_id},
+        {"$setOnInsert": {"status": STATUS_PENDING, "updated_at": now}},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        return True
+
+    status = previous.get("status")
+    if status == STATUS_READY:
+        _ready_sessions.add(session_id)
+        return False
+    updated_at = previous.get("updated_at")
+    stale = updated_at is not None and (now - updated_at.replace(tzinfo=datetime.timezone.utc)).total_seconds() > STALE_PENDING
+    if status == STATUS_FAILED or (status == STATUS_PENDING and stale):
+        result = sessions.update_one(
+            {"_id": previous["_id"], "status": status, "updated_at": updated_at},
+            {"$set": {"status": STATUS_PENDING, "updated_at": now}}
+        )
+        return result.modified_count == 1
+    return False
+
+
+def _run_ingestion(user_id, event):
+    session_id = get_session_id(user_id)
+    ok = handbook_upload(user_id)
+    try:
+        get_collection("handbooks", "sessions").update_one(
+            {"session_id": session_id},
+            {"$set": {
+                "status": STATUS_READY if ok else STATUS_FAILED,
+                "updated_at": datetime.datetime.now(datetime.timezone.utc)
+            }}
+        )
+    finally:
+        if ok:
+            _ready_sessions.add(session_id)
+        with _lock:
+            _local_events.pop(session_id, None)
+        event.set()
+    return ok
+
+
+def start_handbook_ingestion(user_id):
+    """
+    Start ingesting the handbooks for a user's session in the background, unless the
+    session is already ready or another worker is ingesting it.
+
+    Returns:
+        bool: True if the session is already known to be ready
+    """
+    session_id = get_session_id(user_id)
+    if session_id in _ready_sessions:
+        return True
+
+    # the event is registered first, so other requests of this process wait on it instead
+    # of claiming too; the MongoDB claim itself runs outside the process-wide lock
+    with _lock:
+        if session_id in _local_events:
+            return False
+        event = threading.Event()
+        _local_events[session_id] = event
+
+    claimed = False
+    try:
+        claimed = _claim_session(session_id)
+    finally:
+        if not claimed:
+            with _lock:
+                _local_events.pop(session_id, None)
+            event.set()
+    if not claimed:
+        return session_id in _ready_sessions
+
+    _ingestion_pool.submit(_run_ingestion, user_id, event)
+    return False
+
+
+def wait_for_handbooks(user_id, timeout=READY_TIMEOUT):
+    """
+    Wait until the user's session is ready, failed, or the deadline passes.
+
+    Returns:
+        str: "ready", "failed" or "pending" (deadline reached)
+    """
+    session_id = get_session_id(user_id)
+    deadline = time.monotonic() + timeout
+    if session_id in _ready_sessions:
+        return STATUS_READY
+
+    # ingestion running in this process: wait on its event
+    event = _local_events.get(session_id)
+    if event is not None:
+        event.wait(max(0.0, deadline - time.monotonic()))
+        if session_id in _ready_sessions:
+            return STATUS_READY
+
+    # otherwise poll the readiness recorded by whichever worker is ingesting it
+    sessions = get_collection("handbooks", "sessions")
+    delay = 0.1
+    while True:
+        doc = sessions.find_one({"session_id": session_id}, {"status": 1})
+        status = doc.get("status") if doc else STATUS_PENDING
+        if status == STATUS_READY:
+            _ready_sessions.add(session_id)
+            return status
+        if status == STATUS_FAILED or time.monotonic() >= deadline:
+            return status
+        time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+        delay = min(delay * 2, 1.0)
+
 
 def get_txt(filename):
     """
     Reads a text file and returns its contents as a string.
-    
+
     Args:
         filename (str): Path to the text file to be read
-        
+
     Returns:
         str: The contents of the text file
-        
+
     Raises:
         FileNotFoundError: If the file does not exist
         IOError: If there is an error reading the file
@@ -42,9 +214,69 @@ def handbook_txt_upload(user_id):
         for txt in all_txts:
             response = text_upload(
                     text = get_txt(f"resources/{txt}"),
-                    session_id = 'cs-advising-handbooks-v5-' + user_id,
+                    session_id = get_session_id(user_id),
                     strategy = 'fixed')
-            print("✅ " + txt + " is successfully loaded")
+            logger.info("✅ " + txt + " is successfully loaded")
     except Exception as e:
-        print(f"❌ Error uploading handbooks: {str(e)}")
-            
\ No newline at end of file
+        logger.error(f"❌ Error uploading handbooks: {str(e)}")
+
+
+def seed_existing_sessions():
+    """
+    Record the sessions of students who messaged before readiness was tracked as ready.
+
+    Their handbooks were uploaded on their first message (last_k == 0), so without a
+    record they would be ingested a second time, duplicating every RAG chunk. Existing
+    records are left alone. Returns the number of sessions seeded.
+    """
+    sessions = get_collection("handbooks", "sessions")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    seeded = 0
+    for doc in get_collection("Users", "user").find({"last_k": {"$gt": 0}}, {"user_id": 1}):
+        result = sessions.update_one(
+            {"session_id": get_session_id(doc["user_id"])},
+            {"$setOnInsert": {"status": STATUS_READY, "updated_at": now, "seeded": True}},
+            upsert=True
+        )
+        seeded += result.upserted_id is not None
+    return seeded
+
+
+def prewarm(user_ids, timeout):
+    """
+    Ingest handbooks for many users ahead of peak periods and wait for them.
+    """
+    for user_id in user_ids:
+        start_handbook_ingestion(user_id)
+    counts = {}
+    for user_id in user_ids:
+        status = wait_for_handbooks(user_id, timeout)
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+if __name__ == "__main__":
+    # python -m utils.uploads seed
+    # python -m utils.uploads prewarm --all
+    # python -m utils.uploads prewarm <user_id> [<user_id> ...]
+    parser = argparse.ArgumentParser(description="Pre-warm per-user handbook sessions in bulk.")
+    parser.add_argument("command", choices=["seed", "prewarm"])
+    parser.add_argument("user_ids", nargs="*", help="user ids to pre-warm")
+    parser.add_argument("--all", action="store_true", help="pre-warm every user in Users.user without a ready session")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for each session")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "seed" or args.all:
+        print(f"seeded {seed_existing_sessions()} sessions of existing students as ready")
+    if args.command == "seed":
+        sys.exit(0)
+    user_ids = list(args.user_ids)
+    if args.all:
+        ready = {doc["session_id"] for doc in get_collection("handbooks", "sessions").find({"status": STATUS_READY}, {"session_id": 1})}
+        user_ids += [doc["user_id"] for doc in get_collection("Users", "user").find({}, {"user_id": 1})
+                     if get_session_id(doc["user_id"]) not in ready]
+    if not user_ids:
+        print("nothing to pre-warm")
+        sys.exit(0)
+    print(f"pre-warming {len(user_ids)} sessions: {prewarm(user_ids, args.timeout)}")